@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Times the gene and results stages of grase.py on synthetic data sets (see synthetic.py) and stores the timings as
+JSON, so that runs of different commits can be compared on the same machine.
+
+	python3 benchmarks/bench_grase.py run --genes 100 1000 10000 60000
+	python3 benchmarks/bench_grase.py compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+For every number of genes and splicing software, run records:
+	- per-gene timings of read_gene_inputs, get_gene_files, build_splicing_graph, map_DEXSeq_from_gff, each mapper,
+	  style_and_plot and flush_gene on a sample of genes, run one gene at a time in this process
+	- the whole gene stage (map_genes, using --nthread workers) and get_grase_results
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import grase
+import synthetic
+
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+RMATS_MAPPERS = [("A3SS", grase.map_rMATS_event_overhang), ("A5SS", grase.map_rMATS_event_overhang),
+				 ("SE", grase.map_rMATS_event_full_fragment), ("RI", grase.map_rMATS_event_full_fragment)]
+
+
+
+def git_commit():
+	"""
+	:return: the short commit hash of the grase.py checkout, with -dirty appended if it has uncommitted changes
+	"""
+	repo = os.path.dirname(BENCHMARK_DIR)
+	try:
+		commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo, capture_output=True, text=True, check=True).stdout.strip()
+		dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo, capture_output=True, text=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown"
+	return commit + "-dirty" if dirty else commit
+
+
+
+def plotting_available():
+	return importlib.util.find_spec("cairo") is not None or importlib.util.find_spec("cairocffi") is not None
+
+
+
+def peak_rss_mb():
+	"""
+	:return: peak resident set size of this process and of its finished children, in MB
+	"""
+	return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+			"children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+
+def set_grase_args(grase_dir, data_dir, software, nthread):
+	"""
+	Sets grase.args as if grase.py was run on the synthetic data set.
+	"""
+	argv = ["grase.py", "-g", os.path.join(grase_dir, "gene_files"), "-s", software, "--dexseq", os.path.join(data_dir, "dexseq_results.txt"),
+			"--nthread", str(nthread)]
+	if software == 'r':
+		argv += ["--rmats", os.path.join(data_dir, "rmats")]
+	else:
+		argv += ["--majiq", os.path.join(data_dir, "majiq")]
+	saved_argv = sys.argv
+	sys.argv = argv
+	try:
+		grase.args = grase.get_args()
+	finally:
+		sys.argv = saved_argv
+
+
+
+class StageTimer:
+	"""
+	Sums the wall time of named stages over a number of genes.
+	"""
+
+	def __init__(self):
+		self.totals = {}
+		self.counts = {}
+
+	def time(self, stage, func, *func_args):
+		start = time.perf_counter()
+		result = func(*func_args)
+		self.totals[stage] = self.totals.get(stage, 0.0) + time.perf_counter() - start
+		self.counts[stage] = self.counts.get(stage, 0) + 1
+		return result
+
+	def results(self):
+		return {stage: {"seconds": total, "genes": self.counts[stage], "ms_per_gene": 1000 * total / self.counts[stage]}
+				for stage, total in self.totals.items()}
+
+
+
+def time_gene_functions(genes, software, scratch_dir, plots):
+	"""
+	Maps genes one at a time, timing each step of process_gene separately. Combined files are written to
+	scratch_dir/results/tmp so they do not mix with the ones of the gene stage.
+	"""
+	timer = StageTimer()
+	for gene in genes:
+		inputs = timer.time("read_gene_inputs", grase.read_gene_inputs, gene)
+		gene_path = os.path.join(grase.args.gene_files_directory, gene)
+		g, gff, events = timer.time("get_gene_files", grase.parse_gene_inputs, *grase.split_gene_inputs(inputs))
+		if gene + ".gtf" in inputs:
+			timer.time("build_splicing_graph", grase.build_splicing_graph, gene, inputs[gene + ".gtf"])
+		g = timer.time("map_DEXSeq_from_gff", grase.map_DEXSeq_from_gff, g, gff)
+		if software == 'r':
+			g.es["events"] = 0
+			g["mapper"] = "rmats"
+			for event_type, mapper in RMATS_MAPPERS:
+				if events[event_type]:
+					g = timer.time(f"{mapper.__name__}.{event_type}", mapper, g, events[event_type], event_type, gff)
+		else:
+			g = timer.time("map_majiq", grase.map_majiq, g, gff, events)
+		result = grase.MappingResult.collect(True, g)
+		timer.time("style_and_plot" if plots else "style_and_plot (no png)", grase.style_and_plot, g, gene_path)
+		timer.time("flush_gene", grase.flush_gene, gene_path, scratch_dir, result)
+	return timer.results()
+
+
+
+def bench_scale(num_genes, software, args, work_dir):
+	"""
+	Generates num_genes synthetic genes and times the gene and results stages on them.
+	:return: dict of timings
+	"""
+	data_dir = os.path.join(work_dir, f"{software}_{num_genes}")
+	shutil.rmtree(data_dir, ignore_errors=True)
+	record = {"genes": num_genes, "software": software, "stages": {}}
+
+	start = time.perf_counter()
+	grase_dir = synthetic.generate(data_dir, num_genes, software, args.seed)[software]
+	record["generate_seconds"] = time.perf_counter() - start
+
+	set_grase_args(grase_dir, data_dir, software, args.nthread)
+	genes = grase.list_genes()
+	sample = []
+	for gene in genes:
+		if len(sample) == args.sample:
+			break
+		graph, gff, events = grase.split_gene_inputs(grase.read_gene_inputs(gene))
+		if grase.has_mappable_events(graph, events):
+			sample.append(gene)
+	scratch_dir = os.path.join(data_dir, "scratch")
+	os.makedirs(os.path.join(scratch_dir, "results", "tmp"))
+	grase.init_combined_files(scratch_dir)
+	record["gene_functions"] = time_gene_functions(sample, software, scratch_dir, args.plots)
+
+	start = time.perf_counter()
+	num_skipped = grase.map_genes(genes)
+	grase.pack_gene_outputs(grase_dir)
+	record["stages"]["map_genes"] = {"seconds": time.perf_counter() - start, "nthread": grase.args.nthread, "skipped": num_skipped}
+
+	start = time.perf_counter()
+	grase.get_grase_results(grase.RESULTS_ADAPTERS[software])
+	record["stages"]["get_grase_results"] = {"seconds": time.perf_counter() - start}
+
+	record["peak_rss_mb"] = peak_rss_mb()
+	if not args.keep:
+		shutil.rmtree(data_dir, ignore_errors=True)
+	return record
+
+
+
+def run_main(argv):
+	parser = argparse.ArgumentParser(prog="bench_grase.py run", description="Times grase.py on synthetic data sets")
+	parser.add_argument('--genes', dest='genes', type=int, nargs='+', default=[100, 1000, 10000, 60000],
+						help='Numbers of genes to benchmark. Default: %(default)s')
+	parser.add_argument('-s', dest='software', default='rm', choices=['r', 'm', 'rm'],
+						help='Splicing software to benchmark. Default: %(default)s')
+	parser.add_argument('--sample', dest='sample', type=int, default=200,
+						help='Number of genes the individual gene functions are timed on. Default: %(default)s')
+	parser.add_argument('--nthread', dest='nthread', type=int, default=os.cpu_count(),
+						help='Number of workers of the gene stage. Default: %(default)s')
+	parser.add_argument('--seed', dest='seed', type=int, default=1, help='Random seed of the data sets. Default: %(default)s')
+	parser.add_argument('--workdir', dest='workdir', help='Directory for the data sets. Default: a temporary directory')
+	parser.add_argument('--keep', dest='keep', action='store_true', help='Keep the data sets and outputs')
+	parser.add_argument('-o', dest='output', help='Output JSON. Default: benchmarks/results/<commit>.json')
+	args = parser.parse_args(argv)
+
+	args.plots = plotting_available()
+	if not args.plots:
+		# without cairo, igraph cannot render the pngs; style_and_plot is still timed up to the rendering
+		print("pycairo is not installed, style_and_plot is timed without writing the png", file=sys.stderr)
+		grase.save_gene_plot = lambda g, gene, name, layout, visual_style: None
+
+	commit = git_commit()
+	output = args.output or os.path.join(RESULTS_DIR, commit + ".json")
+	work_dir = args.workdir or tempfile.mkdtemp(prefix="grase_bench_")
+	os.makedirs(work_dir, exist_ok=True)
+
+	report = {"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+			  "machine": {"platform": platform.platform(), "cpus": os.cpu_count()}, "plots": args.plots,
+			  "sample": args.sample, "seed": args.seed, "runs": []}
+	try:
+		for num_genes in args.genes:
+			for software in args.software:
+				print(f"{software}: {num_genes} genes", file=sys.stderr)
+				report["runs"].append(bench_scale(num_genes, software, args, work_dir))
+	finally:
+		if not args.workdir and not args.keep:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+	os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+	with open(output, "w") as f:
+		json.dump(report, f, indent=1)
+	print(output)
+
+
+
+def flatten(report):
+	"""
+	:return: dict {(software, genes, stage): seconds}, using ms per gene for the per-gene functions
+	"""
+	timings = {}
+	for run in report["runs"]:
+		for stage, timing in run["stages"].items():
+			timings[(run["software"], run["genes"], stage)] = timing["seconds"]
+		for stage, timing in run["gene_functions"].items():
+			timings[(run["software"], run["genes"], stage + " (ms/gene)")] = timing["ms_per_gene"]
+	return timings
+
+
+
+def compare_main(argv):
+	parser = argparse.ArgumentParser(prog="bench_grase.py compare", description="Compares two benchmark JSON files")
+	parser.add_argument('old', help='Benchmark JSON of the baseline')
+	parser.add_argument('new', help='Benchmark JSON to compare with the baseline')
+	parser.add_argument('--threshold', dest='threshold', type=float, default=0.10,
+						help='Relative slowdown reported as a regression. Default: %(default)s')
+	args = parser.parse_args(argv)
+
+	with open(args.old) as f:
+		old = json.load(f)
+	with open(args.new) as f:
+		new = json.load(f)
+	old_timings = flatten(old)
+	new_timings = flatten(new)
+
+	print(f"{old['commit']} -> {new['commit']}")
+	print("software\tgenes\tstage\told\tnew\tratio")
+	regressions = 0
+	for key in sorted(old_timings.keys() & new_timings.keys()):
+		ratio = new_timings[key] / old_timings[key] if old_timings[key] else float("inf")
+		flag = ""
+		if ratio > 1 + args.threshold:
+			flag = "\tREGRESSION"
+			regressions += 1
+		print(f"{key[0]}\t{key[1]}\t{key[2]}\t{old_timings[key]:.4f}\t{new_timings[key]:.4f}\t{ratio:.2f}{flag}")
+	return 1 if regressions else 0
+
+
+
+COMMANDS = {"run": run_main, "compare": compare_main}
+
+
+
+def main():
+	if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+		sys.exit(f"usage: {sys.argv[0]} {{{','.join(COMMANDS)}}} ...")
+	sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Generates synthetic but valid GrASE inputs at a configurable number of genes:
+	- splicing graphs in the graphml shape written by SplicingGraphs.igraph.R
+	- non-aggregated DEXSeq gffs, gtfs and DEXSeq results
+	- rMATS fromGTF.*.txt and *.MATS.JCEC.txt files
+	- a MAJIQ deltapsi.tsv
+laid out the way creatingFilesByGene.sh leaves them (grase_results_<software>/gene_files/<gene>/...).
+
+Every gene has a skipped exon, a shifted start and a shifted end of an inner exon (A3SS/A5SS depending on strand) and
+a retained intron. A fraction of the genes have no rMATS events and a fraction have only novel MAJIQ LSVs, so the
+paths that skip mapping are exercised as well.
+"""
+import argparse
+import os
+import random
+
+
+RMATS_HEADERS = {
+	"SE": "ID\tGeneID\tgeneSymbol\tchr\tstrand\texonStart_0base\texonEnd\tupstreamES\tupstreamEE\tdownstreamES\tdownstreamEE",
+	"RI": "ID\tGeneID\tgeneSymbol\tchr\tstrand\triExonStart_0base\triExonEnd\tupstreamES\tupstreamEE\tdownstreamES\tdownstreamEE",
+	"A3SS": "ID\tGeneID\tgeneSymbol\tchr\tstrand\tlongExonStart_0base\tlongExonEnd\tshortES\tshortEE\tflankingES\tflankingEE",
+	"A5SS": "ID\tGeneID\tgeneSymbol\tchr\tstrand\tlongExonStart_0base\tlongExonEnd\tshortES\tshortEE\tflankingES\tflankingEE",
+}
+MATS_HEADER = "ID\tIJC_SAMPLE_1\tSJC_SAMPLE_1\tIJC_SAMPLE_2\tSJC_SAMPLE_2\tIncFormLen\tSkipFormLen\tPValue\tFDR\tIncLevel1\tIncLevel2\tIncLevelDifference"
+MAJIQ_HEADER = ["Gene ID", "LSV ID", "LSV Type", "E(dPSI) per LSV junction", "P(|dPSI|>=0.20) per LSV junction",
+				"P(|dPSI|<=0.05) per LSV junction", "ctrl E(PSI)", "case E(PSI)", "A5SS", "A3SS", "ES", "Num. Junctions",
+				"Num. Exons", "Junctions coords", "IR coords"]
+DEXSEQ_HEADER = "groupID\tfeatureID\texonBaseMean\tdispersion\tstat\tpvalue\tpadj"
+GRAPHML_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">
+<!-- Created by igraph -->
+  <key id="v_name" for="node" attr.name="name" attr.type="string"/>
+  <key id="e_start" for="edge" attr.name="start" attr.type="double"/>
+  <key id="e_end" for="edge" attr.name="end" attr.type="double"/>
+  <key id="e_width" for="edge" attr.name="width" attr.type="double"/>
+  <key id="e_ex_or_in" for="edge" attr.name="ex_or_in" attr.type="string"/>"""
+
+
+
+def make_gene(rng, num):
+	"""
+	Builds one gene: a reference transcript and one transcript per alternative event.
+	:param rng: random.Random
+	:param num: gene number, used for the gene id and its position
+	:return: dict with gene, chrom, strand, exons (of the reference transcript), transcripts and events
+	"""
+	gene = "ENSG%011d.1" % num
+	strand = rng.choice("+-")
+	pos = 10000 + num * 100000
+	exons = []
+	for i in range(rng.randint(4, 9)):
+		length = rng.randint(60, 200)
+		exons.append((pos, pos + length - 1))
+		pos += length + rng.randint(200, 800)
+	n = len(exons)
+
+	transcripts = {"T%d_1" % num: list(exons)}
+	events = {}
+
+	skipped = rng.randint(1, n - 2)
+	transcripts["T%d_2" % num] = [e for i, e in enumerate(exons) if i != skipped]
+	events["SE"] = skipped
+
+	start_shifted = rng.randint(1, n - 2)
+	start_shift = rng.randint(10, 40)
+	transcripts["T%d_3" % num] = [(e[0] + start_shift, e[1]) if i == start_shifted else e for i, e in enumerate(exons)]
+	events["start_shift"] = (start_shifted, start_shift)
+
+	end_shifted = rng.randint(1, n - 2)
+	end_shift = rng.randint(10, 40)
+	transcripts["T%d_4" % num] = [(e[0], e[1] - end_shift) if i == end_shifted else e for i, e in enumerate(exons)]
+	events["end_shift"] = (end_shifted, end_shift)
+
+	retained = rng.randint(0, n - 2)
+	transcripts["T%d_5" % num] = sorted([e for i, e in enumerate(exons) if i not in (retained, retained + 1)] +
+										[(exons[retained][0], exons[retained + 1][1])])
+	events["RI"] = retained
+
+	return {"gene": gene, "chrom": "chr%d" % (num % 3 + 1), "strand": strand, "exons": exons,
+			"transcripts": transcripts, "events": events}
+
+
+
+def graph_edges(gene):
+	"""
+	:return: dict {(from, to, ex_or_in, start, end): [transcripts]} of the exon and intron edges of the splicing graph
+	"""
+	edges = {}
+	plus = gene["strand"] == '+'
+	for tx, exons in gene["transcripts"].items():
+		for i, (start, end) in enumerate(exons):
+			key = (start, end + 1, "ex", start, end) if plus else (end + 1, start, "ex", start, end)
+			edges.setdefault(key, []).append(tx)
+			if i + 1 < len(exons):
+				next_start = exons[i + 1][0]
+				if plus:
+					key = (end + 1, next_start, "in", end + 1, next_start - 1)
+				else:
+					key = (next_start, end + 1, "in", end + 1, next_start - 1)
+				edges.setdefault(key, []).append(tx)
+	return edges
+
+
+
+def graphml(gene):
+	"""
+	:return: the splicing graph of gene as graphml text, vertices named by coordinate between R and L
+	"""
+	edges = graph_edges(gene)
+	coords = sorted({e[0] for e in edges} | {e[1] for e in edges}, reverse=gene["strand"] == '-')
+	names = ['R'] + [str(c) for c in coords] + ['L']
+	index = {name: i for i, name in enumerate(names)}
+	transcripts = sorted(gene["transcripts"])
+
+	out = [GRAPHML_HEADER]
+	for tx in transcripts:
+		out.append('  <key id="e_%s" for="edge" attr.name="%s" attr.type="boolean"/>' % (tx, tx))
+	out.append('  <graph id="G" edgedefault="directed">')
+	for name in names:
+		out.append('    <node id="n%d">\n      <data key="v_name">%s</data>\n    </node>' % (index[name], name))
+
+	sources = set()
+	targets = set()
+	for edge in sorted(edges, key=lambda e: (index[str(e[0])], index[str(e[1])])):
+		source, target, ex_or_in, start, end = edge
+		sources.add(str(source))
+		targets.add(str(target))
+		out.append('    <edge source="n%d" target="n%d">' % (index[str(source)], index[str(target)]))
+		# like SG2igraph, the start and end of the edges of - strand genes are swapped
+		out.append('      <data key="e_start">%d</data>' % (start if gene["strand"] == '+' else end))
+		out.append('      <data key="e_end">%d</data>' % (end if gene["strand"] == '+' else start))
+		out.append('      <data key="e_width">%d</data>' % (end - start + 1))
+		out.append('      <data key="e_ex_or_in">%s</data>' % ex_or_in)
+		for tx in transcripts:
+			out.append('      <data key="e_%s">%s</data>' % (tx, "true" if tx in edges[edge] else "false"))
+		out.append('    </edge>')
+	# the R and L edges have NA attributes: the coordinates are left out, and the transcripts written as true
+	na_data = '      <data key="e_ex_or_in">NA</data>' + "".join('\n      <data key="e_%s">true</data>' % tx for tx in transcripts)
+	for name in names[1:-1]:
+		if name not in targets:
+			out.append('    <edge source="n0" target="n%d">\n%s\n    </edge>' % (index[name], na_data))
+	for name in names[1:-1]:
+		if name not in sources:
+			out.append('    <edge source="n%d" target="n%d">\n%s\n    </edge>' % (index[name], len(names) - 1, na_data))
+	out.append('  </graph>\n</graphml>\n')
+	return "\n".join(out)
+
+
+
+def exonic_parts(gene):
+	"""
+	:return: list of (start, end, transcripts) of the non-aggregated DEXSeq exonic parts of gene
+	"""
+	all_exons = {e for exons in gene["transcripts"].values() for e in exons}
+	bounds = sorted({start for start, end in all_exons} | {end + 1 for start, end in all_exons})
+	parts = []
+	for start, next_start in zip(bounds, bounds[1:]):
+		transcripts = sorted(tx for tx, exons in gene["transcripts"].items()
+							 if any(s <= start and next_start - 1 <= e for s, e in exons))
+		if transcripts:
+			parts.append((start, next_start - 1, transcripts))
+	return parts
+
+
+
+def dexseq_gff(gene, parts):
+	lines = ['%s\tdexseq_prepare_annotation.py\taggregate_gene\t%d\t%d\t.\t%s\t.\tgene_id "%s"'
+			 % (gene["chrom"], parts[0][0], parts[-1][1], gene["strand"], gene["gene"])]
+	for i, (start, end, transcripts) in enumerate(parts):
+		lines.append('%s\tdexseq_prepare_annotation.py\texonic_part\t%d\t%d\t.\t%s\t.\tgene_id "%s"; transcripts "%s"; exonic_part_number "%03d"'
+					 % (gene["chrom"], start, end, gene["strand"], gene["gene"], "+".join(transcripts), i + 1))
+	return "\n".join(lines) + "\n"
+
+
+
+def gtf(gene):
+	lines = []
+	for tx, exons in sorted(gene["transcripts"].items()):
+		for start, end in exons:
+			lines.append('%s\tsynthetic\texon\t%d\t%d\t.\t%s\t.\tgene_id "%s"; transcript_id "%s";'
+						 % (gene["chrom"], start, end, gene["strand"], gene["gene"], tx))
+	return "\n".join(lines) + "\n"
+
+
+
+def rmats_rows(gene, ids):
+	"""
+	:param ids: dict {event type: next rMATS ID}, advanced for every row
+	:return: dict {event type: [fromGTF rows]}
+	"""
+	exons = gene["exons"]
+	rows = {event_type: [] for event_type in RMATS_HEADERS}
+
+	def add(event_type, coords):
+		rows[event_type].append([str(ids[event_type]), '"%s"' % gene["gene"], '"SYM%s"' % gene["gene"][4:],
+								 gene["chrom"], gene["strand"]] + [str(c) for c in coords])
+		ids[event_type] += 1
+
+	k = gene["events"]["SE"]
+	add("SE", [exons[k][0] - 1, exons[k][1], exons[k - 1][0] - 1, exons[k - 1][1], exons[k + 1][0] - 1, exons[k + 1][1]])
+	k = gene["events"]["RI"]
+	add("RI", [exons[k][0] - 1, exons[k + 1][1], exons[k][0] - 1, exons[k][1], exons[k + 1][0] - 1, exons[k + 1][1]])
+	k, shift = gene["events"]["start_shift"]
+	add("A3SS" if gene["strand"] == '+' else "A5SS",
+		[exons[k][0] - 1, exons[k][1], exons[k][0] + shift - 1, exons[k][1], exons[k - 1][0] - 1, exons[k - 1][1]])
+	k, shift = gene["events"]["end_shift"]
+	add("A5SS" if gene["strand"] == '+' else "A3SS",
+		[exons[k][0] - 1, exons[k][1], exons[k][0] - 1, exons[k][1] - shift, exons[k + 1][0] - 1, exons[k + 1][1]])
+	return rows
+
+
+
+def majiq_rows(gene, rng):
+	"""
+	:return: list of deltapsi rows for gene, the last one being a novel LSV
+	"""
+	exons = gene["exons"]
+	rows = []
+
+	def add(lsv, lsv_type, junctions, flags, ir=""):
+		num = len(junctions.split(';')) + (1 if ir else 0)
+		stats = [";".join("%.3f" % rng.uniform(-.5, .5) for _ in range(num))]
+		stats += [";".join("%.3f" % rng.random() for _ in range(num)) for _ in range(4)]
+		rows.append([gene["gene"], "%s:%s" % (gene["gene"], lsv), lsv_type] + stats + list(flags) +
+					[str(num), "2", junctions, ir])
+
+	k = gene["events"]["SE"]
+	if gene["strand"] == '+':
+		junctions = "%d-%d;%d-%d" % (exons[k - 1][1], exons[k][0], exons[k - 1][1], exons[k + 1][0])
+	else:
+		junctions = "%d-%d;%d-%d" % (exons[k - 1][1], exons[k + 1][0], exons[k][1], exons[k + 1][0])
+	add("s:%d" % exons[k][0], "s|1e1.1o1|1e2.1o1", junctions, ("False", "False", "True"))
+	k = gene["events"]["RI"]
+	add("t:%d" % exons[k][0], "t|1e1.1o1|i", "%d-%d" % (exons[k][1], exons[k + 1][0]), ("False", "False", "False"),
+		"%d-%d" % (exons[k][1] + 1, exons[k + 1][0] - 1))
+	k, shift = gene["events"]["end_shift"]
+	if gene["strand"] == '+':
+		add("s:%d" % exons[k][1], "s|1e1.1o1|1e1.2o1",
+			"%d-%d;%d-%d" % (exons[k][1] - shift, exons[k + 1][0], exons[k][1], exons[k + 1][0]), ("True", "False", "False"))
+	add("n:%d" % exons[0][0], "s|1e1.1o1|1e2.1o1",
+		"%d-%d;%d-%d" % (exons[0][1] + 3, exons[1][0], exons[0][1] + 3, exons[1][0] + 7), ("False", "True", "False"))
+	return rows
+
+
+
+def write_text(path, text):
+	with open(path, "w") as f:
+		f.write(text)
+
+
+
+def table(header, rows):
+	return header + "\n" + "".join("\t".join(row) + "\n" for row in rows)
+
+
+
+def generate(out_dir, num_genes, software="rm", seed=1, no_event_fraction=0.1, novel_fraction=0.1):
+	"""
+	Writes a synthetic data set of num_genes genes to out_dir.
+	:param software: 'r', 'm' or 'rm', for which splicing software the gene_files are laid out
+	:param no_event_fraction: fraction of genes without rMATS events
+	:param novel_fraction: fraction of genes with only a novel MAJIQ LSV
+	:return: dict {software: grase output directory}
+	"""
+	rng = random.Random(seed)
+	genes = [make_gene(rng, num) for num in range(num_genes)]
+
+	grase_dirs = {sw: os.path.join(out_dir, "grase_results_" + sw) for sw in software}
+	for path in [os.path.join(out_dir, "rmats"), os.path.join(out_dir, "majiq", "majiq_delta_psi")] + \
+				[os.path.join(d, sub) for d in grase_dirs.values() for sub in ("gene_files", "results/tmp", "results/SplicingEvents", "results/ExonParts")]:
+		os.makedirs(path, exist_ok=True)
+
+	ids = {event_type: 0 for event_type in RMATS_HEADERS}
+	all_rmats = {event_type: [] for event_type in RMATS_HEADERS}
+	all_majiq = []
+	dexseq = [DEXSEQ_HEADER]
+	with open(os.path.join(out_dir, "annotation.dexseq.gff"), "w") as all_gff, open(os.path.join(out_dir, "annotation.gtf"), "w") as all_gtf:
+		for gene in genes:
+			gene_id = gene["gene"]
+			parts = exonic_parts(gene)
+			gene_graphml = graphml(gene)
+			gene_gff = dexseq_gff(gene, parts)
+			gene_gtf = gtf(gene)
+			all_gff.write(gene_gff)
+			all_gtf.write(gene_gtf)
+
+			for i in range(len(parts)):
+				if rng.random() < 0.85:
+					pvalue = rng.random() ** 2
+					padj = "NA" if rng.random() < 0.15 else "%.4g" % min(1, pvalue * 1.3)
+					dexseq.append("%s\tE%03d\t100\t0.1\t1.2\t%.4g\t%s" % (gene_id, i + 1, pvalue, padj))
+
+			rmats = rmats_rows(gene, ids)
+			if rng.random() < no_event_fraction:
+				rmats = {event_type: [] for event_type in RMATS_HEADERS}
+			for event_type in RMATS_HEADERS:
+				all_rmats[event_type] += rmats[event_type]
+			majiq = majiq_rows(gene, rng)
+			if rng.random() < novel_fraction:
+				majiq = majiq[-1:]
+			all_majiq += majiq
+
+			for sw, grase_dir in grase_dirs.items():
+				gene_dir = os.path.join(grase_dir, "gene_files", gene_id)
+				os.makedirs(os.path.join(gene_dir, "output"), exist_ok=True)
+				write_text(os.path.join(gene_dir, gene_id + ".graphml"), gene_graphml)
+				write_text(os.path.join(gene_dir, gene_id + ".dexseq.gff"), gene_gff)
+				write_text(os.path.join(gene_dir, gene_id + ".gtf"), gene_gtf)
+				if sw == 'r':
+					for event_type, header in RMATS_HEADERS.items():
+						write_text(os.path.join(gene_dir, "fromGTF.%s.txt" % event_type), table(header, rmats[event_type]))
+				else:
+					write_text(os.path.join(gene_dir, gene_id + ".deltapsi.tsv"), table("\t".join(MAJIQ_HEADER), majiq))
+
+	for event_type, header in RMATS_HEADERS.items():
+		write_text(os.path.join(out_dir, "rmats", "fromGTF.%s.txt" % event_type), table(header, all_rmats[event_type]))
+		mats = []
+		for row in all_rmats[event_type]:
+			if rng.random() < 0.8:
+				pvalue = rng.random() ** 2
+				mats.append(row + [row[0], "10", "5", "8", "7", "150", "99", "%.4g" % pvalue, "%.4g" % min(1, pvalue * 1.5),
+								   "0.5,0.6", "0.4,0.3", "0.2"])
+		write_text(os.path.join(out_dir, "rmats", "%s.MATS.JCEC.txt" % event_type), table(header + "\t" + MATS_HEADER, mats))
+	write_text(os.path.join(out_dir, "majiq", "majiq_delta_psi", "ctrl-case.deltapsi.tsv"), table("\t".join(MAJIQ_HEADER), all_majiq))
+	write_text(os.path.join(out_dir, "dexseq_results.txt"), "\n".join(dexseq) + "\n")
+
+	return grase_dirs
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Writes a synthetic GrASE data set")
+	parser.add_argument('out_dir', help='Output directory')
+	parser.add_argument('-n', '--genes', dest='genes', type=int, default=100, help='Number of genes. Default: %(default)s')
+	parser.add_argument('-s', dest='software', default='rm', choices=['r', 'm', 'rm'],
+						help='Splicing software to lay out gene_files for. Default: %(default)s')
+	parser.add_argument('--seed', dest='seed', type=int, default=1, help='Random seed. Default: %(default)s')
+	args = parser.parse_args()
+	generate(args.out_dir, args.genes, args.software, args.seed)
+
+
+
+if __name__ == "__main__":
+	main()
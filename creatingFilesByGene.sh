@@ -1,7 +1,7 @@
 #!/bin/bash
 
 print_usage(){
-    echo "Usage: bash creatingFilesByGene.sh [-r] [-m] [-s /splicing_software_directory] [-a annotation.gtf] [-d dexseq_prepare_annotation.py]  [-g /graphml_directory] [-p num_threads]"
+    echo "Usage: bash creatingFilesByGene.sh [-r] [-m] [-s /splicing_software_directory] [-a annotation.gtf] [-d dexseq_prepare_annotation.py] [-g /graphml_directory] [-p num_threads] [-b] [-w]"
 }
 
 if [[ $# -lt 8 ]]; then
@@ -11,8 +11,10 @@ fi
 
 rmats=0
 majiq=0
+bundle=0
+genome_wide=0
 
-while getopts "rms:d:g:a:p:" arg; do
+while getopts "rms:d:g:a:p:bw" arg; do
         case "$arg" in
                 r ) rmats=1;;
 		m ) majiq=1;;
@@ -21,12 +23,13 @@ while getopts "rms:d:g:a:p:" arg; do
                 d ) prep_annotation="$OPTARG";;
                 g ) graphml="$OPTARG";;
 		p ) procs="$OPTARG";;
+		b ) bundle=1;;
+		w ) genome_wide=1;;
         esac
 done
 
 rm -r grase_results
 mkdir grase_results
-mkdir -p grase_results/gene_files
 mkdir -p grase_results/tmp
 mkdir grase_results/results
 mkdir -p grase_results/results/tmp
@@ -52,12 +55,32 @@ then
         sed -i '/^$/d' grase_results/tmp/all_genes.txt
 fi
 
-echo -e "\nCreating grase_results directory and populating gene_files directory (inside grase_results)..."
+if [[ $bundle == 1 ]]
+then
+	# with -b, every gene job makes its genes in its own scratch directory and hands it to a single grase.py pack
+	# through a fifo; pack appends the genes to gene_files.grase and removes the directory, so the per-gene tree is
+	# never made as a whole. The fifo stays open as long as a gene job holds it, so pack ends with the last job.
+	echo -e "\nCreating grase_results directory and packing the gene files into grase_results/gene_files.grase..."
+	scratch=$(mktemp -d)
+	mkfifo grase_results/tmp/gene_files.fifo
+	python3 "$(dirname "$0")/grase.py" pack - grase_results/gene_files.grase --remove < grase_results/tmp/gene_files.fifo &
+	packer=$!
+	exec 3> grase_results/tmp/gene_files.fifo
+else
+	echo -e "\nCreating grase_results directory and populating gene_files directory (inside grase_results)..."
+	mkdir -p grase_results/gene_files
+	gene_files=grase_results/gene_files
+fi
 
 cat grase_results/tmp/all_genes.txt | while read line; do
 
 	(
 
+	if [[ $bundle == 1 ]]
+	then
+		gene_files=$(mktemp -d -p "$scratch")
+	fi
+
 	if [[ $rmats == 1 ]]
 	then
 
@@ -69,71 +92,83 @@ cat grase_results/tmp/all_genes.txt | while read line; do
 			do 
 				gene_part=$(echo $line | cut -d+ -f$c) 
 		
-				mkdir grase_results/gene_files/$gene_part
+				mkdir $gene_files/$gene_part
 			
 				#echo -e "A3SS events:"
-				grep -w GeneID $splicing_dir/fromGTF.A3SS.txt > grase_results/gene_files/$gene_part/fromGTF.A3SS.txt
-				grep -w $gene_part $splicing_dir/fromGTF.A3SS.txt >> grase_results/gene_files/$gene_part/fromGTF.A3SS.txt
+				grep -w GeneID $splicing_dir/fromGTF.A3SS.txt > $gene_files/$gene_part/fromGTF.A3SS.txt
+				grep -w $gene_part $splicing_dir/fromGTF.A3SS.txt >> $gene_files/$gene_part/fromGTF.A3SS.txt
 			
 				#echo -e "\nA5SS events:"
-				grep -w GeneID $splicing_dir/fromGTF.A5SS.txt > grase_results/gene_files/$gene_part/fromGTF.A5SS.txt
-				grep -w $gene_part $splicing_dir/fromGTF.A5SS.txt >> grase_results/gene_files/$gene_part/fromGTF.A5SS.txt
+				grep -w GeneID $splicing_dir/fromGTF.A5SS.txt > $gene_files/$gene_part/fromGTF.A5SS.txt
+				grep -w $gene_part $splicing_dir/fromGTF.A5SS.txt >> $gene_files/$gene_part/fromGTF.A5SS.txt
 				
 				#echo -e "\nSE events:"
-				grep -w GeneID $splicing_dir/fromGTF.SE.txt > grase_results/gene_files/$gene_part/fromGTF.SE.txt
-				grep -w $gene_part $splicing_dir/fromGTF.SE.txt >> grase_results/gene_files/$gene_part/fromGTF.SE.txt
+				grep -w GeneID $splicing_dir/fromGTF.SE.txt > $gene_files/$gene_part/fromGTF.SE.txt
+				grep -w $gene_part $splicing_dir/fromGTF.SE.txt >> $gene_files/$gene_part/fromGTF.SE.txt
 	
        		 		#echo -e "\nRI events:"
-				grep -w GeneID $splicing_dir/fromGTF.RI.txt > grase_results/gene_files/$gene_part/fromGTF.RI.txt
-				grep -w $gene_part $splicing_dir/fromGTF.RI.txt >> grase_results/gene_files/$gene_part/fromGTF.RI.txt
+				grep -w GeneID $splicing_dir/fromGTF.RI.txt > $gene_files/$gene_part/fromGTF.RI.txt
+				grep -w $gene_part $splicing_dir/fromGTF.RI.txt >> $gene_files/$gene_part/fromGTF.RI.txt
 			done 
 		else
 	
-		mkdir grase_results/gene_files/$line
+		mkdir $gene_files/$line
 	
 		#echo -e "A3SS events:" 
-		grep -w GeneID $splicing_dir/fromGTF.A3SS.txt > grase_results/gene_files/$line/fromGTF.A3SS.txt
-		grep -w $line $splicing_dir/fromGTF.A3SS.txt >> grase_results/gene_files/$line/fromGTF.A3SS.txt
+		grep -w GeneID $splicing_dir/fromGTF.A3SS.txt > $gene_files/$line/fromGTF.A3SS.txt
+		grep -w $line $splicing_dir/fromGTF.A3SS.txt >> $gene_files/$line/fromGTF.A3SS.txt
 		
 		#echo -e "\nA5SS events:" 
-		grep -w GeneID $splicing_dir/fromGTF.A5SS.txt > grase_results/gene_files/$line/fromGTF.A5SS.txt
-		grep -w $line $splicing_dir/fromGTF.A5SS.txt >> grase_results/gene_files/$line/fromGTF.A5SS.txt
+		grep -w GeneID $splicing_dir/fromGTF.A5SS.txt > $gene_files/$line/fromGTF.A5SS.txt
+		grep -w $line $splicing_dir/fromGTF.A5SS.txt >> $gene_files/$line/fromGTF.A5SS.txt
 	
 		#echo -e "\nSE events:"
-		grep -w GeneID $splicing_dir/fromGTF.SE.txt > grase_results/gene_files/$line/fromGTF.SE.txt	
-		grep -w $line $splicing_dir/fromGTF.SE.txt >> grase_results/gene_files/$line/fromGTF.SE.txt
+		grep -w GeneID $splicing_dir/fromGTF.SE.txt > $gene_files/$line/fromGTF.SE.txt	
+		grep -w $line $splicing_dir/fromGTF.SE.txt >> $gene_files/$line/fromGTF.SE.txt
 
 		#echo -e "\nRI events:"
-		grep -w GeneID $splicing_dir/fromGTF.RI.txt > grase_results/gene_files/$line/fromGTF.RI.txt
-        	grep -w $line $splicing_dir/fromGTF.RI.txt >> grase_results/gene_files/$line/fromGTF.RI.txt
+		grep -w GeneID $splicing_dir/fromGTF.RI.txt > $gene_files/$line/fromGTF.RI.txt
+        	grep -w $line $splicing_dir/fromGTF.RI.txt >> $gene_files/$line/fromGTF.RI.txt
 
 		fi
 	fi
 
 	if [[ $majiq = 1 ]]
 	then
-		mkdir grase_results/gene_files/$line
-		grep -w 'Gene ID' $splicing_dir/majiq_delta_psi/*.deltapsi.tsv > grase_results/gene_files/$line/$line.deltapsi.tsv
-		grep -w $line $splicing_dir/majiq_delta_psi/*.deltapsi.tsv >> grase_results/gene_files/$line/$line.deltapsi.tsv
-		awk '{if (($9 == "True" && $10 == "False" && $11 == "False" && $3 !~ /i/) || ($9 == "False" && $10 == "True" && $11 == "False" && $3 !~ /i/) || ($9 == "False" && $10 == "False" && $11 == "True" && $3 !~ /i/) || ($9 == "False" && $10 == "False" && $11 == "False") || ($1 == "Gene")) print }' grase_results/gene_files/$line/$line.deltapsi.tsv > grase_results/gene_files/$line/tmp.txt && mv grase_results/gene_files/$line/tmp.txt grase_results/gene_files/$line/$line.deltapsi.tsv
-		awk -F\| 'NF < 4 || NR == 1 {print}' grase_results/gene_files/$line/$line.deltapsi.tsv > grase_results/gene_files/$line/tmp.txt && mv grase_results/gene_files/$line/tmp.txt grase_results/gene_files/$line/$line.deltapsi.tsv
+		mkdir $gene_files/$line
+		grep -w 'Gene ID' $splicing_dir/majiq_delta_psi/*.deltapsi.tsv > $gene_files/$line/$line.deltapsi.tsv
+		grep -w $line $splicing_dir/majiq_delta_psi/*.deltapsi.tsv >> $gene_files/$line/$line.deltapsi.tsv
+		awk '{if (($9 == "True" && $10 == "False" && $11 == "False" && $3 !~ /i/) || ($9 == "False" && $10 == "True" && $11 == "False" && $3 !~ /i/) || ($9 == "False" && $10 == "False" && $11 == "True" && $3 !~ /i/) || ($9 == "False" && $10 == "False" && $11 == "False") || ($1 == "Gene")) print }' $gene_files/$line/$line.deltapsi.tsv > $gene_files/$line/tmp.txt && mv $gene_files/$line/tmp.txt $gene_files/$line/$line.deltapsi.tsv
+		awk -F\| 'NF < 4 || NR == 1 {print}' $gene_files/$line/$line.deltapsi.tsv > $gene_files/$line/tmp.txt && mv $gene_files/$line/tmp.txt $gene_files/$line/$line.deltapsi.tsv
 		
-		delta_psi="grase_results/gene_files/$line/$line.deltapsi.tsv"	
+		delta_psi="$gene_files/$line/$line.deltapsi.tsv"	
 		num_lines=$(wc -l < "$delta_psi")
 		if [[ $num_lines -lt 2 ]] ; then
   			#echo -e "$line does not have any binary events"
-			rm -r grase_results/gene_files/$line
+			rm -r $gene_files/$line
 			exit 0
 		fi
 	fi
 
 
-	cp $graphml/$line.graphml grase_results/gene_files/$line/	
+	# without -g, grase.py builds the graphs from the GTF (--graph-from-gtf)
+	if [[ -n $graphml ]]
+	then
+		cp $graphml/$line.graphml $gene_files/$line/
+	fi
 	
-	#echo -e "\nDexseq Data:"
-        grep -w $line $gtf > grase_results/gene_files/$line/$line.gtf
-	python3 $prep_annotation grase_results/gene_files/$line/$line.gtf grase_results/gene_files/$line/$line.dexseq.gff
-	mkdir -p grase_results/gene_files/$line/output
+	if [[ $genome_wide == 0 ]]
+	then
+		#echo -e "\nDexseq Data:"
+		grep -w $line $gtf > $gene_files/$line/$line.gtf
+		python3 $prep_annotation $gene_files/$line/$line.gtf $gene_files/$line/$line.dexseq.gff
+	fi
+	mkdir -p $gene_files/$line/output
+
+	if [[ $bundle == 1 ]]
+	then
+		echo "$gene_files" >&3
+	fi
 	
 	) &
 
@@ -142,6 +177,21 @@ cat grase_results/tmp/all_genes.txt | while read line; do
 	fi
 done
 
+if [[ $bundle == 1 ]]
+then
+	exec 3>&-
+	wait $packer || exit 1
+	rm -r "$scratch"
+fi
+wait
+
+if [[ $genome_wide == 1 ]]
+then
+	echo -e "\nCreating the genome-wide DEXSeq gff and indexing it and the GTF by gene..."
+	python3 $prep_annotation -r no $gtf grase_results/annotation.dexseq.gff
+	python3 "$(dirname "$0")/grase.py" index grase_results/annotation.dexseq.gff $gtf
+fi
+
 rm -r grase_results/tmp
 
 echo "Done!"
@@ -1,10 +1,39 @@
 import multiprocessing
+import multiprocessing.connection
 from multiprocessing import Pool
 import igraph as ig
 import numpy as np
 import pandas as pd
+import abc
 import argparse
+import collections
+import contextlib
+import cProfile
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import marshal
+import mmap
 import os
+import queue
+import re
+import signal
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socketserver
+from urllib.parse import parse_qs, urlsplit
 
 """
 Vocabulary:
@@ -16,14 +45,34 @@ Vocabulary:
 """
 
 USAGE = '''python3 %(prog)s [-g gene_files] [-s splicing_software(r or m)] ([--rmats rmats_results_directory] or [--majiq majiq_results_directory]) [--dexseq dexseq_results.txt] [--nthread nthreads]
+       or
+       python3 %(prog)s {pack,unpack,index,merge,query,serve,validate-graphs} ...
        or
        python %(prog)s -h for help'''
 
-def get_args():
+# --output-profile: which per-gene outputs are written besides the combined tables in results/tmp
+OUTPUT_PROFILES = ["minimal", "standard", "full"]
+PLOT_BACKENDS = ["png", "viewer"]
+
+
+
+def parse_shard(value):
+	"""
+	:param value: --shard value i/N, with 1 <= i <= N
+	:return: (i, N)
+	"""
+	match = re.fullmatch(r"(\d+)/(\d+)", value)
+	if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+		raise argparse.ArgumentTypeError(f"expected i/N with 1 <= i <= N, got {value!r}")
+	return int(match.group(1)), int(match.group(2))
+
+
+
+def get_args(argv=None):
 	parser = argparse.ArgumentParser(usage=USAGE)
 
 	parser.add_argument('-g', action='store', dest='gene_files_directory', required=True,
-	                    help='Required. The gene_files directory created by the first step (creating_files_by_gene.sh)')
+	                    help='Required. The gene_files directory created by the first step (creating_files_by_gene.sh), or the gene bundle (gene_files' + BUNDLE_SUFFIX + ') created with its -b option')
 	parser.add_argument('-s', action='store', dest='splicing_software', required=True, choices=['r', 'm'],
 						help='Required. The splicing software chosen to use for GrASE analysis (rMATS or MAJIQ)')
 	parser.add_argument('--rmats', action='store', dest='rmats_directory', required=False,
@@ -32,12 +81,56 @@ def get_args():
 						help='Optional depending on splicing software choice. The majiq output directory')
 	parser.add_argument('--dexseq', action='store', dest='dexseq_results', required=True,
 	                    help='Required. The dexseq results file in .txt or .csv format (tab separated)')
+	parser.add_argument('--gff', action='store', dest='gff', required=False,
+	                    help='Optional. A genome-wide, non-aggregated DEXSeq gff. Each gene\'s exonic parts are read from it through a byte-offset index instead of from per-gene .dexseq.gff files')
+	parser.add_argument('--gtf', action='store', dest='gtf', required=False,
+	                    help='Optional. The genome-wide GTF. Each gene\'s records are read from it through a byte-offset index instead of from per-gene .gtf files')
 	parser.add_argument('--nthread', action='store', dest='nthread', default=1, type=int, required=False,
 	                    help='Optional. The number of threads. The optimal number of threads should be equal to the number of CPU cores. Default: %(default)s')
+	parser.add_argument('--prefetch', action='store', dest='prefetch', default=8, type=int, required=False,
+	                    help='Optional. The number of genes whose input files are read ahead while other genes are being mapped. Default: %(default)s')
+	parser.add_argument('--profile', action='store_true', dest='profile', required=False,
+	                    help='Optional. Record wall time, CPU time and peak RSS of every stage of every gene and of the results steps in results/' + PROFILE_DIR)
+	parser.add_argument('--profile-top', action='store', dest='profile_top', default=20, type=int, required=False,
+	                    help='Optional. With --profile, the number of slowest genes listed in slowest_genes.txt. Default: %(default)s')
+	parser.add_argument('--profile-cprofile', action='store', dest='profile_cprofile', default=0, type=int, required=False,
+	                    help='Optional. With --profile, run every gene under cProfile and keep the stats of this many slowest genes. Default: %(default)s')
+	parser.add_argument('--gene-timeout', action='store', dest='gene_timeout', default=600, type=float, required=False,
+	                    help='Optional. Seconds a gene may take before it is failed (and retried once with a new worker). 0 disables the timeout. Default: %(default)s')
+	parser.add_argument('--allow-failed-genes', action='store_true', dest='allow_failed_genes', required=False,
+	                    help='Optional. Exit with status 0 when genes failed twice and were left out of the results. Without it, such a run still writes its results and failures.log, then exits with status ' + str(FAILED_GENES_STATUS))
+	parser.add_argument('--metrics', action='store', dest='metrics', required=False,
+	                    help='Optional. Prometheus text-format file (e.g. in the node exporter textfile directory) rewritten with the progress of the run every --metrics-interval seconds')
+	parser.add_argument('--status', action='store', dest='status', required=False,
+	                    help='Optional. JSON file rewritten with the progress of the run every --metrics-interval seconds')
+	parser.add_argument('--metrics-interval', action='store', dest='metrics_interval', default=15, type=float, required=False,
+	                    help='Optional. Seconds between updates of --metrics / --status. Default: %(default)s')
+	parser.add_argument('--shard', action='store', dest='shard', type=parse_shard, required=False,
+	                    help='Optional. i/N: map only the i-th of N gene shards (selected by a hash of the gene ID) into results/tmp/shard_<i>_of_<N> and skip the results. Once all N shards are done, run the merge command with the same arguments (without --shard) to combine them and process the results')
+	parser.add_argument('--io-threads', action='store', dest='io_threads', default=4, type=int, required=False,
+	                    help='Optional. The number of threads reading gene input files ahead of the mapping. Default: %(default)s')
+	parser.add_argument('--giant-gene-events', action='store', dest='giant_gene_events', default=1000, type=int, required=False,
+	                    help='Optional. With --nthread > 1, genes with more rMATS / MAJIQ events than this have their events split into chunks that are mapped by all workers in parallel. 0 disables the splitting. Default: %(default)s')
+	parser.add_argument('--output-profile', action='store', dest='output_profile', default="full", choices=OUTPUT_PROFILES, required=False,
+	                    help='Optional. The per-gene outputs written: full (results tables, graph png and annotated graphML), standard (results tables and graph png) or minimal (none, only the combined tables the results stage reads). Default: %(default)s')
+	parser.add_argument('--plot', action='store', dest='plot', default="png", choices=PLOT_BACKENDS, required=False,
+	                    help='Optional. How the gene graphs are drawn: png (a graph.<gene>.png per gene, rendered with cairo) or viewer (nothing is rendered; the styled graphs of all genes are written to results/' + GRAPH_VIEWER_DIR + '/graphs.json, which ' + GRAPH_VIEWER_DIR + '/viewer.html draws in the browser). Default: %(default)s')
+	parser.add_argument('--compress-output', action='store', dest='compress_output', choices=list(COMPRESSION_METHODS), required=False,
+	                    help='Optional. Compress the results tables in ExonParts and SplicingEvents with gzip (gz) or zstd (zst, needs the zstandard package)')
+	parser.add_argument('--compress-level', action='store', dest='compress_level', type=int, required=False,
+	                    help='Optional. Compression level of --compress-output. Default: 6 for gz, 3 for zst')
+	parser.add_argument('--graph-from-gtf', action='store_true', dest='graph_from_gtf', required=False,
+	                    help='Optional. Build each gene\'s splicing graph from its GTF records (per-gene .gtf or --gtf) instead of reading its .graphml, which SplicingGraphs.igraph.R then does not need to write. Not yet validated against graphMLs written by SplicingGraphs.igraph.R; check a run with validate-graphs first')
+	parser.add_argument('--edge-table', action='store_true', dest='edge_table', required=False,
+	                    help='Optional. Also write the vertices and edges of the annotated graphs of all genes, with integer coordinates and event flags, to results/' + EDGE_TABLE_DIR + ' as one .npz per chromosome')
+	parser.add_argument('--layout-cache', action='store', dest='layout_cache', required=False,
+	                    help='Optional. Directory of the cached graph layouts, which can be shared by runs on the same annotation. Default: ' + LAYOUT_CACHE_DIR + ' next to the gene_files')
+	parser.add_argument('--layout-cache-mb', action='store', dest='layout_cache_mb', default=256, type=float, required=False,
+	                    help='Optional. Size the layout cache is trimmed to at the end of the gene stage, dropping the least recently used layouts. 0 disables the cache. Default: %(default)s')
 	'''parser.add_argument('--task', action='store', dest='task', type=int,
 	                    help='If task is set to results, gene processing will be skipped, and only the results will be processed')'''
 
-	args = parser.parse_args()
+	args = parser.parse_args(argv)
 
 	if args.nthread > multiprocessing.cpu_count():
 		args.nthread = multiprocessing.cpu_count()
@@ -47,612 +140,2627 @@ def get_args():
 
 
 
-def get_gene_files(gene):
-	gene = os.path.join(args.gene_files_directory, gene)
-	grase_output_dir = os.path.abspath(os.path.join(args.gene_files_directory, os.pardir))
-
-	if args.splicing_software == 'r':
-		fromGTF_A3SS = fromGTF_A5SS = fromGTF_SE = fromGTF_RI = ''
-		for file in os.listdir(gene):
-			file = os.path.join(gene, file)
-			if file.endswith(".graphml"):
-				g = ig.Graph.Read_GraphML(file)
-			elif file.endswith(".dexseq.gff"):
-				gff = open(file)
-			elif file.endswith("fromGTF.SE.txt"):
-				fromGTF_SE = open(file)
-			elif file.endswith("fromGTF.RI.txt"):
-				fromGTF_RI = open(file)
-			elif file.endswith("fromGTF.A3SS.txt"):
-				fromGTF_A3SS = open(file)
-			elif file.endswith("fromGTF.A5SS.txt"):
-				fromGTF_A5SS = open(file)
-		return g, gene, gff, fromGTF_SE, fromGTF_RI, fromGTF_A3SS, fromGTF_A5SS, grase_output_dir
+# Gene bundles (.grase) pack the per-gene files of a gene_files directory, or the per-gene outputs of a run, into a
+# single file instead of one directory per gene:
+#   header  - magic, index offset and index length (BUNDLE_HEADER)
+#   records - for every gene, a length-prefixed JSON record header followed by the raw bytes of its files
+#   index   - JSON {gene: {file name: [offset, length]}} pointing at the raw bytes of every file
+# Workers write the per-gene outputs as plain record streams (.part, no header or index), which are packed into an
+# indexed bundle once all genes are processed.
+BUNDLE_SUFFIX = ".grase"
+BUNDLE_MAGIC = b"GRASEBN1"
+BUNDLE_HEADER = struct.Struct("<8sQQ")
+RECORD_HEADER = struct.Struct("<I")
+GENE_OUTPUT_BUNDLE = "gene_output" + BUNDLE_SUFFIX
 
-	elif args.splicing_software == 'm':
-		for file in os.listdir(gene):
-			file = os.path.join(gene, file)
-			if file.endswith(".graphml"):
-				g = ig.Graph.Read_GraphML(file)
-			elif file.endswith(".dexseq.gff"):
-				gff = open(file)
-			elif file.endswith(".deltapsi.tsv"):
-				delta_psi = open(file)
-		return g, gene, gff, delta_psi, grase_output_dir
+_bundles = {}
+_gene_outputs = {}
+_gene_tables = {}
+_combined_rows = {}
 
 
 
+def is_bundle(path):
+	return path.endswith(BUNDLE_SUFFIX) and os.path.isfile(path)
 
 
-def get_results_files():
-	if args.splicing_software == 'r':
-		rmats_dir = os.path.abspath(args.rmats_directory)
-		for file in os.listdir(rmats_dir):
-			file = os.path.join(rmats_dir, file)
-			if file.endswith("A3SS.MATS.JCEC.txt"):
-				A3SS_MATS = pd.read_table(file, dtype=str)
-				A3SS_MATS["ID"] = "A3SS_" + A3SS_MATS["ID"].astype(str)
-			if file.endswith("A5SS.MATS.JCEC.txt"):
-				A5SS_MATS = pd.read_table(file, dtype=str)
-				A5SS_MATS["ID"] = "A5SS_" + A5SS_MATS["ID"].astype(str)
-			if file.endswith("SE.MATS.JCEC.txt"):
-				SE_MATS = pd.read_table(file, dtype=str)
-				SE_MATS["ID"] = "SE_" + SE_MATS["ID"].astype(str)
-			if file.endswith("RI.MATS.JCEC.txt"):
-				RI_MATS = pd.read_table(file, dtype=str)
-				RI_MATS["ID"] = "RI_" + RI_MATS["ID"].astype(str)
-	elif args.splicing_software == 'm':
-		majiq_dir = os.path.abspath(args.majiq_directory)
-		for file in os.listdir(majiq_dir + '/majiq_delta_psi'):
-			file = os.path.join(majiq_dir + '/majiq_delta_psi', file)
-			if file.endswith("deltapsi.tsv"):
-				majiq_output = pd.read_table(file, dtype=str, sep='\t')
-
-
-	grase_results_dir = os.path.abspath(os.path.join(args.gene_files_directory, os.pardir))
-	output_dir = os.path.join(grase_results_dir + "/results")
-	grase_results_tmp = os.path.join(output_dir + "/tmp")
-	'''	for file in os.listdir(grase_results_tmp):
-		file = os.path.join(grase_results_tmp, file)
-		if file.endswith("tmp"):
-			grase_results = os.path.abspath(file)'''
-
-	for file in os.listdir(grase_results_tmp):
-		file = os.path.join(grase_results_tmp, file)
-
-		if file.endswith("A3SS.mapped.txt"):
-			dex_to_A3SS = dex_to_mats(file)
-		if file.endswith("A5SS.mapped.txt"):
-			dex_to_A5SS = dex_to_mats(file)
-		if file.endswith("SE.mapped.txt"):
-			dex_to_SE = dex_to_mats(file)
-		if file.endswith("RI.mapped.txt"):
-			dex_to_RI = dex_to_mats(file)
-		if file.endswith("fromGTF.A3SS.txt"):
-			A3SS_to_dex = mats_to_dex(file, "A3SS")
-		if file.endswith("fromGTF.A5SS.txt"):
-			A5SS_to_dex = mats_to_dex(file, "A5SS")
-		if file.endswith("fromGTF.SE.txt"):
-			SE_to_dex = mats_to_dex(file, "SE")
-		if file.endswith("fromGTF.RI.txt"):
-			RI_to_dex = mats_to_dex(file, "RI")
-		if file.endswith("deltapsi.mapped.tsv"):
-			majiq_to_dex = convert_majiq_to_dex(file)
-		if file.endswith("dexseq.majiq.mapped.txt"):
-			dex_to_majiq = convert_dex_to_majiq(file)
-
-	dexseqResults = pd.read_table(args.dexseq_results, dtype=str)
-	dexseqResults["padj"] = dexseqResults["padj"].astype(float)
 
-	if args.splicing_software == 'r':
-		return (output_dir, dexseqResults,
-	        A3SS_MATS, A5SS_MATS, SE_MATS, RI_MATS,
-	        dex_to_A3SS, dex_to_A5SS, dex_to_SE, dex_to_RI,
-	        A3SS_to_dex, A5SS_to_dex, SE_to_dex, RI_to_dex)
+class GeneBundle:
+	"""
+	Random access to the records of a gene bundle. The bundle is memory mapped, and the files of a gene are returned
+	as memoryviews into the map, so nothing is copied until a file is actually parsed.
+	"""
+	def __init__(self, path):
+		self.path = path
+		with open(path, "rb") as f:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, index_offset, index_length = BUNDLE_HEADER.unpack_from(self.map, 0)
+		if magic != BUNDLE_MAGIC:
+			raise ValueError(f"{path} is not a GrASE gene bundle")
+		self.index = json.loads(self.map[index_offset:index_offset + index_length])
+		self.view = memoryview(self.map)
 
-	if args.splicing_software == 'm':
-		return (output_dir, dexseqResults, majiq_output, dex_to_majiq, majiq_to_dex)
+	def genes(self):
+		return list(self.index)
 
+	def files(self, gene):
+		return {name: self.view[offset:offset + length] for name, (offset, length) in self.index[gene].items()}
 
 
-def process_gene(gene):
-	if args.splicing_software == 'r':
-		g, gene, gff, fromGTF_SE, fromGTF_RI, fromGTF_A3SS, fromGTF_A5SS, grase_output_dir = get_gene_files(gene)
-		g = map_DEXSeq_from_gff(g, gff)
-		g = map_rMATS(g, gene, gff, fromGTF_A3SS, fromGTF_A5SS, fromGTF_SE, fromGTF_RI, grase_output_dir)
-	elif args.splicing_software == 'm':
-		g, gene, gff, delta_psi, grase_output_dir = get_gene_files(gene)
-		g = map_DEXSeq_from_gff(g, gff)
-		g = map_majiq(g, gene, gff, delta_psi, grase_output_dir)
 
-	style_and_plot(g, gene)
+def open_gene_bundle(path):
+	# one mapping per process, shared by every gene the process reads
+	if path not in _bundles:
+		_bundles[path] = GeneBundle(path)
+	return _bundles[path]
 
 
 
-def map_DEXSeq_from_gff(g, gff):
+class GeneBundleWriter:
 	"""
-	Takes a gff DEXSeq output file and reads it. The function will take the coordinates of DEXSeq exon fragments
-	in order to create edges on the igraph object that map to those fragments. The fragments are labelled with
-	a "dexseq_fragment" attribute with the value of the corresponding exonic part number from the gff file (i.e. E001).
-
-	:param g: igraph object that has been imported from the graphml object read into this program
-	:param gff: DEXSeq gff file that will be used to create fragment edges on the igraph object
-	:return: igraph object after the DEXSeq edges have been added
+	Writes gene records to a bundle. With indexed=False the records are appended to a .part stream that can be
+	written to by one process at a time and packed into an indexed bundle later with pack_gene_outputs().
 	"""
-	leftCoords = []
-	rightCoords = []
-	dex_frag = []
+	def __init__(self, path, indexed=True):
+		self.indexed = indexed
+		self.index = {}
+		if indexed:
+			self.handle = open(path, "wb")
+			self.handle.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, 0, 0))
+		else:
+			self.handle = open(path, "ab")
+
+	def add(self, gene, files):
+		record_header = json.dumps({"gene": gene, "files": [[name, len(data)] for name, data in files.items()]}).encode()
+		offset = self.handle.tell() + RECORD_HEADER.size + len(record_header)
+		record = [RECORD_HEADER.pack(len(record_header)), record_header]
+		entry = self.index.setdefault(gene, {})
+		for name, data in files.items():
+			entry[name] = [offset, len(data)]
+			record.append(data)
+			offset += len(data)
+		self.handle.write(b"".join(record))
+		self.handle.flush()
+
+	def close(self):
+		if self.indexed:
+			index = json.dumps(self.index).encode()
+			index_offset = self.handle.tell()
+			self.handle.write(index)
+			self.handle.seek(0)
+			self.handle.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, index_offset, len(index)))
+		self.handle.close()
+
+
+
+def iter_bundle_records(path):
+	"""
+	Yields (gene, {file name: bytes}) for every record of a .part stream, in the order they were written.
+	"""
+	with open(path, "rb") as f:
+		while True:
+			size = f.read(RECORD_HEADER.size)
+			if len(size) < RECORD_HEADER.size:
+				break
+			record_header = json.loads(f.read(RECORD_HEADER.unpack(size)[0]))
+			yield record_header["gene"], {name: f.read(length) for name, length in record_header["files"]}
 
-	g.es["dexseq_fragment"] = ''
-	for x in gff:
-		if x.split()[2] == "aggregate_gene":
-			g["strand"] = x.split()[6]
-			g["gene"] = x.split()[-1].strip('\"')
-		if x.split()[2] == "exonic_part":
-			leftCoords.append(x.split()[3])
-			rightCoords.append(x.split()[4])
-			dex_frag.append(x.split()[-1].strip('\"'))
 
-	if g["strand"] == '-':
-		for x in range(len(rightCoords)):
-			rightCoords[x] = str(int(rightCoords[x]) + 1)
-			g.add_edges([(rightCoords[x], leftCoords[x])])
-			g.es[-1]["dexseq_fragment"] = dex_frag[x]
 
-	if g["strand"] == '+':
-		for x in range(len(rightCoords)):
-			rightCoords[x] = str(int(rightCoords[x]) + 1)
-			g.add_edges([(leftCoords[x], rightCoords[x])])
-			g.es[-1]["dexseq_fragment"] = dex_frag[x]
+def pack_gene_files(gene_files_directories, bundle_path, remove=False):
+	"""
+	Packs gene_files directories into a gene bundle, one record per gene directory. A gene found in more than one
+	directory keeps the files of all of them, as when they were written into one gene_files directory.
+	:param gene_files_directories: iterable of gene_files directories, e.g. read from a pipe while they are being made
+	:param bundle_path: the gene bundle to write
+	:param remove: remove each gene_files directory once its genes are packed
+	"""
+	writer = GeneBundleWriter(bundle_path)
+	for gene_files_directory in gene_files_directories:
+		for gene in sorted(os.listdir(gene_files_directory)):
+			gene_dir = os.path.join(gene_files_directory, gene)
+			files = {}
+			for file in sorted(os.listdir(gene_dir)):
+				path = os.path.join(gene_dir, file)
+				if os.path.isfile(path):
+					with open(path, "rb") as f:
+						files[file] = f.read()
+			writer.add(gene, files)
+		if remove:
+			shutil.rmtree(gene_files_directory)
+	# the records are in the order the directories came in, the index lists the genes sorted
+	writer.index = dict(sorted(writer.index.items()))
+	writer.close()
+
+
+
+def unpack_gene_bundle(bundle_path, output_directory, genes=None):
+	bundle = GeneBundle(bundle_path)
+	for gene in genes or bundle.genes():
+		os.makedirs(os.path.join(output_directory, gene), exist_ok=True)
+		for file, data in bundle.files(gene).items():
+			with open(os.path.join(output_directory, gene, file), "wb") as f:
+				f.write(data)
+
+
+
+def pack_gene_outputs(grase_output_dir):
+	"""
+	Packs the .part streams written by the workers into the results store, results/gene_output.grase (or the shard's
+	own gene_output.grase with --shard, see merge_shards).
+	"""
+	tmp_dir = combined_dir(grase_output_dir)
+	parts = [os.path.join(tmp_dir, file) for file in os.listdir(tmp_dir) if file.endswith(".part")]
+	if not parts:
+		return
+	writer = GeneBundleWriter((tmp_dir if args.shard else grase_output_dir + "/results") + "/" + GENE_OUTPUT_BUNDLE)
+	for part in parts:
+		for gene, files in iter_bundle_records(part):
+			writer.add(gene, files)
+		os.remove(part)
+	writer.close()
 
-	return g
 
 
+# Genome-wide annotations (the flattened DEXSeq gff and the GTF) are read through a byte-offset index,
+# {gene: [[offset, length], ...]}, saved next to the annotation as <annotation>.gidx and rebuilt whenever the
+# annotation changes.
+GENE_INDEX_SUFFIX = ".gidx"
+GENE_ID_PATTERN = re.compile(rb'gene_id "([^"]+)"')
 
-def map_majiq(g, gene, gff, delta_psi, grase_output_dir):
-	majiq_df = pd.read_csv(delta_psi, dtype=str, sep='\t')
-	dex_df = pd.read_csv(gff.name, dtype=str, header=None, skiprows=1, sep=r'\s+')
-	delta_psi.seek(0)
+_gene_indexes = {}
 
-	g.es["A3SS"] = False
-	g.es["A5SS"] = False
-	g.es["SE"] = False
-	g.es["RI"] = False
 
-	dx_ID = {}  # dictionary that maps {majiq ID: [dexseq fragments]}
-	dx_gff = {}  # dictionary that maps {dexseq fragment: [majiq IDs]}
-	ID = []  # lists ID of every line in the delta_psi
-	event = [] # lists event type for each ID
-	junc_coords = []  # lists junction / IR coordinates from delta_psi
 
-	for x in delta_psi:
-		if x.split()[0] == "Gene":
-			continue
-		dx_ID[x.split()[1]] = []
-		ID.append(x.split()[1])
-		junc_coords.append(x.split()[13])
-		if x.split()[8] == "True":
-			event.append("A5SS")
-		elif x.split()[9] == "True":
-			event.append("A3SS")
-		elif x.split()[10] == "True":
-			event.append("SE")
-		else:
-			event.append("RI")
+def build_gene_index(path):
+	"""
+	Scans a GFF / GTF once and records, for every gene_id, the byte spans of its lines. Consecutive lines of the same
+	gene are merged into a single span, so a gene whose records are contiguous has exactly one.
+	"""
+	spans = {}
+	offset = 0
+	current = None
+	with open(path, "rb") as f:
+		for line in f:
+			match = GENE_ID_PATTERN.search(line)
+			gene = match.group(1).decode() if match else None
+			if gene is not None:
+				if gene == current:
+					spans[gene][-1][1] += len(line)
+				else:
+					spans.setdefault(gene, []).append([offset, len(line)])
+			current = gene
+			offset += len(line)
+	return spans
+
+
+
+def load_gene_index(path):
+	stat = os.stat(path)
+	index_path = path + GENE_INDEX_SUFFIX
+	if os.path.isfile(index_path):
+		with open(index_path) as f:
+			index = json.load(f)
+		if index["size"] == stat.st_size and index["mtime_ns"] == stat.st_mtime_ns:
+			return index["genes"]
+
+	spans = build_gene_index(path)
+	try:
+		with open(index_path + ".tmp", "w") as f:
+			json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "genes": spans}, f)
+		os.replace(index_path + ".tmp", index_path)
+	except OSError:
+		# annotation directory is read-only, keep the index for this run only
+		pass
+	return spans
+
+
+
+class GeneSliceIndex:
+	"""
+	Memory-mapped genome-wide annotation with its per-gene byte-offset index. slice() returns a gene's lines as a
+	memoryview into the map, without copying them, whenever they are contiguous in the file.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.spans = load_gene_index(path)
+		with open(path, "rb") as f:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		self.view = memoryview(self.map)
 
-	for x in range(len(ID)):
-		junc_start = []  # lists junction start coords from delta_psi
-		junc_end = []  # lists junction end coords from delta_psi
-		next_loop = False
-		if g['strand'] == '+':
-			for junc in junc_coords[x].split(';'):
-				if len(g.vs.select(name=str(int(junc.split('-')[0]) + 1))) == 0 or len(g.vs.select(name=junc.split('-')[1])) == 0:
-					dx_ID[ID[x]] = 'novel_junc'
-					next_loop = True
-					break
-				junc_start.append(str(int(junc.split('-')[0]) + 1))
-				junc_end.append(junc.split('-')[1])
-		if g['strand'] == '-':
-			for junc in junc_coords[x].split(';'):
-				if len(g.vs.select(name=str(int(junc.split('-')[0]) + 1))) == 0 or len(g.vs.select(name=junc.split('-')[1])) == 0:
-					dx_ID[ID[x]] = 'novel_junc'
-					next_loop = True
-					break
-				junc_end.insert(0, str(int(junc.split('-')[0]) + 1))
-				junc_start.insert(0, junc.split('-')[1])
+	def genes(self):
+		return list(self.spans)
 
-		if next_loop:
-			continue
+	def slice(self, gene):
+		spans = self.spans.get(gene)
+		if spans is None:
+			return None
+		if len(spans) == 1:
+			offset, length = spans[0]
+			return self.view[offset:offset + length]
+		return b"".join(self.view[offset:offset + length] for offset, length in spans)
 
-		if len(junc_start) == 1:
-			g, dx_ID, dx_gff = map_majiq_RI(g, junc_start, junc_end, dx_ID, dx_gff, ID[x], event[x])
 
-		elif len(junc_start) == 2:
-			if junc_start[0] == junc_start[1]:
-				g, dx_ID, dx_gff = map_majiq_A3_style(g, junc_start, junc_end, dx_ID, dx_gff, ID[x], event[x])
-			elif junc_end[0] == junc_end[1]:
-				g, dx_ID, dx_gff = map_majiq_A5_style(g, junc_start, junc_end, dx_ID, dx_gff, ID[x], event[x])
 
-	for x in dx_ID:
-		if dx_ID[x] == []:
-			dx_ID[x] = 'NA'
-		elif dx_ID[x] == 'novel_junc':
-			continue
-		else:
-			dx_ID[x] = ','.join(dx_ID[x])
+def open_gene_index(path):
+	# opened once in the parent, so the workers share the mapping and the index
+	if path not in _gene_indexes:
+		_gene_indexes[path] = GeneSliceIndex(path)
+	return _gene_indexes[path]
 
-	for x in dx_gff:
-		dx_gff[x] = ','.join(dx_gff[x])
 
-	majiq_df['DexseqFragment'] = majiq_df['LSV ID'].map(dx_ID)
-	majiq_df = majiq_df[["Gene ID", "LSV ID", "DexseqFragment", "A5SS", "A3SS", "ES"]]
-	majiq_df.to_csv(gene + "/output/" + g["gene"] + ".mapped.deltapsi.tsv", sep='\t', index=False)
-	majiq_df.to_csv(grase_output_dir + "/results/tmp/combined.majiq.deltapsi.mapped.tsv", mode='a', sep='\t', index=False)
 
-	dex_df[14] = dex_df[13].map(dx_gff)
-	dex_df = dex_df[[9, 13, 14]].rename(columns={9: "GeneID", 13: "DexseqFragment", 14: "LSV_ID"})
-	dex_df["DexseqFragment"] = "E" + dex_df["DexseqFragment"].astype(str)
-	dex_df["GeneID"] = dex_df["GeneID"].str.replace(r";", "", regex=True)
-	dex_df.to_csv(gene + "/output/" + g["gene"] + ".dexseq.mapped.txt", sep='\t', index=False)
-	dex_df.to_csv(grase_output_dir + "/results/tmp/combined.dexseq.majiq.mapped.txt", mode='a', sep='\t', index=False)
+def list_genes():
+	if is_bundle(args.gene_files_directory):
+		return open_gene_bundle(args.gene_files_directory).genes()
+	return os.listdir(args.gene_files_directory)
 
-	return g
 
 
-def map_majiq_A3_style(g, junc_start, junc_end, dx_ID, dx_gff, ID, eventType):
-	for i in range(g.vs.find(junc_end[0]).index, g.vs.find(junc_end[1]).index):
-		for k in range(len(g.es.select(_within=(i, i + 1)))):
-			if g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"] != '':
-				g.es.select(_within=(i, i + 1))[k][eventType] = True
-				dx_ID[ID].append('E' + ''.join(g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]))
-				if g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"] not in dx_gff:
-					dx_gff[g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]] = []
-				dx_gff[g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]].append(eventType + "_" + ID)
-	return g, dx_ID, dx_gff
+def read_gene_inputs(gene):
+	"""
+	Returns {file name: bytes} with every input file of the gene, read either from its directory inside gene_files
+	or from the gene bundle given with -g. With --gff / --gtf, the gene's gff / gtf are the gene's slices of the
+	genome-wide annotations instead.
+	"""
+	if is_bundle(args.gene_files_directory):
+		files = open_gene_bundle(args.gene_files_directory).files(gene)
+	else:
+		files = {}
+		gene_dir = os.path.join(args.gene_files_directory, gene)
+		for file in os.listdir(gene_dir):
+			path = os.path.join(gene_dir, file)
+			if os.path.isfile(path):
+				with open(path, "rb") as f:
+					files[file] = f.read()
+	files = dict(decompress(file, data) for file, data in files.items())
+
+	for annotation, suffix in ((args.gff, ".dexseq.gff"), (args.gtf, ".gtf")):
+		if annotation:
+			for file in [file for file in files if file.endswith(suffix)]:
+				del files[file]
+			data = open_gene_index(annotation).slice(gene)
+			if data is not None:
+				files[gene + suffix] = data
+	return files
+
 
 
+# Input files may be compressed with gzip (.gz) or zstd (.zst, read with the zstandard package). The per-gene files
+# are decompressed whole when they are read, by the I/O threads that read the genes ahead; the rMATS / MAJIQ and DEXSeq
+# results tables are streamed through a BackgroundReader, which decompresses on a thread of its own while pandas parses.
+# With --compress-output, the results tables are written compressed the same way.
+COMPRESSION_METHODS = {"gz": "gzip", "zst": "zstd"}
 
-def map_majiq_A5_style(g, junc_start, junc_end, dx_ID, dx_gff, ID, eventType):
-	for i in range(g.vs.find(junc_start[0]).index, g.vs.find(junc_start[1]).index):
-		for k in range(len(g.es.select(_within=(i, i + 1)))):
-			if g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"] != '':
-				g.es.select(_within=(i, i + 1))[k][eventType] = True
-				dx_ID[ID].append('E' + ''.join(g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]))
-				if g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"] not in dx_gff:
-					dx_gff[g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]] = []
-				dx_gff[g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]].append(eventType + "_" + ID)
-	return g, dx_ID, dx_gff
 
 
-def map_majiq_RI(g, junc_start, junc_end, dx_ID, dx_gff, ID, eventType):
-	for i in range(g.vs.find(junc_start[0]).index, g.vs.find(junc_end[0]).index):
-		for k in range(len(g.es.select(_within=(i, i + 1)))):
-			if g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"] != '':
-				g.es.select(_within=(i, i + 1))[k][eventType] = True
-				dx_ID[ID].append('E' + ''.join(g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]))
-				if g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"] not in dx_gff:
-					dx_gff[g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]] = []
-				dx_gff[g.es.select(_within=(i, i + 1))[k]["dexseq_fragment"]].append(eventType + "_" + ID)
-	return g, dx_ID, dx_gff
+def strip_compression(name):
+	for suffix in COMPRESSION_METHODS:
+		if name.endswith("." + suffix):
+			return name[:-len(suffix) - 1]
+	return name
 
 
 
-def map_rMATS_event_overhang(g, fromGTF, eventType, gene, gff, grase_output_dir):
+def decompress(name, data):
 	"""
-	Takes a fromGTF.event.txt rMATS output file and reads it. This function will take the coordinates of rMATS events in
-	order to create edges on the igraph object that map those events with corresponding DEXSeq fragments. The goal is to
-	map DEXSeq fragments that should be differentially expressed when alternative splicing (AS) events occur. This
-	function specifically works with AS events that produce an overhang (A3SS and A5SS). Sometimes, an overhang may span
-	over multiple DEXSeq fragments. This function accounts for that by iterating over the indices of nodes between the
-	start and end coordinates of the rMATS event. Bifurcating paths of A3SS or A5SS events will be labelled "rmats
-	short" or "rmats long", matching the fromGTF.event.txt file. The difference between the long exon and short exon
-	will represent the overhang, and DEXSeq fragments spanning that overhang will be labelled with an edge attribute
-	matching the rMATS event. In addition, this function will take the original fromGTF.event.txt input file and append
-	a new column "DexseqFragment" that lists which DEXSeq exonic part number maps specifically to each rMATS event.
-	This modified file will be output to the output directory specified in the command line arguments.
+	:return: (name, data) of a file, without its .gz / .zst suffix and decompressed if it has one
+	"""
+	if name.endswith(".gz"):
+		return name[:-3], gzip.decompress(data)
+	if name.endswith(".zst"):
+		import zstandard
+		# every frame, as pzstd and concatenated .zst files have more than one
+		with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True) as reader:
+			return name[:-4], reader.read()
+	return name, data
 
-	:param g: igraph object that has been imported from the graphml object read into this program
-	:param fromGTF: rMATS fromGTF.event.txt file that will be used to label DEXSeq edges on the igraph object with
-					corresponding rMATS events. This will then be converted to a dataframe, and a column will be
-					appended that will map rMATS event ID to DEXSeq fragment(s)
-	:param eventType: Tracks rMATS event type (A3SS or A5SS) to label edges on the igrpah object appropriately
-	:return: igraph object after the rMATS labels have been added to the DEXSeq edges appropriately.
+
+
+class BackgroundReader(io.RawIOBase):
+	"""
+	Binary stream over a decompressing file object, which a background thread reads ahead of the consumer into a
+	bounded queue of chunks, so that decompression overlaps with parsing.
 	"""
-	rmats_df = pd.read_csv(fromGTF, dtype=str, sep='\t')
-	dex_df = pd.read_csv(gff.name, dtype=str, header=None, skiprows=1, sep=r'\s+')
-	fromGTF.seek(0)
 
-	dx_ID = {} # dictionary that maps {rMATS ID: [dexseq fragments]}
-	dx_gff = {} # dictionary that maps {dexseq fragment: [rMATS IDs]}
-	ID = [] # lists ID #s of every line in the fromGTF
-	longES = [] # lists long exon start coordinates of every line in the fromGTF
-	longEE = [] # lists long exon end coordinates of every line in the fromGTF
-	shortES = [] # lists short exon start coordinates of every line in the fromGTF
-	shortEE = [] # lists short exon end coordinates of every line in the fromGTF
+	def __init__(self, stream, chunk_size=1 << 20, depth=4):
+		super().__init__()
+		self.stream = stream
+		self.chunk_size = chunk_size
+		self.chunks = queue.Queue(depth)
+		self.chunk = memoryview(b"")
+		self.eof = False
+		self.stop = threading.Event()
+		self.thread = threading.Thread(target=self.fill, daemon=True)
+		self.thread.start()
+
+	def fill(self):
+		try:
+			while not self.stop.is_set():
+				chunk = self.stream.read(self.chunk_size)
+				while not self.stop.is_set():
+					try:
+						self.chunks.put(chunk, timeout=0.1)
+						break
+					except queue.Full:
+						pass
+				if not chunk:
+					break
+		except Exception as error:
+			self.chunks.put(error)
+		finally:
+			self.stream.close()
 
-	for x in fromGTF:
-		if x.split()[0] == "ID":
-			continue
-		dx_ID[x.split()[0]] = []
-		ID.append(x.split()[0])
-		longES.append(x.split()[5])
-		longEE.append(x.split()[6])
-		shortES.append(x.split()[7])
-		shortEE.append(x.split()[8])
+	def readable(self):
+		return True
 
-	for x in range(len(longES)):
-		# incrementing values in order to map rMATS coordinate to DEXSeq coordinates (0 index vs 1 index)
-		longES[x] = str(int(longES[x]) + 1)
-		longEE[x] = str(int(longEE[x]) + 1)
-		shortES[x] = str(int(shortES[x]) + 1)
-		shortEE[x] = str(int(shortEE[x]) + 1)
-		if eventType == "A3SS":
-			# finds the edge that spans the vertex labelled with longES coordinates to the vertex labelled with longEE coordinates
-			# ultimately labels the edge that corresponds to the rMATS long edge
-			g.es.find(_within=(g.vs.find(longES[x]).index, g.vs.find(longEE[x]).index))["rmats"] = "rmats long"
-			# finds the edge that spans the vertex labelled with shortES coordinates to the vertex labelled with shortEE coordinates
-			# ultimately labels the edge that corresponds to the rMATS short edge
-			g.es.find(_within=(g.vs.find(shortES[x]).index, g.vs.find(shortEE[x]).index))["rmats"] = "rmats short"
+	def readinto(self, buffer):
+		while not len(self.chunk) and not self.eof:
+			chunk = self.chunks.get()
+			if isinstance(chunk, Exception):
+				raise chunk
+			self.eof = not chunk
+			self.chunk = memoryview(chunk)
+		n = min(len(buffer), len(self.chunk))
+		buffer[:n] = self.chunk[:n]
+		self.chunk = self.chunk[n:]
+		return n
 
-			# cannot assume longES = shortES or longEE = shortEE since gene strandedness (+/-) affects the layout of the graph
-			if longES[x] == shortES[x]:
-				# for every adjacent pair of nodes (aka every dexseq fragment edge) from the beginning to the end of the overhang,
-				# label that edge with an eventType attribute. In addition, append the dexseq fragment label at that edge to the
-				# dx_ID dictionary {rMATS ID: [dexseq fragment list]}
-				for i in range(g.vs.find(longEE[x]).index, g.vs.find(shortEE[x]).index):
-					# since an overhang fragment cannot line up with an exon, there will only be one edge between adjacent pairs
-					# of nodes over that fragment. Find that one edge (corresponding to dexseq fragment) and label it.
-					for k in range(len(g.es.select(_within=(i, i+1)))):
-						if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] != '':
-							g.es.select(_within=(i, i+1))[k][eventType] = True
-							dx_ID[ID[x]].append('E' + ''.join(g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]))
-							if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] not in dx_gff:
-								dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]] = []
-							dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]].append(eventType + "_" + ID[x])
+	def close(self):
+		self.stop.set()
+		super().close()
 
-			# cannot assume longES = shortES or longEE = shortEE since gene strandedness (+/-) affects the layout of the graph.
-			# works exactly the same as longES[x] == shortES[x], but in reverse order
-			if longEE[x] == shortEE[x]:
-				for i in range(g.vs.find(longES[x]).index, g.vs.find(shortES[x]).index):
-					for k in range(len(g.es.select(_within=(i, i+1)))):
-						if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] != '':
-							g.es.select(_within=(i, i+1))[k][eventType] = True
-							dx_ID[ID[x]].append('E' + ''.join(g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]))
-							if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] not in dx_gff:
-								dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]] = []
-							dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]].append(eventType + "_" + ID[x])
-		if eventType == "A5SS":
-			# works exactly the same as A3SS events, but in reverse order (A5SS and A3SS are on opposite sides of the exon)
-			g.es.find(_within=(g.vs.find(longEE[x]).index, g.vs.find(longES[x]).index))["rmats"] = "rmats long"
-			g.es.find(_within=(g.vs.find(shortEE[x]).index, g.vs.find(shortES[x]).index))["rmats"] = "rmats short"
-			if longES[x] == shortES[x]:
-				for i in range(g.vs.find(shortEE[x]).index, g.vs.find(longEE[x]).index):
-					for k in range(len(g.es.select(_within=(i, i+1)))):
-						if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] != '':
-							g.es.select(_within=(i, i+1))[k][eventType] = True
-							dx_ID[ID[x]].append('E' + ''.join(g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]))
-							if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] not in dx_gff:
-								dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]] = []
-							dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]].append(eventType+ "_" + ID[x])
-			if longEE[x] == shortEE[x]:
-				for i in range(g.vs.find(shortES[x]).index, g.vs.find(longES[x]).index):
-					for k in range(len(g.es.select(_within=(i, i+1)))):
-						if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] != '':
-							g.es.select(_within=(i, i+1))[k][eventType] = True
-							dx_ID[ID[x]].append('E' + ''.join(g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]))
-							if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] not in dx_gff:
-								dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]] = []
-							dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]].append(eventType + "_" + ID[x])
 
-	for x in dx_ID:
-		dx_ID[x] = ','.join(dx_ID[x])
 
-	for x in dx_gff:
-		dx_gff[x] = ','.join(dx_gff[x])
+def open_input(path):
+	"""
+	Opens an input file for reading in binary, decompressing .gz / .zst files on a background thread.
+	"""
+	if path.endswith(".gz"):
+		stream = gzip.open(path, "rb")
+	elif path.endswith(".zst"):
+		import zstandard
+		stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+	else:
+		return open(path, "rb")
+	return io.BufferedReader(BackgroundReader(stream))
 
-	rmats_df['DexseqFragment'] = rmats_df['ID'].map(dx_ID)
-	rmats_df = rmats_df[["GeneID", "ID", "DexseqFragment"]]
-	rmats_df.to_csv(gene + "/output/fromGTF_" + g["gene"] + "." + eventType + ".txt", sep='\t', index=False)
-	rmats_df.to_csv(grase_output_dir + "/results/tmp/combined.fromGTF." + eventType + ".txt", mode='a', sep='\t', index=False)
 
-	dex_df[14] = dex_df[13].map(dx_gff)
-	dex_df = dex_df[[9, 13, 14]].rename(columns={9: "GeneID", 13: "DexseqFragment", 14: "rMATS_ID_" + eventType})
-	dex_df["DexseqFragment"] = "E" + dex_df["DexseqFragment"].astype(str)
-	dex_df["GeneID"] = dex_df["GeneID"].str.replace(r";", "", regex=True)
-	dex_df.to_csv(gene + "/output/" + g["gene"] + ".dexseq." + eventType + ".mapped.txt", sep='\t', index=False)
-	dex_df.to_csv(grase_output_dir + "/results/tmp/combined.dexseq." + eventType + ".mapped.txt", mode='a', sep='\t', index=False)
 
-	return g
+def read_table(path, **kwargs):
+	# pd.read_table of a possibly compressed file
+	with open_input(path) as f:
+		return pd.read_table(f, **kwargs)
 
 
 
-def map_rMATS_event_full_fragment(g, fromGTF, eventType, gene, gff, grase_output_dir):
+def output_compression():
 	"""
-	Takes a fromGTF.event.txt rMATS output file and reads it. This function will take the coordinates of rMATS events in
-	order to create edges on the igraph object that map those events with corresponding DEXSeq fragments. The goal is to
-	map DEXSeq fragments that should be differentially expressed when alternative splicing (AS) events occur. This
-	function specifically works with AS events that span a full exon (RI and SE). Sometimes, an exon may span over
-	multiple DEXSeq fragments. This function accounts for that by iterating over the indices of nodes between the start
-	and end coordinates of the rMATS event. DEXSeq fragments spanning the SE/RI exon will be labelled with an edge
-	attribute matching the rMATS event. In addition, this function will take the original fromGTF.event.txt input file
-	and append a new column "DexseqFragment" that lists which DEXSeq exonic part number maps specifically to each rMATS
-	event. This modified file will be output to the output directory specified in the command line arguments.
-
-	:param g: igraph object that has been imported from the graphml object read into this program
-	:param fromGTF: rMATS fromGTF.event.txt file that will be used to label DEXSeq edges on the igraph object with
-					corresponding rMATS events. This will then be converted to a dataframe, and a column will be
-					appended that will map rMATS event ID to DEXSeq fragment(s)
-	:param eventType: Tracks rMATS event type (SE or RI) to label edges on the igrpah object appropriately
-	:return: igraph object after the rMATS labels have been added to the DEXSeq edges appropriately.
+	:return: the suffix and pandas compression options of --compress-output
 	"""
-	rmats_df = pd.read_csv(fromGTF, dtype=str, sep='\t')
-	dex_df = pd.read_csv(gff.name, dtype=str, header=None, skiprows=1, sep=r'\s+')
-	fromGTF.seek(0)
+	if not args.compress_output:
+		return "", None
+	if args.compress_output == "gz":
+		# without a timestamp, the same table always compresses to the same bytes
+		return ".gz", {"method": "gzip", "compresslevel": 6 if args.compress_level is None else args.compress_level, "mtime": 0}
+	return ".zst", {"method": "zstd", "level": 3 if args.compress_level is None else args.compress_level}
 
-	dx_ID = {} # dictionary that maps {rMATS ID: [dexseq fragments]}
-	dx_gff = {} # dictionary that maps {dexseq fragment: [rMATS IDs]}
-	ID = [] # lists ID #s of every line in the fromGTF
-	exonStart = [] # lists exon start coordinates of every line in the fromGTF
-	exonEnd = [] # lists exon end coordinates of every line in the fromGTF
 
-	for x in fromGTF:
-		if x.split()[0] == "ID":
-			continue
-		dx_ID[x.split()[0]] = []
-		ID.append(x.split()[0])
-		exonStart.append(x.split()[5])
-		exonEnd.append(x.split()[6])
 
-	for x in range(len(exonStart)):
-		exonStart[x] = str(int(exonStart[x]) + 1)
-		exonEnd[x] = str(int(exonEnd[x]) + 1)
-		# strand affects directionality of graph
-		if g["strand"] == '+':
-			# for every dexseq fragment edge from the beginning to the end of the exon, label that edge with an eventType
-			# attribute. In addition, append the dexseq fragment label at that edge to the dx_ID dictionary
-			# {rMATS ID: [dexseq fragment list]}
-			for i in range(g.vs.find(exonStart[x]).index, g.vs.find(exonEnd[x]).index):
-				# as SE exons can be exactly the same as dexseq fragments (causing 2 edges to exist over the same node pair),
-				# we choose to select the edge labelled as dexseq fragment, and then label that edge with an eventType attribute.
-				for k in range(len(g.es.select(_within=(i, i+1)))):
-					if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] != '':
-						g.es.select(_within=(i, i+1))[k][eventType] = True
-						dx_ID[ID[x]].append('E' + ''.join(g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]))
-						if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] not in dx_gff:
-							dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]] = []
-						dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]].append(eventType + "_" + ID[x])
-		# works exactly the same as strand == +, but in the reverse direction
-		if g["strand"] == '-':
-			for i in range(g.vs.find(exonEnd[x]).index, g.vs.find(exonStart[x]).index):
-				for k in range(len(g.es.select(_within=(i, i+1)))):
-					if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] != '':
-						g.es.select(_within=(i, i+1))[k][eventType] = True
-						dx_ID[ID[x]].append('E' + ''.join(g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]))
-						if g.es.select(_within=(i, i+1))[k]["dexseq_fragment"] not in dx_gff:
-							dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]] = []
-						dx_gff[g.es.select(_within=(i, i+1))[k]["dexseq_fragment"]].append(eventType + "_" + ID[x])
+def load_gene_inputs(gene):
+	# copies the gene's inputs out of any bundle / annotation mapping so they can be handed to a worker process
+	if _profiler is None:
+		return gene, {file: bytes(data) for file, data in read_gene_inputs(gene).items()}
+	start_wall = time.perf_counter()
+	start_cpu = time.thread_time()
+	inputs = {file: bytes(data) for file, data in read_gene_inputs(gene).items()}
+	_read_times[gene] = (time.perf_counter() - start_wall, time.thread_time() - start_cpu)
+	return gene, inputs
 
-	for x in dx_ID:
-		dx_ID[x] = ','.join(dx_ID[x])
 
-	for x in dx_gff:
-		dx_gff[x] = ','.join(dx_gff[x])
 
-	rmats_df['DexseqFragment'] = rmats_df['ID'].map(dx_ID)
-	rmats_df = rmats_df[["GeneID", "ID", "DexseqFragment"]]
-	rmats_df.to_csv(gene + "/output/fromGTF_" + g["gene"] + "." + eventType + ".txt", sep='\t', index=False)
-	rmats_df.to_csv(grase_output_dir + "/results/tmp/combined.fromGTF." + eventType + ".txt", mode='a', sep='\t', index=False)
+def prefetch_gene_inputs(genes, slots, stop):
+	"""
+	Yields (gene, inputs) for every gene, in order, while a small thread pool reads the inputs of the next
+	--prefetch genes. Every gene taken holds one of the slots until its result has come back, which bounds how many
+	genes are waiting in memory for a worker. Setting stop ends the generator early.
+	"""
+	genes = iter(genes)
+	with ThreadPoolExecutor(max_workers=args.io_threads) as executor:
+		pending = collections.deque(executor.submit(load_gene_inputs, gene) for gene in itertools.islice(genes, max(args.prefetch, 1)))
+		while pending and not stop.is_set():
+			task = pending.popleft().result()
+			for gene in itertools.islice(genes, 1):
+				pending.append(executor.submit(load_gene_inputs, gene))
+			while not slots.acquire(timeout=1):
+				if stop.is_set():
+					return
+			yield task
 
-	dex_df[14] = dex_df[13].map(dx_gff)
-	dex_df = dex_df[[9, 13, 14]].rename(columns={9: "GeneID", 13: "DexseqFragment", 14: "rMATS_ID_" + eventType})
-	dex_df["DexseqFragment"] = "E" + dex_df["DexseqFragment"].astype(str)
-	dex_df["GeneID"] = dex_df["GeneID"].str.replace(r";", "", regex=True)
-	dex_df.to_csv(gene + "/output/" + g["gene"] + ".dexseq." + eventType + ".mapped.txt", sep='\t', index=False)
-	dex_df.to_csv(grase_output_dir + "/results/tmp/combined.dexseq." + eventType + ".mapped.txt", mode='a', sep='\t', index=False)
 
-	return g
 
+def text_input(name, data):
+	handle = io.StringIO(str(data, "utf-8"))
+	handle.name = name
+	return handle
 
 
-def map_rMATS(g, gene, gff, fromGTF_A3SS, fromGTF_A5SS, fromGTF_SE, fromGTF_RI, grase_output_dir):
-	g.es["rmats"] = ""
-	g.es["A3SS"] = g.es["A5SS"] = g.es["SE"] = g.es["RI"] = False
 
-	if fromGTF_A3SS:
-		g = map_rMATS_event_overhang(g, fromGTF_A3SS, "A3SS", gene, gff, grase_output_dir)
-		fromGTF_A3SS.close()
-	if fromGTF_A5SS:
-		g = map_rMATS_event_overhang(g, fromGTF_A5SS, "A5SS", gene, gff, grase_output_dir)
-		fromGTF_A5SS.close()
-	if fromGTF_SE:
-		g = map_rMATS_event_full_fragment(g, fromGTF_SE, "SE", gene, gff, grase_output_dir)
-		fromGTF_SE.close()
-	if fromGTF_RI:
-		g = map_rMATS_event_full_fragment(g, fromGTF_RI, "RI", gene, gff, grase_output_dir)
-		fromGTF_RI.close()
+def scratch_file():
+	# anonymous in-memory file for the igraph readers / writers that need a real file descriptor
+	if hasattr(os, "memfd_create"):
+		return os.fdopen(os.memfd_create("grase"), "w+b")
+	return tempfile.TemporaryFile()
 
-	gff.close()
+
+
+def read_graphml(data):
+	with profile_stage("parse_graphml"), scratch_file() as f:
+		f.write(data)
+		f.flush()
+		f.seek(0)
+		return ig.Graph.Read_GraphML(f)
+
+
+
+# With --graph-from-gtf, the splicing graph of a gene is built from the exon records of its GTF by
+# build_splicing_graph, in the worker, instead of being read from the .graphml written by SplicingGraphs.igraph.R. The
+# graph is the one SG2igraph makes of the SplicingGraphs edges of the gene: the vertices are the exon starts and
+# intron starts (exon end + 1) of its transcripts, named by coordinate and sorted along the strand between R and L,
+# and every distinct exon (ex) or intron (in) of the transcripts is an edge, with a boolean attribute per transcript
+# using it. The validate-graphs command compares the built graphs with the .graphml files of a gene_files directory.
+def build_splicing_graph(gene, gtf):
+	"""
+	Builds a gene's splicing graph from its GTF records, as SplicingGraphs.igraph.R does.
+	:param gene: the gene id; records of other genes are ignored
+	:param gtf: the GTF records as bytes or text
+	:return: igraph.Graph with the vertex and edge attributes of the gene's .graphml, None if the gene has no exons
+	"""
+	if isinstance(gtf, (bytes, bytearray, memoryview)):
+		gtf = str(gtf, "utf-8")
+	strand = None
+	transcripts = {}
+	for x in gtf.splitlines():
+		fields = x.split('\t')
+		if len(fields) < 9 or fields[2] != "exon":
+			continue
+		attributes = dict(re.findall(r'(\S+) "([^"]*)"', fields[8]))
+		if attributes.get("gene_id") != gene:
+			continue
+		if strand is None:
+			strand = fields[6]
+		transcripts.setdefault(attributes["transcript_id"], []).append((int(fields[3]), int(fields[4])))
+	if not transcripts:
+		return None
+
+	# {(start, end, ex_or_in): [transcripts]} of the exons and introns, in genomic coordinates
+	parts = {}
+	for tx, exons in transcripts.items():
+		exons.sort()
+		for i, (start, end) in enumerate(exons):
+			parts.setdefault((start, end, "ex"), []).append(tx)
+			if i + 1 < len(exons):
+				parts.setdefault((end + 1, exons[i + 1][0] - 1, "in"), []).append(tx)
+
+	# an edge runs from its 5' to its 3' boundary; on the - strand, SG2igraph also swaps its start and end
+	edges = []
+	for (start, end, ex_or_in), txs in parts.items():
+		if strand == '-':
+			edges.append((end + 1, start, end, start, end - start + 1, ex_or_in, txs))
+		else:
+			edges.append((start, end + 1, start, end, end - start + 1, ex_or_in, txs))
+	coords = sorted({edge[0] for edge in edges} | {edge[1] for edge in edges}, reverse=strand == '-')
+	names = ['R'] + [str(coord) for coord in coords] + ['L']
+	index = {coord: i + 1 for i, coord in enumerate(coords)}
+	edges.sort(key=lambda edge: (index[edge[0]], index[edge[1]], edge[5]))
+
+	tx_ids = list(dict.fromkeys(tx for edge in edges for tx in edge[6]))
+	pairs = [(index[edge[0]], index[edge[1]]) for edge in edges]
+	edge_attrs = {"start": [float(edge[2]) for edge in edges], "end": [float(edge[3]) for edge in edges],
+				  "width": [float(edge[4]) for edge in edges], "ex_or_in": [edge[5] for edge in edges]}
+	for tx in tx_ids:
+		edge_attrs[tx] = [tx in edge[6] for edge in edges]
+
+	# vertices without incoming (outgoing) edges are joined to R (L)
+	sources = {pair[0] for pair in pairs}
+	targets = {pair[1] for pair in pairs}
+	extra = [(0, i) for i in range(1, len(names) - 1) if i not in targets] + \
+			[(i, len(names) - 1) for i in range(1, len(names) - 1) if i not in sources]
+	pairs += extra
+	for name, values in edge_attrs.items():
+		values += [float("nan") if name in ("start", "end", "width") else "NA" if name == "ex_or_in" else False] * len(extra)
+
+	return ig.Graph(n=len(names), edges=pairs, directed=True,
+					vertex_attrs={"name": names, "id": ["n%d" % i for i in range(len(names))]}, edge_attrs=edge_attrs)
+
+
+
+def split_gene_inputs(inputs):
+	"""
+	Sorts the input files of a gene, {file name: bytes} as read by read_gene_inputs, into the arguments of map_gene.
+	With --graph-from-gtf, the graph is built from the gene's GTF when it has one.
+	:return: graph (GraphML bytes or igraph.Graph), gff, events
+	"""
+	graph = gff = delta_psi = gtf = None
+	fromGTF = {}
+	for file, data in inputs.items():
+		if file.endswith(".graphml"):
+			graph = data
+		elif file.endswith(".dexseq.gff"):
+			gff = data
+		elif file.endswith(".gtf"):
+			gtf = (file[:-len(".gtf")], data)
+		elif file.endswith(".deltapsi.tsv"):
+			delta_psi = data
+		else:
+			match = re.search(r"fromGTF\.(A3SS|A5SS|SE|RI)\.txt$", file)
+			if match:
+				fromGTF[match.group(1)] = data
+	if args.graph_from_gtf and gtf is not None:
+		with profile_stage("build_graph"):
+			built = build_splicing_graph(*gtf)
+		if built is not None:
+			graph = built
+	return graph, gff, fromGTF if args.splicing_software == 'r' else delta_psi
+
+
+
+def table_bytes(table):
+	# a table given to map_gene as text, bytes, a file object or a DataFrame, as bytes
+	if isinstance(table, pd.DataFrame):
+		return table.to_csv(sep='\t', index=False).encode()
+	if hasattr(table, "read"):
+		table = table.read()
+	if isinstance(table, str):
+		return table.encode()
+	return table
+
+
+
+def parse_gene_inputs(graph, gff, events):
+	"""
+	Parses the inputs of map_gene.
+	:return: g, gff, events, where gff and the event tables are text handles; for rMATS, events has all four event
+	types, with '' for the ones the gene has no table of
+	"""
+	if isinstance(graph, ig.Graph):
+		g = graph.copy()
+	else:
+		g = read_graphml(table_bytes(graph))
+	gff = text_input("dexseq.gff", gff)
+	if isinstance(events, dict):
+		events = {eventType: text_input("fromGTF." + eventType + ".txt", events[eventType]) if eventType in events else ''
+				  for eventType in ["A3SS", "A5SS", "SE", "RI"]}
+	else:
+		events = text_input("deltapsi.tsv", events)
+	return g, gff, events
+
+
+
+def save_gene_table(df, name):
+	# keeps one of the gene's output tables for its MappingResult
+	_gene_tables[name] = df
+
+
+
+def write_gene_tables(gene, tables):
+	"""
+	Writes the output tables of a gene to gene/output or, in bundle mode, adds them to what flush_gene_outputs writes.
+	"""
+	with profile_stage("save_gene_tables"):
+		if is_bundle(args.gene_files_directory):
+			outputs = {name: df.to_csv(sep='\t', index=False).encode() for name, df in tables.items()}
+			outputs.update(_gene_outputs)
+			_gene_outputs.clear()
+			_gene_outputs.update(outputs)
+		else:
+			for name, df in tables.items():
+				df.to_csv(gene + "/output/" + name, sep='\t', index=False)
+				note_written(gene + "/output/" + name)
+
+
+
+def save_gene_plot(g, gene, name, layout, visual_style):
+	if is_bundle(args.gene_files_directory):
+		# igraph renders through whichever cairo binding it found, and picks the format from the file name
+		with tempfile.NamedTemporaryFile(suffix=".png") as f:
+			ig.plot(g, f.name, layout=layout, **visual_style)
+			with open(f.name, "rb") as png:
+				_gene_outputs[name] = png.read()
+	else:
+		ig.plot(g, gene + "/output/" + name, layout=layout, **visual_style)
+		note_written(gene + "/output/" + name)
+
+
+
+def save_gene_graphml(g, gene, name):
+	if is_bundle(args.gene_files_directory):
+		with scratch_file() as f:
+			g.write_graphml(f)
+			f.flush()
+			f.seek(0)
+			_gene_outputs[name] = f.read()
+	else:
+		g.write_graphml(gene + "/output/" + name)
+		note_written(gene + "/output/" + name)
+
+
+
+def flush_gene_outputs(gene, grase_output_dir):
+	"""
+	In bundle mode, appends everything saved for the gene as one record to this worker's part of the results store.
+	"""
+	if not _gene_outputs:
+		return
+	writer = GeneBundleWriter(f"{combined_dir(grase_output_dir)}/gene_output.{os.getpid()}.part", indexed=False)
+	writer.add(os.path.basename(gene), _gene_outputs)
+	writer.close()
+	_gene_outputs.clear()
+
+
+
+
+
+# With --profile, every gene's stages (parsing, mapping, the appends to the combined files, plotting, ...) and the steps
+# of the results functions are timed by a StageProfiler. Stages nest, and the time of a stage excludes the stages
+# nested in it, so the stages of a gene add up to the gene's total. The records are written by the parent to
+# results/profile/trace.jsonl and summarised in slowest_genes.txt and stages.txt.
+PROFILE_DIR = "profile"
+NO_PROFILE = contextlib.nullcontext()
+
+_profiler = None
+_read_times = {}
+
+
+
+def reset_peak_rss():
+	"""
+	Resets the peak RSS of this process (Linux only). Returns False if the peak cannot be reset.
+	"""
+	try:
+		with open("/proc/self/clear_refs", "w") as f:
+			f.write("5")
+		return True
+	except OSError:
+		return False
+
+
+
+def read_peak_rss():
+	"""
+	Peak RSS in MB since the last reset_peak_rss(), or since the process started if it cannot be reset.
+	"""
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1]) / 1024
+	except OSError:
+		pass
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+
+class StageProfiler:
+	"""
+	Records wall time, CPU time and peak RSS of nested stages of one gene (or of the results functions).
+	"""
+
+	def __init__(self):
+		self.begin()
+
+	def begin(self):
+		self.stages = {}
+		# one frame per open stage: [name, wall start, cpu start, wall of nested stages, cpu of nested stages, peak RSS]
+		self.stack = []
+		self.step_open = False
+		self.peak = 0.0
+		self.start_wall = time.perf_counter()
+		self.start_cpu = time.process_time()
+		reset_peak_rss()
+
+	def push(self, name):
+		if self.stack:
+			self.stack[-1][5] = max(self.stack[-1][5], read_peak_rss())
+		else:
+			self.peak = max(self.peak, read_peak_rss())
+		reset_peak_rss()
+		self.stack.append([name, time.perf_counter(), time.process_time(), 0.0, 0.0, 0.0])
+
+	def pop(self):
+		name, start_wall, start_cpu, nested_wall, nested_cpu, peak = self.stack.pop()
+		wall = time.perf_counter() - start_wall
+		cpu = time.process_time() - start_cpu
+		peak = max(peak, read_peak_rss())
+		reset_peak_rss()
+
+		stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0, "peak_rss_mb": 0.0})
+		stage["wall"] += wall - nested_wall
+		stage["cpu"] += cpu - nested_cpu
+		stage["calls"] += 1
+		stage["peak_rss_mb"] = max(stage["peak_rss_mb"], peak)
+
+		if self.stack:
+			self.stack[-1][3] += wall
+			self.stack[-1][4] += cpu
+			self.stack[-1][5] = max(self.stack[-1][5], peak)
+		else:
+			self.peak = max(self.peak, peak)
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		self.push(name)
+		try:
+			yield
+		finally:
+			self.pop()
+
+	def step(self, name):
+		# ends the previous step and starts the next one, for long functions made of consecutive steps
+		if self.step_open:
+			self.pop()
+		self.step_open = name is not None
+		if name is not None:
+			self.push(name)
+
+	def end(self, **fields):
+		self.step(None)
+		while self.stack:
+			self.pop()
+		record = dict(fields)
+		record["wall"] = time.perf_counter() - self.start_wall
+		record["cpu"] = time.process_time() - self.start_cpu
+		record["peak_rss_mb"] = max(self.peak, read_peak_rss())
+		record["stages"] = self.stages
+		return record
+
+
+
+def profile_stage(name):
+	if _profiler is None:
+		return NO_PROFILE
+	return _profiler.stage(name)
+
+
+
+def results_step(name):
+	# marks the start of the next step of the results functions, for --profile and the metrics
+	if _profiler is not None:
+		_profiler.step(name)
+	if _metrics is not None and name is not None:
+		_metrics.set_phase("results." + name)
+
+
+
+class ProfileReport:
+	"""
+	Collects the profile records in the parent: appends them to trace.jsonl, keeps the --profile-top slowest genes and
+	the per-stage totals, and the cProfile stats of the --profile-cprofile slowest genes.
+	"""
+
+	def __init__(self, profile_dir):
+		self.dir = profile_dir
+		os.makedirs(self.dir, exist_ok=True)
+		for file in os.listdir(self.dir):
+			if os.path.isfile(os.path.join(self.dir, file)):
+				os.remove(os.path.join(self.dir, file))
+		self.trace = open(os.path.join(self.dir, "trace.jsonl"), "w")
+		self.slowest = []  # heap of (wall, gene, record)
+		self.cprofiles = []  # heap of (wall, gene, marshaled stats)
+		self.totals = {}  # {(phase, stage): [calls, wall, cpu, peak RSS]}
+		self.tables = []  # [file, bytes, seconds] of the results tables
+		self.num_genes = 0
+
+	def add(self, record):
+		stats = record.pop("cprofile", None)
+		self.trace.write(json.dumps(record) + "\n")
+		phase = record.get("phase", "genes")
+		for name, stage in record["stages"].items():
+			total = self.totals.setdefault((phase, name), [0, 0.0, 0.0, 0.0])
+			total[0] += stage["calls"]
+			total[1] += stage["wall"]
+			total[2] += stage["cpu"] or 0.0
+			total[3] = max(total[3], stage["peak_rss_mb"] or 0.0)
+		if phase != "genes":
+			return
+		self.num_genes += 1
+		entry = (record["wall"], record["gene"], record)
+		if len(self.slowest) < args.profile_top:
+			heapq.heappush(self.slowest, entry)
+		elif args.profile_top:
+			heapq.heappushpop(self.slowest, entry)
+		if stats is not None:
+			entry = (record["wall"], record["gene"], stats)
+			if len(self.cprofiles) < args.profile_cprofile:
+				heapq.heappush(self.cprofiles, entry)
+			else:
+				heapq.heappushpop(self.cprofiles, entry)
+
+	def add_tables(self, rows):
+		# the [file, bytes, seconds] written by the ResultsWriter of the results stage
+		self.tables.extend(rows)
+
+	def close(self):
+		self.trace.close()
+
+		rows = []
+		for wall, gene, record in sorted(self.slowest, reverse=True):
+			stages = {name: stage for name, stage in record["stages"].items() if name != "read_inputs"}
+			slowest_stage = max(stages, key=lambda name: stages[name]["wall"]) if stages else "NA"
+			rows.append([gene, record["mapped"], round(wall, 4), round(record["cpu"], 4), round(record["peak_rss_mb"], 1),
+						 slowest_stage, round(stages[slowest_stage]["wall"], 4) if stages else "NA"])
+		pd.DataFrame(rows, columns=["GeneID", "Mapped", "Wall_s", "CPU_s", "PeakRSS_MB", "SlowestStage", "SlowestStage_s"]).to_csv(
+			os.path.join(self.dir, "slowest_genes.txt"), sep='\t', index=False)
+
+		rows = []
+		for (phase, name), (calls, wall, cpu, peak) in sorted(self.totals.items(), key=lambda item: (item[0][0], -item[1][1])):
+			rows.append([phase, name, calls, round(wall, 4), round(cpu, 4), round(peak, 1)])
+		pd.DataFrame(rows, columns=["Phase", "Stage", "Calls", "Wall_s", "CPU_s", "PeakRSS_MB"]).to_csv(
+			os.path.join(self.dir, "stages.txt"), sep='\t', index=False)
+
+		if self.tables:
+			rows = [[file, size, round(seconds, 4)] for file, size, seconds in sorted(self.tables, key=lambda row: -row[2])]
+			pd.DataFrame(rows, columns=["File", "Bytes", "Seconds"]).to_csv(
+				os.path.join(self.dir, "results_tables.txt"), sep='\t', index=False)
+
+		if self.cprofiles:
+			os.makedirs(os.path.join(self.dir, "cprofile"), exist_ok=True)
+			for wall, gene, stats in self.cprofiles:
+				# same format as pstats.Stats.dump_stats, readable with pstats / snakeviz
+				with open(os.path.join(self.dir, "cprofile", gene + ".prof"), "wb") as f:
+					f.write(stats)
+
+
+
+# Workers report which gene they started, when they start writing its outputs and how many bytes of per-gene output
+# they wrote through _events, a queue the pool inherits. A WorkerMonitor thread of the main process follows them, to
+# kill workers stuck on a gene past --gene-timeout and to report them in the metrics: with --metrics / --status,
+# another thread rewrites a Prometheus text-format file (for the node exporter's textfile collector) and / or a status
+# JSON every --metrics-interval seconds, replacing them atomically.
+WATCHDOG_INTERVAL = 1.0
+WATCHDOG_GRACE = 30
+# exit status of a run whose results leave out failed genes, unless --allow-failed-genes
+FAILED_GENES_STATUS = 3
+
+_metrics = None
+_monitor = None
+_events = None
+_bytes_written = 0
+_failed_genes = {}
+
+
+
+def note_written(path):
+	# counts a per-gene output written by a worker, for the metrics
+	global _bytes_written
+	if _events is not None:
+		try:
+			_bytes_written += os.path.getsize(path)
+		except OSError:
+			pass
+
+
+
+def write_atomic(path, text):
+	tmp_path = f"{path}.tmp.{os.getpid()}"
+	with open(tmp_path, "w") as f:
+		f.write(text)
+	os.replace(tmp_path, path)
+
+
+
+class WorkerMonitor:
+	"""
+	Follows the gene each worker process is on. A worker still on the same gene kill_after seconds after starting it
+	is killed, its gene being passed to on_kill(gene, error), unless it is already writing the mapped gene's outputs.
+	"""
+
+	def __init__(self, kill_after=0):
+		self.kill_after = kill_after
+		self.on_kill = None
+		self.workers = {}  # {pid: (gene, start time)}
+		self.flushing = set()  # pids of the workers writing their gene's outputs (see flush_gene)
+		self.bytes_written = 0
+		self.lock = threading.Lock()
+		self.stop_event = threading.Event()
+		self.thread = threading.Thread(target=self.run, daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.stop_event.set()
+		self.thread.join()
+
+	def run(self):
+		while not self.stop_event.wait(WATCHDOG_INTERVAL):
+			self.update()
+
+	def update(self):
+		with self.lock:
+			while True:
+				try:
+					event, pid, gene, value = _events.get_nowait()
+				except (queue.Empty, OSError, ValueError):
+					break
+				if event == "start":
+					self.workers[pid] = (gene, value)
+					self.flushing.discard(pid)
+				elif event == "flushing":
+					if self.workers.get(pid, (None,))[0] == gene:
+						self.flushing.add(pid)
+				elif event == "done":
+					self.bytes_written += value
+					if self.workers.get(pid, (None,))[0] == gene:
+						del self.workers[pid]
+						self.flushing.discard(pid)
+			if not self.kill_after:
+				return
+			now = time.time()
+			for pid, (gene, start) in list(self.workers.items()):
+				if now - start > self.kill_after and pid not in self.flushing:
+					# the worker did not get out of the gene on SIGALRM, e.g. inside a long igraph call
+					try:
+						os.kill(pid, signal.SIGKILL)
+					except OSError:
+						pass
+					del self.workers[pid]
+					if self.on_kill is not None:
+						self.on_kill(gene, f"GeneTimeout: worker {pid} was killed after {now - start:.0f}s on {gene}\n")
+
+	def snapshot(self):
+		self.update()
+		with self.lock:
+			return dict(self.workers), self.bytes_written
+
+
+
+class RunMetrics:
+	"""
+	Progress of a run as seen by the main process: gene counts, the gene each worker is on, bytes written and phase.
+	"""
+
+	def __init__(self, num_genes, grase_output_dir):
+		self.num_genes = num_genes
+		self.grase_output_dir = grase_output_dir
+		self.completed = 0
+		self.skipped = 0
+		self.failed = 0
+		self.phase = "genes"
+		self.start_time = time.time()
+		self.lock = threading.Lock()
+		self.stop_event = threading.Event()
+		self.thread = threading.Thread(target=self.run, daemon=True)
+
+	def start(self):
+		self.write()
+		self.thread.start()
+
+	def stop(self, phase="done"):
+		self.set_phase(phase)
+		self.stop_event.set()
+		self.thread.join()
+		self.write()
+
+	def run(self):
+		while not self.stop_event.wait(args.metrics_interval):
+			self.write()
+
+	def gene_done(self, mapped):
+		with self.lock:
+			self.completed += 1
+			self.skipped += not mapped
+
+	def gene_failed(self):
+		with self.lock:
+			self.failed += 1
+
+	def set_phase(self, phase):
+		with self.lock:
+			self.phase = phase
+
+	def bytes_written(self, worker_bytes):
+		"""
+		Bytes reported by the workers plus the size of the combined files, gene output parts and results written so far.
+		"""
+		total = worker_bytes
+		results_dir = os.path.join(self.grase_output_dir, "results")
+		for directory in ("", os.path.relpath(combined_dir(self.grase_output_dir), results_dir), "SplicingEvents", "ExonParts"):
+			try:
+				with os.scandir(os.path.join(results_dir, directory)) as entries:
+					total += sum(entry.stat().st_size for entry in entries if entry.is_file())
+			except OSError:
+				pass
+		return total
+
+	def snapshot(self):
+		workers, worker_bytes = _monitor.snapshot()
+		now = time.time()
+		with self.lock:
+			elapsed = now - self.start_time
+			return {"phase": self.phase, "start_time": self.start_time, "update_time": now, "elapsed_seconds": elapsed,
+					"genes": {"total": self.num_genes, "completed": self.completed, "skipped": self.skipped,
+							  "failed": self.failed, "pending": self.num_genes - self.completed - self.failed},
+					"genes_per_second": self.completed / elapsed if elapsed > 0 else 0.0,
+					"bytes_written": self.bytes_written(worker_bytes),
+					"workers": [{"pid": pid, "gene": gene, "elapsed_seconds": now - start}
+								for pid, (gene, start) in sorted(workers.items())]}
+
+	def write(self):
+		status = self.snapshot()
+		if args.status:
+			write_atomic(args.status, json.dumps(status, indent=1) + "\n")
+		if args.metrics:
+			write_atomic(args.metrics, prometheus_text(status))
+
+
+
+def prometheus_text(status):
+	"""
+	:param status: RunMetrics.snapshot()
+	:return: the status in the Prometheus text exposition format
+	"""
+	lines = []
+
+	def metric(name, kind, help_text, samples):
+		lines.append(f"# HELP grase_{name} {help_text}")
+		lines.append(f"# TYPE grase_{name} {kind}")
+		for labels, value in samples:
+			label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+			lines.append(f"grase_{name}{{{label_text}}} {value}" if label_text else f"grase_{name} {value}")
+
+	metric("genes", "gauge", "Genes of the run by state.",
+		   [({"state": state}, count) for state, count in status["genes"].items()])
+	metric("genes_per_second", "gauge", "Genes completed per second since the start of the run.", [({}, round(status["genes_per_second"], 4))])
+	metric("bytes_written", "gauge", "Bytes of combined files and outputs written.", [({}, status["bytes_written"])])
+	metric("phase", "gauge", "Current phase of the run.", [({"phase": status["phase"]}, 1)])
+	metric("start_time_seconds", "gauge", "Unix time the run started.", [({}, round(status["start_time"], 3))])
+	metric("last_update_seconds", "gauge", "Unix time of this update.", [({}, round(status["update_time"], 3))])
+	metric("worker_gene_seconds", "gauge", "Seconds the worker has been on its current gene.",
+		   [({"pid": worker["pid"], "gene": worker["gene"]}, round(worker["elapsed_seconds"], 3)) for worker in status["workers"]])
+	return "\n".join(lines) + "\n"
+
+
+
+def is_header_only(data):
+	return not any(line.strip() for line in bytes(data).splitlines()[1:])
+
+
+
+def graphml_vertex_names(data):
+	# vertex names straight from the GraphML text, without building the graph
+	text = str(data, "utf-8")
+	key = re.search(r'<key id="([^"]+)" for="node" attr\.name="name"', text)
+	if key is None:
+		return None
+	return set(re.findall(r'<data key="' + re.escape(key.group(1)) + r'">([^<]*)</data>', text))
+
+
+
+def has_mappable_events(graph, events):
+	"""
+	Cheap check, done before any graph work, of whether a gene has events that can be mapped onto its graph. Genes
+	whose fromGTF.*.txt files are all empty or header-only (rMATS), or whose LSVs all have a junction that is not in
+	the annotation graph (MAJIQ, mapped as novel_junc), have none.
+	:param graph: igraph.Graph or GraphML bytes
+	:param events: as for map_gene, with the tables as bytes
+	"""
+	if isinstance(events, dict):
+		return not all(is_header_only(data) for data in events.values())
+
+	names = set(graph.vs["name"]) if isinstance(graph, ig.Graph) else graphml_vertex_names(graph)
+	if names is None:
+		return True
+	for x in bytes(events).decode().splitlines():
+		if not x.strip() or x.split()[0] == "Gene":
+			continue
+		if all(str(int(junc.split('-')[0]) + 1) in names and junc.split('-')[1] in names for junc in x.split()[13].split(';')):
+			return True
+	return False
+
+
+
+def write_unmapped_gene(gff, events):
+	"""
+	Keeps the rows a gene without mappable events contributes to the combined files: its DEXSeq exonic parts with no
+	events mapped to them and, for MAJIQ, its LSVs as novel_junc. The combined files already have their header (see
+	init_combined_files), so these rows are written without one.
+	"""
+	gff = text_input("dexseq.gff", gff)
+	dex_df = pd.read_csv(gff, dtype=str, header=None, skiprows=1, sep=r'\s+')
+	dex_df[14] = np.nan
+	dex_df["DexseqFragment"] = "E" + dex_df[13].astype(str)
+	dex_df["GeneID"] = dex_df[9].str.replace(r";", "", regex=True)
+	gff.close()
+
+	if isinstance(events, dict):
+		for eventType in ["A3SS", "A5SS", "SE", "RI"]:
+			if eventType in events:
+				append_combined(dex_df[["GeneID", "DexseqFragment", 14]], "combined.dexseq." + eventType + ".mapped.txt")
+
+	else:
+		majiq_df = pd.read_csv(text_input("deltapsi.tsv", events), dtype=str, sep='\t')
+		majiq_df['DexseqFragment'] = 'novel_junc'
+		majiq_df = majiq_df[["Gene ID", "LSV ID", "DexseqFragment", "A5SS", "A3SS", "ES"]]
+		append_combined(majiq_df, "combined.majiq.deltapsi.mapped.tsv")
+		append_combined(dex_df[["GeneID", "DexseqFragment", 14]], "combined.dexseq.majiq.mapped.txt")
+
+
+
+def combined_dir(grase_output_dir):
+	"""
+	:return: the directory of the combined files and gene output parts: results/tmp, or results/tmp/shard_<i>_of_<N>
+	with --shard
+	"""
+	if args.shard:
+		return grase_output_dir + "/results/tmp/shard_%d_of_%d" % args.shard
+	return grase_output_dir + "/results/tmp"
+
+
+
+def in_shard(gene, shard):
+	"""
+	Genes are assigned to shards by a CRC32 of the gene ID, so every run with the same N selects the same genes.
+	:param shard: (i, N)
+	"""
+	return zlib.crc32(gene.encode()) % shard[1] == shard[0] - 1
+
+
+
+def append_combined(df, name):
+	"""
+	Keeps, for the gene's MappingResult, rows the gene adds to one of the combined files in results/tmp. They are
+	only written by flush_gene, once the whole gene has been mapped, so a gene that fails or times out leaves no rows
+	behind.
+	"""
+	_combined_rows.setdefault(name, []).append(df)
+
+
+
+def flush_gene(gene, grase_output_dir, result):
+	"""
+	Writes the MappingResult of a gene: its rows of the combined files, its output tables and, in bundle mode, its
+	other outputs. The rows of a mapped gene are written with a header line each, those of an unmapped gene without.
+	"""
+	disarm_gene_timeout()
+	if _events is not None:
+		# the watchdog no longer kills the worker for this gene, which would leave part of its outputs behind
+		_events.put(("flushing", os.getpid(), gene, 0))
+	with profile_stage("append_combined"):
+		for name, dfs in result.combined.items():
+			# each file gets the gene's rows in a single write, so they are never interleaved or cut short
+			data = memoryview("".join(df.to_csv(sep='\t', index=False, header=result.mapped) for df in dfs).encode())
+			fd = os.open(combined_dir(grase_output_dir) + "/" + name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+			try:
+				while data:
+					data = data[os.write(fd, data):]
+			finally:
+				os.close(fd)
+	if args.output_profile != "minimal":
+		write_gene_tables(gene, result.tables)
+	flush_gene_outputs(gene, grase_output_dir)
+
+
+
+def discard_gene():
+	# drops what a failed gene buffered
+	_gene_tables.clear()
+	_combined_rows.clear()
+	_gene_outputs.clear()
+
+
+
+def init_combined_files(grase_output_dir):
+	"""
+	Starts every combined file in results/tmp with its header row. Genes without mappable events append only data
+	rows, so this makes sure a header is in place however few genes reach the mappers.
+	"""
+	tmp_dir = combined_dir(grase_output_dir) + "/"
+	headers = {}
+	if args.splicing_software == 'r':
+		for eventType in ["A3SS", "A5SS", "SE", "RI"]:
+			headers["combined.fromGTF." + eventType + ".txt"] = ["GeneID", "ID", "DexseqFragment"]
+			headers["combined.dexseq." + eventType + ".mapped.txt"] = ["GeneID", "DexseqFragment", "rMATS_ID_" + eventType]
+	elif args.splicing_software == 'm':
+		headers["combined.majiq.deltapsi.mapped.tsv"] = ["Gene ID", "LSV ID", "DexseqFragment", "A5SS", "A3SS", "ES"]
+		headers["combined.dexseq.majiq.mapped.txt"] = ["GeneID", "DexseqFragment", "LSV_ID"]
+	if args.edge_table:
+		headers.update(EDGE_TABLE_FILES)
+	if graph_viewer_enabled():
+		headers.update(GRAPH_VIEWER_FILES)
+	for file, header in headers.items():
+		with open(tmp_dir + file, "w") as f:
+			f.write('\t'.join(header) + '\n')
+
+
+
+class GeneTimeout(Exception):
+	pass
+
+
+
+# Errors of the environment rather than of a gene, such as a missing module, fail every gene the same way. The first
+# one stops the run instead of being retried and leaving every gene out of the results.
+ENVIRONMENT_ERRORS = ("ImportError", "ModuleNotFoundError")
+
+
+
+def is_environment_error(error):
+	# error is the traceback of a failed gene, whose last line starts with the name of the exception
+	return error.strip().splitlines()[-1].split(":")[0] in ENVIRONMENT_ERRORS
+
+
+
+def check_plotting():
+	"""
+	Exits if igraph cannot render the graph pngs, which would otherwise fail every mapped gene.
+	"""
+	if args.plot != "png" or args.output_profile == "minimal":
+		return
+	with tempfile.TemporaryDirectory() as directory:
+		try:
+			ig.plot(ig.Graph(1), os.path.join(directory, "check.png"), bbox=(10, 10))
+		except Exception as error:
+			sys.exit(f"igraph cannot render the graph pngs ({error}). Install pycairo or cairocffi, or run with "
+					 f"--plot viewer or --output-profile minimal, which do not render them.")
+
+
+
+def arm_gene_timeout(gene):
+	if args.gene_timeout > 0:
+		def timeout(signum, frame):
+			raise GeneTimeout(f"{gene} took longer than --gene-timeout {args.gene_timeout:g}s")
+		signal.signal(signal.SIGALRM, timeout)
+		signal.setitimer(signal.ITIMER_REAL, args.gene_timeout)
+
+
+
+def disarm_gene_timeout():
+	if args.gene_timeout > 0:
+		signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+
+class MappingResult:
+	"""
+	What map_gene returns for one gene.
+		- mapped: False if the gene had no mappable events (see has_mappable_events)
+		- graph: the splicing graph with the DEXSeq exonic parts and the events mapped onto its edges, with the edge
+		  attributes of the annotated GraphML (see export_graph), None if not mapped
+		- tables: the gene's output tables, {file name in gene/output: DataFrame}
+		- combined: the gene's rows of the combined files, {file name in results/tmp: [DataFrame, ...]}
+	"""
+
+	def __init__(self, mapped, graph, tables, combined):
+		self.mapped = mapped
+		self.graph = graph
+		self.tables = tables
+		self.combined = combined
+
+	@classmethod
+	def collect(cls, mapped, graph):
+		# takes what save_gene_table and append_combined kept for the gene
+		result = cls(mapped, graph, dict(_gene_tables), dict(_combined_rows))
+		_gene_tables.clear()
+		_combined_rows.clear()
+		return result
+
+
+
+def map_gene(graph, gff, events):
+	"""
+	Maps the DEXSeq exonic parts and the rMATS or MAJIQ events of one gene onto its splicing graph, in memory: nothing
+	is read from or written to disk and args is not used, so GrASE can be imported and run gene by gene from another
+	pipeline. process_gene is this, plus reading the gene's files and writing its MappingResult. Not thread-safe, as
+	the mappers keep the gene's tables in module globals; run genes in parallel in processes.
+	:param graph: the gene's splicing graph, an igraph.Graph (which is left as is) or its GraphML
+	:param gff: the gene's DEXSeq gff (*.dexseq.gff)
+	:param events: rMATS: {event type: fromGTF.<event type>.txt table} for the event types the gene has a table of;
+	MAJIQ: the gene's deltapsi.tsv table
+	GraphML, gff and tables are given as text, bytes or file objects; event tables can also be DataFrames.
+	:return: MappingResult
+	"""
+	result = map_gene_coded(graph, gff, events)
+	if result.graph is not None:
+		result.graph = export_graph(result.graph)
+	return result
+
+
+
+def map_gene_coded(graph, gff, events):
+	# map_gene with the graph's edge annotations left as the integer codes of the mappers (see ExonicParts), which
+	# process_gene draws and writes from
+	gff = table_bytes(gff)
+	if isinstance(events, dict):
+		events = {eventType: table_bytes(table) for eventType, table in events.items()}
+	else:
+		events = table_bytes(events)
+	discard_gene()
+
+	with profile_stage("check_events"):
+		mappable = has_mappable_events(graph, events)
+	if not mappable:
+		with profile_stage("write_unmapped"):
+			write_unmapped_gene(gff, events)
+		return MappingResult.collect(False, None)
+	return map_gene_events(graph, gff, events)
+
+
+
+def map_gene_events(graph, gff, events):
+	# map_gene of a gene known to have mappable events, with its tables as bytes
+	with profile_stage("get_gene_files"):
+		g, gff, events = parse_gene_inputs(graph, gff, events)
+	with profile_stage("map_DEXSeq"):
+		g = map_DEXSeq_from_gff(g, gff)
+	if isinstance(events, dict):
+		g = map_rMATS(g, gff, events["A3SS"], events["A5SS"], events["SE"], events["RI"])
+	else:
+		with profile_stage("map_majiq"):
+			g = map_majiq(g, gff, events)
+	return MappingResult.collect(True, g)
+
+
+
+# Giant genes (e.g. TTN, or the protocadherin and immunoglobulin clusters) would keep one worker busy long after the
+# others are done. With --nthread > 1, the events of a gene with more than --giant-gene-events of them are split by
+# split_giant_gene into chunks of consecutive events of one event type, which all workers map in parallel
+# (map_gene_chunk_task). Every event is mapped on its own, only adding to the edge flags and the dx_ID / dx_gff
+# dictionaries of the mappers, so merge_mapping_results can put the chunks' MappingResults back together as if the
+# events had been mapped one after the other, before one worker plots and writes the gene.
+def split_giant_gene(inputs):
+	"""
+	:param inputs: the gene's input files, {file name: bytes}
+	:return: None, or for a giant gene, the map_gene arguments (graph, gff, events) of its chunks, in event order
+	"""
+	if args.giant_gene_events <= 0 or args.nthread == 1:
+		return None
+	graph, gff, events = split_gene_inputs(inputs)
+	tables = events if isinstance(events, dict) else {None: events}
+	lines = {key: bytes(data).splitlines(keepends=True) for key, data in tables.items() if data is not None}
+	num_events = sum(max(len(table) - 1, 0) for table in lines.values())
+	if num_events <= args.giant_gene_events or not has_mappable_events(graph, events):
+		return None
+
+	chunk_size = -(-num_events // args.nthread)
+	chunks = []
+	for key in (["A3SS", "A5SS", "SE", "RI"] if isinstance(events, dict) else [None]):
+		if key not in lines:
+			continue
+		header, rows = lines[key][:1], lines[key][1:]
+		for start in range(0, max(len(rows), 1), chunk_size):
+			data = b"".join(header + rows[start:start + chunk_size])
+			chunks.append((graph, gff, {key: data} if isinstance(events, dict) else data))
+	return chunks
+
+
+
+def map_gene_chunk_task(task):
+	"""
+	Maps one chunk of the events of a giant gene in a worker. Returns (MappingResult, error), error being None or the
+	traceback of a chunk that failed or timed out.
+	"""
+	gene, chunk = task
+	if _events is not None:
+		_events.put(("start", os.getpid(), gene, time.time()))
+	try:
+		arm_gene_timeout(gene)
+		discard_gene()
+		return map_gene_events(*chunk), None
+	except Exception:
+		discard_gene()
+		return None, traceback.format_exc()
+	finally:
+		disarm_gene_timeout()
+		if _events is not None:
+			_events.put(("done", os.getpid(), gene, 0))
+
+
+
+def merge_mapping_results(results):
+	"""
+	Merges the MappingResults of the chunks of a giant gene, given in event order: the edge flags of the chunks' graphs
+	are combined, an edge keeping the last rMATS long / short label set on it, the rows of the event tables are
+	concatenated, and the events mapped to each exonic part in the dexseq tables are joined.
+	"""
+	g = results[0].graph
+	events = np.array([result.graph.es["events"] for result in results], dtype=np.int64)
+	labels = np.zeros(g.ecount(), dtype=np.int64)
+	for chunk in events & RMATS_LABELS:
+		labels = np.where(chunk != 0, chunk, labels)
+	g.es["events"] = ((np.bitwise_or.reduce(events, axis=0) & ~RMATS_LABELS) | labels).tolist()
+
+	def merge_tables(name, dfs):
+		if ".dexseq." not in name:
+			return pd.concat(dfs, ignore_index=True)
+		# the same exonic parts in every chunk, with the chunk's events mapped to them in the third column
+		df = dfs[0].copy()
+		events = pd.concat([chunk.iloc[:, 2] for chunk in dfs], axis=1)
+		df[df.columns[2]] = [",".join(row[pd.notna(row)]) or np.nan for row in events.to_numpy()]
+		return df
+
+	tables = {}
+	combined = {}
+	for result in results:
+		for name, df in result.tables.items():
+			tables.setdefault(name, []).append(df)
+		for name, dfs in result.combined.items():
+			combined.setdefault(name, []).extend(dfs)
+	return MappingResult(True, g, {name: merge_tables(name, dfs) for name, dfs in tables.items()},
+						 {name: [merge_tables(name, dfs)] for name, dfs in combined.items()})
+
+
+
+def process_gene(gene, inputs=None, chunks=None):
+	"""
+	Maps one gene with map_gene and writes the outputs selected by --output-profile. Returns False if the gene had no
+	mappable events and only its DEXSeq rows were written.
+	:param chunks: for a giant gene, the MappingResults of its chunks, which are merged instead
+	"""
+	if chunks is not None:
+		with profile_stage("merge_chunks"):
+			result = merge_mapping_results(chunks)
+	else:
+		if inputs is None:
+			inputs = read_gene_inputs(gene)
+		result = map_gene_coded(*split_gene_inputs(inputs))
+	if result.mapped and args.edge_table:
+		with profile_stage("edge_table"):
+			result.combined.update({name: [df] for name, df in edge_table_rows(result.graph).items()})
+	gene = os.path.join(args.gene_files_directory, gene)
+	if result.mapped and args.output_profile != "minimal":
+		with profile_stage("plot"):
+			result.combined.update({name: [df] for name, df in style_and_plot(result.graph, gene).items()})
+	with profile_stage("flush_outputs"):
+		flush_gene(gene, os.path.abspath(os.path.join(args.gene_files_directory, os.pardir)), result)
+	return result.mapped
+
+
+
+def process_gene_task(task):
+	"""
+	Maps one prefetched gene in a worker, within --gene-timeout seconds. Returns (gene, mapped, profile record, error):
+	error is None, or the traceback of a gene that failed or timed out, in which case nothing of the gene was written.
+	The record is None without --profile.
+	"""
+	gene, inputs = task[:2]
+	chunks = task[2] if len(task) > 2 else None
+	written = _bytes_written
+	if _events is not None:
+		_events.put(("start", os.getpid(), gene, time.time()))
+	try:
+		arm_gene_timeout(gene)
+		mapped, record = profile_gene(gene, inputs, chunks)
+		return gene, mapped, record, None
+	except Exception:
+		discard_gene()
+		return gene, False, None, traceback.format_exc()
+	finally:
+		disarm_gene_timeout()
+		if _events is not None:
+			_events.put(("done", os.getpid(), gene, _bytes_written - written))
+
+
+
+def profile_gene(gene, inputs, chunks=None):
+	# runs process_gene under the worker's StageProfiler (and cProfile) with --profile
+	if _profiler is None:
+		return process_gene(gene, inputs, chunks), None
+
+	_profiler.begin()
+	profile = cProfile.Profile() if args.profile_cprofile else None
+	if profile is not None:
+		profile.enable()
+	mapped = process_gene(gene, inputs, chunks)
+	record = _profiler.end(gene=gene, mapped=mapped, pid=os.getpid())
+	if profile is not None:
+		profile.disable()
+		profile.create_stats()
+		record["cprofile"] = marshal.dumps(profile.stats)
+	return mapped, record
+
+
+
+# While a gene is mapped, the annotations of its graph's edges are integer codes rather than the string / boolean
+# attributes of the annotated GraphML: "fragment" is the index of the edge's DEXSeq exonic part in the graph's
+# "fragments" labels (0, labelled '', for the other edges) and "events" is a bitmask with bit i set for EDGE_FLAGS[i],
+# the event types mapped to the exonic part and the rMATS long / short label of the edge. The mappers update them
+# through an ExonicParts in numpy arrays, without igraph attribute access per edge. style_and_plot builds its edge
+# labels from the codes, and export_graph writes them out as dexseq_fragment, rmats and A3SS / A5SS / SE / RI for the
+# GraphML and the mapping service.
+EDGE_FLAGS = ["A3SS", "A5SS", "SE", "RI", "rmats long", "rmats short"]
+RMATS_LABELS = (1 << EDGE_FLAGS.index("rmats long")) | (1 << EDGE_FLAGS.index("rmats short"))
+
+
+
+def map_DEXSeq_from_gff(g, gff):
+	"""
+	Takes a gff DEXSeq output file and reads it. The function will take the coordinates of DEXSeq exon fragments
+	in order to create edges on the igraph object that map to those fragments. The fragments are numbered by a
+	"fragment" attribute, the index of the corresponding exonic part number from the gff file (i.e. 001 for E001)
+	in the graph's "fragments" labels.
+
+	:param g: igraph object that has been imported from the graphml object read into this program
+	:param gff: DEXSeq gff file that will be used to create fragment edges on the igraph object
+	:return: igraph object after the DEXSeq edges have been added
+	"""
+	leftCoords = []
+	rightCoords = []
+	dex_frag = []
+
+	for x in gff:
+		if x.split()[2] == "aggregate_gene":
+			g["chrom"] = x.split()[0]
+			g["strand"] = x.split()[6]
+			g["gene"] = x.split()[-1].strip('\"')
+		if x.split()[2] == "exonic_part":
+			leftCoords.append(x.split()[3])
+			rightCoords.append(x.split()[4])
+			dex_frag.append(x.split()[-1].strip('\"'))
+
+	pairs = []
+	for x in range(len(rightCoords)):
+		rightCoords[x] = str(int(rightCoords[x]) + 1)
+	if g["strand"] == '-':
+		pairs = list(zip(rightCoords, leftCoords))
+	if g["strand"] == '+':
+		pairs = list(zip(leftCoords, rightCoords))
+
+	g.es["fragment"] = 0
+	g.add_edges(pairs, attributes={"fragment": list(range(1, len(pairs) + 1))})
+	g["fragments"] = [''] + dex_frag
+
+	return g
+
+
+
+class ExonicParts:
+	"""
+	The DEXSeq exonic part edges of a graph, indexed by the pair of consecutive vertices they lie within, with the
+	"events" bitmask of all edges as a numpy array that the mappers flag and save writes back to the graph.
+	"""
+
+	def __init__(self, g):
+		self.g = g
+		self.labels = g["fragments"]
+		self.fragment = g.es["fragment"]
+		self.events = np.array(g.es["events"], dtype=np.int64)
+		# {i: [exonic part edges]}, the edges of g.es.select(_within=(i, i + 1)) with a fragment, in edge order
+		self.steps = {}
+		for edge, (source, target) in enumerate(g.get_edgelist()):
+			if not self.fragment[edge]:
+				continue
+			if source == target:
+				for i in (source - 1, source):
+					self.steps.setdefault(i, []).append(edge)
+			elif abs(source - target) == 1:
+				self.steps.setdefault(min(source, target), []).append(edge)
+
+	def flag(self, first, last, eventType, ID, dx_ID, dx_gff):
+		"""
+		Flags the exonic parts between the vertices first and last (vertex indices) with eventType, and records them as
+		mapped to the event in dx_ID {event ID: [exonic parts]} and dx_gff {fragment: [events]}.
+		"""
+		bit = 1 << EDGE_FLAGS.index(eventType)
+		for i in range(first, last):
+			for edge in self.steps.get(i, ()):
+				label = self.labels[self.fragment[edge]]
+				self.events[edge] |= bit
+				dx_ID[ID].append('E' + label)
+				if label not in dx_gff:
+					dx_gff[label] = []
+				dx_gff[label].append(eventType + "_" + ID)
+
+	def label_rmats(self, start, end, label):
+		# sets the rMATS label ("rmats long" / "rmats short") of the edge from the vertex named start to the one named end
+		edge = self.g.es.find(_within=(self.g.vs.find(start).index, self.g.vs.find(end).index)).index
+		self.events[edge] = (self.events[edge] & ~RMATS_LABELS) | (1 << EDGE_FLAGS.index(label))
+
+	def save(self):
+		self.g.es["events"] = self.events.tolist()
+		return self.g
+
+
+
+def export_graph(g):
+	"""
+	:return: a copy of a mapped graph with the integer codes of its edges written out as the attributes of the
+	annotated GraphML: dexseq_fragment, rmats (for rMATS) and A3SS / A5SS / SE / RI
+	"""
+	g = g.copy()
+	if "chrom" in g.attributes():
+		# only kept for the edge table and the graph viewer; the annotated GraphML has the attributes of its input
+		del g["chrom"]
+	if "fragment" in g.es.attributes():
+		g.es["dexseq_fragment"] = [g["fragments"][fragment] for fragment in g.es["fragment"]]
+		del g.es["fragment"]
+		del g["fragments"]
+	if "events" in g.es.attributes():
+		events = np.array(g.es["events"], dtype=np.int64)
+		if g["mapper"] == "rmats":
+			g.es["rmats"] = np.where(events & (1 << EDGE_FLAGS.index("rmats long")), "rmats long",
+									 np.where(events & (1 << EDGE_FLAGS.index("rmats short")), "rmats short", "")).tolist()
+		for bit, eventType in enumerate(EDGE_FLAGS[:4]):
+			g.es[eventType] = ((events >> bit) & 1).astype(bool).tolist()
+		del g.es["events"]
+		del g["mapper"]
+	return g
+
+
+
+def map_majiq(g, gff, delta_psi):
+	with profile_stage("read_tables"):
+		majiq_df = pd.read_csv(delta_psi, dtype=str, sep='\t')
+		gff.seek(0)
+		dex_df = pd.read_csv(gff, dtype=str, header=None, skiprows=1, sep=r'\s+')
+		delta_psi.seek(0)
+
+	g.es["events"] = 0
+	g["mapper"] = "majiq"
+	parts = ExonicParts(g)
+
+	dx_ID = {}  # dictionary that maps {majiq ID: [dexseq fragments]}
+	dx_gff = {}  # dictionary that maps {dexseq fragment: [majiq IDs]}
+	ID = []  # lists ID of every line in the delta_psi
+	event = [] # lists event type for each ID
+	junc_coords = []  # lists junction / IR coordinates from delta_psi
+
+	for x in delta_psi:
+		if x.split()[0] == "Gene":
+			continue
+		dx_ID[x.split()[1]] = []
+		ID.append(x.split()[1])
+		junc_coords.append(x.split()[13])
+		if x.split()[8] == "True":
+			event.append("A5SS")
+		elif x.split()[9] == "True":
+			event.append("A3SS")
+		elif x.split()[10] == "True":
+			event.append("SE")
+		else:
+			event.append("RI")
+
+	for x in range(len(ID)):
+		junc_start = []  # lists junction start coords from delta_psi
+		junc_end = []  # lists junction end coords from delta_psi
+		next_loop = False
+		if g['strand'] == '+':
+			for junc in junc_coords[x].split(';'):
+				if len(g.vs.select(name=str(int(junc.split('-')[0]) + 1))) == 0 or len(g.vs.select(name=junc.split('-')[1])) == 0:
+					dx_ID[ID[x]] = 'novel_junc'
+					next_loop = True
+					break
+				junc_start.append(str(int(junc.split('-')[0]) + 1))
+				junc_end.append(junc.split('-')[1])
+		if g['strand'] == '-':
+			for junc in junc_coords[x].split(';'):
+				if len(g.vs.select(name=str(int(junc.split('-')[0]) + 1))) == 0 or len(g.vs.select(name=junc.split('-')[1])) == 0:
+					dx_ID[ID[x]] = 'novel_junc'
+					next_loop = True
+					break
+				junc_end.insert(0, str(int(junc.split('-')[0]) + 1))
+				junc_start.insert(0, junc.split('-')[1])
+
+		if next_loop:
+			continue
+
+		if len(junc_start) == 1:
+			dx_ID, dx_gff = map_majiq_RI(parts, junc_start, junc_end, dx_ID, dx_gff, ID[x], event[x])
+
+		elif len(junc_start) == 2:
+			if junc_start[0] == junc_start[1]:
+				dx_ID, dx_gff = map_majiq_A3_style(parts, junc_start, junc_end, dx_ID, dx_gff, ID[x], event[x])
+			elif junc_end[0] == junc_end[1]:
+				dx_ID, dx_gff = map_majiq_A5_style(parts, junc_start, junc_end, dx_ID, dx_gff, ID[x], event[x])
+	g = parts.save()
+
+	for x in dx_ID:
+		if dx_ID[x] == []:
+			dx_ID[x] = 'NA'
+		elif dx_ID[x] == 'novel_junc':
+			continue
+		else:
+			dx_ID[x] = ','.join(dx_ID[x])
+
+	for x in dx_gff:
+		dx_gff[x] = ','.join(dx_gff[x])
+
+	majiq_df['DexseqFragment'] = majiq_df['LSV ID'].map(dx_ID)
+	majiq_df = majiq_df[["Gene ID", "LSV ID", "DexseqFragment", "A5SS", "A3SS", "ES"]]
+	save_gene_table(majiq_df, g["gene"] + ".mapped.deltapsi.tsv")
+	append_combined(majiq_df, "combined.majiq.deltapsi.mapped.tsv")
+
+	dex_df[14] = dex_df[13].map(dx_gff)
+	dex_df = dex_df[[9, 13, 14]].rename(columns={9: "GeneID", 13: "DexseqFragment", 14: "LSV_ID"})
+	dex_df["DexseqFragment"] = "E" + dex_df["DexseqFragment"].astype(str)
+	dex_df["GeneID"] = dex_df["GeneID"].str.replace(r";", "", regex=True)
+	save_gene_table(dex_df, g["gene"] + ".dexseq.mapped.txt")
+	append_combined(dex_df, "combined.dexseq.majiq.mapped.txt")
+
+	delta_psi.close()
+	gff.close()
+
+	return g
+
+
+def map_majiq_A3_style(parts, junc_start, junc_end, dx_ID, dx_gff, ID, eventType):
+	g = parts.g
+	parts.flag(g.vs.find(junc_end[0]).index, g.vs.find(junc_end[1]).index, eventType, ID, dx_ID, dx_gff)
+	return dx_ID, dx_gff
+
+
+
+def map_majiq_A5_style(parts, junc_start, junc_end, dx_ID, dx_gff, ID, eventType):
+	g = parts.g
+	parts.flag(g.vs.find(junc_start[0]).index, g.vs.find(junc_start[1]).index, eventType, ID, dx_ID, dx_gff)
+	return dx_ID, dx_gff
+
+
+def map_majiq_RI(parts, junc_start, junc_end, dx_ID, dx_gff, ID, eventType):
+	g = parts.g
+	parts.flag(g.vs.find(junc_start[0]).index, g.vs.find(junc_end[0]).index, eventType, ID, dx_ID, dx_gff)
+	return dx_ID, dx_gff
+
+
+
+def map_rMATS_event_overhang(g, fromGTF, eventType, gff):
+	"""
+	Takes a fromGTF.event.txt rMATS output file and reads it. This function will take the coordinates of rMATS events in
+	order to create edges on the igraph object that map those events with corresponding DEXSeq fragments. The goal is to
+	map DEXSeq fragments that should be differentially expressed when alternative splicing (AS) events occur. This
+	function specifically works with AS events that produce an overhang (A3SS and A5SS). Sometimes, an overhang may span
+	over multiple DEXSeq fragments. This function accounts for that by iterating over the indices of nodes between the
+	start and end coordinates of the rMATS event. Bifurcating paths of A3SS or A5SS events will be labelled "rmats
+	short" or "rmats long", matching the fromGTF.event.txt file. The difference between the long exon and short exon
+	will represent the overhang, and DEXSeq fragments spanning that overhang will be labelled with an edge attribute
+	matching the rMATS event. In addition, this function will take the original fromGTF.event.txt input file and append
+	a new column "DexseqFragment" that lists which DEXSeq exonic part number maps specifically to each rMATS event.
+	This modified file will be output to the output directory specified in the command line arguments.
+
+	:param g: igraph object that has been imported from the graphml object read into this program
+	:param fromGTF: rMATS fromGTF.event.txt file that will be used to label DEXSeq edges on the igraph object with
+					corresponding rMATS events. This will then be converted to a dataframe, and a column will be
+					appended that will map rMATS event ID to DEXSeq fragment(s)
+	:param eventType: Tracks rMATS event type (A3SS or A5SS) to label edges on the igrpah object appropriately
+	:return: igraph object after the rMATS labels have been added to the DEXSeq edges appropriately.
+	"""
+	with profile_stage("read_tables"):
+		rmats_df = pd.read_csv(fromGTF, dtype=str, sep='\t')
+		gff.seek(0)
+		dex_df = pd.read_csv(gff, dtype=str, header=None, skiprows=1, sep=r'\s+')
+		fromGTF.seek(0)
+
+	dx_ID = {} # dictionary that maps {rMATS ID: [dexseq fragments]}
+	dx_gff = {} # dictionary that maps {dexseq fragment: [rMATS IDs]}
+	ID = [] # lists ID #s of every line in the fromGTF
+	longES = [] # lists long exon start coordinates of every line in the fromGTF
+	longEE = [] # lists long exon end coordinates of every line in the fromGTF
+	shortES = [] # lists short exon start coordinates of every line in the fromGTF
+	shortEE = [] # lists short exon end coordinates of every line in the fromGTF
+
+	for x in fromGTF:
+		if x.split()[0] == "ID":
+			continue
+		dx_ID[x.split()[0]] = []
+		ID.append(x.split()[0])
+		longES.append(x.split()[5])
+		longEE.append(x.split()[6])
+		shortES.append(x.split()[7])
+		shortEE.append(x.split()[8])
+
+	parts = ExonicParts(g)
+	for x in range(len(longES)):
+		# incrementing values in order to map rMATS coordinate to DEXSeq coordinates (0 index vs 1 index)
+		longES[x] = str(int(longES[x]) + 1)
+		longEE[x] = str(int(longEE[x]) + 1)
+		shortES[x] = str(int(shortES[x]) + 1)
+		shortEE[x] = str(int(shortEE[x]) + 1)
+		if eventType == "A3SS":
+			# finds the edge that spans the vertex labelled with longES coordinates to the vertex labelled with longEE coordinates
+			# ultimately labels the edge that corresponds to the rMATS long edge
+			parts.label_rmats(longES[x], longEE[x], "rmats long")
+			# finds the edge that spans the vertex labelled with shortES coordinates to the vertex labelled with shortEE coordinates
+			# ultimately labels the edge that corresponds to the rMATS short edge
+			parts.label_rmats(shortES[x], shortEE[x], "rmats short")
+
+			# cannot assume longES = shortES or longEE = shortEE since gene strandedness (+/-) affects the layout of the graph
+			if longES[x] == shortES[x]:
+				# for every adjacent pair of nodes (aka every dexseq fragment edge) from the beginning to the end of the overhang,
+				# label that edge with an eventType attribute. In addition, append the dexseq fragment label at that edge to the
+				# dx_ID dictionary {rMATS ID: [dexseq fragment list]}
+				parts.flag(g.vs.find(longEE[x]).index, g.vs.find(shortEE[x]).index, eventType, ID[x], dx_ID, dx_gff)
+
+			# cannot assume longES = shortES or longEE = shortEE since gene strandedness (+/-) affects the layout of the graph.
+			# works exactly the same as longES[x] == shortES[x], but in reverse order
+			if longEE[x] == shortEE[x]:
+				parts.flag(g.vs.find(longES[x]).index, g.vs.find(shortES[x]).index, eventType, ID[x], dx_ID, dx_gff)
+		if eventType == "A5SS":
+			# works exactly the same as A3SS events, but in reverse order (A5SS and A3SS are on opposite sides of the exon)
+			parts.label_rmats(longEE[x], longES[x], "rmats long")
+			parts.label_rmats(shortEE[x], shortES[x], "rmats short")
+			if longES[x] == shortES[x]:
+				parts.flag(g.vs.find(shortEE[x]).index, g.vs.find(longEE[x]).index, eventType, ID[x], dx_ID, dx_gff)
+			if longEE[x] == shortEE[x]:
+				parts.flag(g.vs.find(shortES[x]).index, g.vs.find(longES[x]).index, eventType, ID[x], dx_ID, dx_gff)
+	g = parts.save()
+
+	for x in dx_ID:
+		dx_ID[x] = ','.join(dx_ID[x])
+
+	for x in dx_gff:
+		dx_gff[x] = ','.join(dx_gff[x])
+
+	rmats_df['DexseqFragment'] = rmats_df['ID'].map(dx_ID)
+	rmats_df = rmats_df[["GeneID", "ID", "DexseqFragment"]]
+	save_gene_table(rmats_df, "fromGTF_" + g["gene"] + "." + eventType + ".txt")
+	append_combined(rmats_df, "combined.fromGTF." + eventType + ".txt")
+
+	dex_df[14] = dex_df[13].map(dx_gff)
+	dex_df = dex_df[[9, 13, 14]].rename(columns={9: "GeneID", 13: "DexseqFragment", 14: "rMATS_ID_" + eventType})
+	dex_df["DexseqFragment"] = "E" + dex_df["DexseqFragment"].astype(str)
+	dex_df["GeneID"] = dex_df["GeneID"].str.replace(r";", "", regex=True)
+	save_gene_table(dex_df, g["gene"] + ".dexseq." + eventType + ".mapped.txt")
+	append_combined(dex_df, "combined.dexseq." + eventType + ".mapped.txt")
+
+	return g
+
+
+
+def map_rMATS_event_full_fragment(g, fromGTF, eventType, gff):
+	"""
+	Takes a fromGTF.event.txt rMATS output file and reads it. This function will take the coordinates of rMATS events in
+	order to create edges on the igraph object that map those events with corresponding DEXSeq fragments. The goal is to
+	map DEXSeq fragments that should be differentially expressed when alternative splicing (AS) events occur. This
+	function specifically works with AS events that span a full exon (RI and SE). Sometimes, an exon may span over
+	multiple DEXSeq fragments. This function accounts for that by iterating over the indices of nodes between the start
+	and end coordinates of the rMATS event. DEXSeq fragments spanning the SE/RI exon will be labelled with an edge
+	attribute matching the rMATS event. In addition, this function will take the original fromGTF.event.txt input file
+	and append a new column "DexseqFragment" that lists which DEXSeq exonic part number maps specifically to each rMATS
+	event. This modified file will be output to the output directory specified in the command line arguments.
+
+	:param g: igraph object that has been imported from the graphml object read into this program
+	:param fromGTF: rMATS fromGTF.event.txt file that will be used to label DEXSeq edges on the igraph object with
+					corresponding rMATS events. This will then be converted to a dataframe, and a column will be
+					appended that will map rMATS event ID to DEXSeq fragment(s)
+	:param eventType: Tracks rMATS event type (SE or RI) to label edges on the igrpah object appropriately
+	:return: igraph object after the rMATS labels have been added to the DEXSeq edges appropriately.
+	"""
+	with profile_stage("read_tables"):
+		rmats_df = pd.read_csv(fromGTF, dtype=str, sep='\t')
+		gff.seek(0)
+		dex_df = pd.read_csv(gff, dtype=str, header=None, skiprows=1, sep=r'\s+')
+		fromGTF.seek(0)
+
+	dx_ID = {} # dictionary that maps {rMATS ID: [dexseq fragments]}
+	dx_gff = {} # dictionary that maps {dexseq fragment: [rMATS IDs]}
+	ID = [] # lists ID #s of every line in the fromGTF
+	exonStart = [] # lists exon start coordinates of every line in the fromGTF
+	exonEnd = [] # lists exon end coordinates of every line in the fromGTF
+
+	for x in fromGTF:
+		if x.split()[0] == "ID":
+			continue
+		dx_ID[x.split()[0]] = []
+		ID.append(x.split()[0])
+		exonStart.append(x.split()[5])
+		exonEnd.append(x.split()[6])
+
+	parts = ExonicParts(g)
+	for x in range(len(exonStart)):
+		exonStart[x] = str(int(exonStart[x]) + 1)
+		exonEnd[x] = str(int(exonEnd[x]) + 1)
+		# strand affects directionality of graph
+		if g["strand"] == '+':
+			# for every dexseq fragment edge from the beginning to the end of the exon, label that edge with an eventType
+			# attribute. In addition, append the dexseq fragment label at that edge to the dx_ID dictionary
+			# {rMATS ID: [dexseq fragment list]}
+			parts.flag(g.vs.find(exonStart[x]).index, g.vs.find(exonEnd[x]).index, eventType, ID[x], dx_ID, dx_gff)
+		# works exactly the same as strand == +, but in the reverse direction
+		if g["strand"] == '-':
+			parts.flag(g.vs.find(exonEnd[x]).index, g.vs.find(exonStart[x]).index, eventType, ID[x], dx_ID, dx_gff)
+	g = parts.save()
+
+	for x in dx_ID:
+		dx_ID[x] = ','.join(dx_ID[x])
+
+	for x in dx_gff:
+		dx_gff[x] = ','.join(dx_gff[x])
+
+	rmats_df['DexseqFragment'] = rmats_df['ID'].map(dx_ID)
+	rmats_df = rmats_df[["GeneID", "ID", "DexseqFragment"]]
+	save_gene_table(rmats_df, "fromGTF_" + g["gene"] + "." + eventType + ".txt")
+	append_combined(rmats_df, "combined.fromGTF." + eventType + ".txt")
+
+	dex_df[14] = dex_df[13].map(dx_gff)
+	dex_df = dex_df[[9, 13, 14]].rename(columns={9: "GeneID", 13: "DexseqFragment", 14: "rMATS_ID_" + eventType})
+	dex_df["DexseqFragment"] = "E" + dex_df["DexseqFragment"].astype(str)
+	dex_df["GeneID"] = dex_df["GeneID"].str.replace(r";", "", regex=True)
+	save_gene_table(dex_df, g["gene"] + ".dexseq." + eventType + ".mapped.txt")
+	append_combined(dex_df, "combined.dexseq." + eventType + ".mapped.txt")
+
+	return g
+
+
+
+def map_rMATS(g, gff, fromGTF_A3SS, fromGTF_A5SS, fromGTF_SE, fromGTF_RI):
+	g.es["events"] = 0
+	g["mapper"] = "rmats"
+
+	if fromGTF_A3SS:
+		with profile_stage("map_rMATS.A3SS"):
+			g = map_rMATS_event_overhang(g, fromGTF_A3SS, "A3SS", gff)
+		fromGTF_A3SS.close()
+	if fromGTF_A5SS:
+		with profile_stage("map_rMATS.A5SS"):
+			g = map_rMATS_event_overhang(g, fromGTF_A5SS, "A5SS", gff)
+		fromGTF_A5SS.close()
+	if fromGTF_SE:
+		with profile_stage("map_rMATS.SE"):
+			g = map_rMATS_event_full_fragment(g, fromGTF_SE, "SE", gff)
+		fromGTF_SE.close()
+	if fromGTF_RI:
+		with profile_stage("map_rMATS.RI"):
+			g = map_rMATS_event_full_fragment(g, fromGTF_RI, "RI", gff)
+		fromGTF_RI.close()
+
+	gff.close()
 
 	return g
 		
 		
 
-def style_and_plot(g, gene):
+# The visual style of the gene graphs, by the ex_or_in of their edges (None for the DEXSeq exonic parts) and, for the
+# curvature, by splicing software. The png plots and the graph viewer draw the graphs with the same style.
+EDGE_COLORS = {"ex": "purple", "in": "grey", "NA": "black", None: "dark green"}
+EDGE_WIDTHS = {"ex": 10, "in": 4, "NA": 2, None: 10}
+EDGE_CURVATURES = {'r': {"ex": -0.3, "in": 0, "NA": False, None: 0}, 'm': {"ex": -0.2, "in": -0.2, "NA": False, None: 0}}
+PLOT_BBOX = (3500, 1000)
+PLOT_MARGIN = 100
+PLOT_LABEL_SIZE = 65
+PLOT_LABEL_DIST = 1.7
+
+
+
+def style_and_plot(g, gene):
+	"""
+	Plots a mapped gene's graph to its graph.<gene>.png, or with --plot viewer, only lays it out for the graph viewer.
+	:return: {combined graph viewer file: DataFrame} of the gene with --plot viewer, otherwise {}
+	"""
+	for vertex in g.vs:
+		vertex['id'] = vertex['id'].strip('n')
+		if vertex['name'] == 'R':
+			vertex['id'] = 'R'
+		if vertex['name'] == 'L':
+			vertex['id'] = 'L'
+
+	# the exonic part number and the event types mapped to it, e.g. "003\nA3SS SE"
+	event_labels = ["A3SS", " A5SS", " SE", " RI"]
+	edge_labels = [g["fragments"][fragment] + '\n' + ''.join(label for bit, label in enumerate(event_labels) if events >> bit & 1)
+				   for fragment, events in zip(g.es["fragment"], g.es["events"])]
+
+	order_dict = {}
+	order_num = 0
+	for name in g.vs['name']:
+		order_dict[name] = name
+		order_num += 1
+	order_dict["L"] = "100000000000"
+	order_dict["R"] = "0"
+	for name in order_dict:
+		order_dict[name] = int(order_dict[name])
+
+	curved_dict = EDGE_CURVATURES[args.splicing_software]
+	visual_style = {"edge_curved": [curved_dict[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
+					"edge_color": [EDGE_COLORS[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
+					"edge_width": [EDGE_WIDTHS[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
+					"order": [order_dict[order] for order in g.vs["name"]],
+					"vertex_label": g.vs["id"], "vertex_label_size": PLOT_LABEL_SIZE, "vertex_label_dist": PLOT_LABEL_DIST,
+					"vertex_shape": "hidden",
+					"edge_label": edge_labels, "edge_label_size": PLOT_LABEL_SIZE,
+					"edge_arrow_size": 0.001,
+					"bbox": PLOT_BBOX, "margin": PLOT_MARGIN
+					}
+	if args.splicing_software == 'r':
+		visual_style["edge_lty"] = "dashed"
+
+	with profile_stage("layout"):
+		layout = gene_layout(g)
+		layout.rotate(270)
+
+	rows = {}
+	if args.plot == "viewer":
+		with profile_stage("graph_viewer"):
+			rows = graph_viewer_rows(g, layout)
+	else:
+		with profile_stage("render_png"):
+			save_gene_plot(g, gene, "graph." + g["gene"] + ".png", layout, visual_style)
+	if args.output_profile == "full":
+		with profile_stage("write_graphml"):
+			save_gene_graphml(export_graph(g), gene, f"{g['gene']}.graphml")
+
+	return rows
+
+
+
+# The Sugiyama layouts of the gene graphs are cached on disk, one .npy file of vertex coordinates per graph, named by
+# a hash of the graph's topology (its vertex names and edges). A gene's annotation graph is the same for every contrast
+# and rerun, so re-plotting it only costs the drawing. The least recently used layouts beyond --layout-cache-mb are
+# removed by trim_layout_cache at the end of the gene stage.
+LAYOUT_CACHE_DIR = "layout_cache"
+
+
+
+def layout_cache_dir():
+	if args.layout_cache:
+		return args.layout_cache
+	return os.path.join(os.path.abspath(os.path.join(args.gene_files_directory, os.pardir)), LAYOUT_CACHE_DIR)
+
+
+
+def topology_key(g):
+	"""
+	:return: hash of the vertex names and edges of g, independent of the order of its vertices and edges
+	"""
+	names = g.vs["name"]
+	edges = sorted(names[source] + "\t" + names[target] for source, target in g.get_edgelist())
+	return hashlib.sha1(("\n".join(sorted(names)) + "\n\n" + "\n".join(edges)).encode()).hexdigest()
+
+
+
+def gene_layout(g):
+	"""
+	:return: the Sugiyama layout of g, from the layout cache if a graph of the same topology was laid out before
+	"""
+	if args.layout_cache_mb <= 0:
+		return g.layout_sugiyama()
+	path = os.path.join(layout_cache_dir(), topology_key(g) + ".npy")
+	# the coordinates of the vertices are stored in the order of their sorted names, followed by those of the dummy
+	# vertices the layout adds to edges spanning several layers
+	order = np.argsort(g.vs["name"], kind="stable")
+	try:
+		coords = np.load(path)
+		if coords.shape[0] >= len(order):
+			os.utime(path)
+			coords[np.concatenate([order, np.arange(len(order), coords.shape[0])])] = coords.copy()
+			return ig.Layout(coords.tolist())
+	except (OSError, ValueError):
+		pass
+
+	layout = g.layout_sugiyama()
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		coords = np.array(layout.coords)
+		with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+			np.save(f, np.concatenate([coords[order], coords[len(order):]]))
+		os.replace(f.name, path)
+	except OSError:
+		pass
+	return layout
+
+
+
+def trim_layout_cache():
+	# removes the least recently used layouts until the cache fits in --layout-cache-mb
+	directory = layout_cache_dir()
+	if args.layout_cache_mb <= 0 or not os.path.isdir(directory):
+		return
+	files = []
+	for entry in os.scandir(directory):
+		if entry.name.endswith(".npy"):
+			stat = entry.stat()
+			files.append((stat.st_mtime, stat.st_size, entry.path))
+	size = sum(file[1] for file in files)
+	for mtime, file_size, path in sorted(files):
+		if size <= args.layout_cache_mb * 2 ** 20:
+			break
+		with contextlib.suppress(OSError):
+			os.remove(path)
+		size -= file_size
+
+
+
+# The exon-event relation of the results is saved as a sparse incidence matrix, results/incidence.npz: DEXSeq exonic
+# parts x rMATS / MAJIQ events in CSR form (indptr, indices), with the integer codes of the rows and columns given by
+# the ID arrays exon_gene / exon_part and event_gene / event_id. It is a plain .npz (numpy.load) and can be used
+# without GrASE, or through IncidenceMatrix.load.
+INCIDENCE_FILE = "incidence.npz"
+
+
+
+class IncidenceMatrix:
+	"""
+	Boolean exonic parts x events matrix in CSR form. Exons and events are numbered in sorted (gene, ID) order.
+	"""
+
+	def __init__(self, indptr, indices, exon_gene, exon_part, event_gene, event_id):
+		self.indptr = indptr
+		self.indices = indices
+		self.exon_gene = exon_gene
+		self.exon_part = exon_part
+		self.event_gene = event_gene
+		self.event_id = event_id
+		self.shape = (len(exon_part), len(event_id))
+		self._transposed = None
+
+	@classmethod
+	def from_pairs(cls, exons, pairs, events=None):
+		"""
+		:param exons: DataFrame (gene, exonic part) of all exonic parts, including those without events
+		:param pairs: DataFrame (gene, exonic part, event) of the exon-event incidences
+		:param events: DataFrame (gene, event) of all events, including those without exonic parts
+		"""
+		exons = pd.concat([exons.set_axis(["gene", "part"], axis=1), pairs.iloc[:, :2].set_axis(["gene", "part"], axis=1)])
+		exons = exons.dropna().drop_duplicates().sort_values(by=["gene", "part"])
+		events = pd.concat(([] if events is None else [events.set_axis(["gene", "event"], axis=1)])
+						   + [pairs.iloc[:, [0, 2]].set_axis(["gene", "event"], axis=1)])
+		events = events.dropna().drop_duplicates().sort_values(by=["gene", "event"])
+		rows = pd.MultiIndex.from_frame(exons).get_indexer(pd.MultiIndex.from_frame(pairs.iloc[:, :2]))
+		columns = pd.MultiIndex.from_frame(events).get_indexer(pd.MultiIndex.from_frame(pairs.iloc[:, [0, 2]]))
+		order = np.lexsort((columns, rows))
+		indptr = np.zeros(len(exons) + 1, dtype=np.int64)
+		np.cumsum(np.bincount(rows, minlength=len(exons)), out=indptr[1:])
+		return cls(indptr, columns[order].astype(np.int32), exons["gene"].to_numpy(dtype=str), exons["part"].to_numpy(dtype=str),
+				   events["gene"].to_numpy(dtype=str), events["event"].to_numpy(dtype=str))
+
+	def save(self, path):
+		with open(path, "wb") as f:
+			np.savez_compressed(f, indptr=self.indptr, indices=self.indices, exon_gene=self.exon_gene, exon_part=self.exon_part,
+								event_gene=self.event_gene, event_id=self.event_id)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as data:
+			return cls(data["indptr"], data["indices"], data["exon_gene"], data["exon_part"], data["event_gene"], data["event_id"])
+
+	def gene_range(self, first=None, last=None):
+		"""
+		:return: the matrix of the genes from first (included) to last (excluded), None leaving the range open. Every
+		incidence is within a gene, so the rows and columns of a range of genes are contiguous
+		"""
+		def bounds(genes):
+			return (0 if first is None else np.searchsorted(genes, first),
+					len(genes) if last is None else np.searchsorted(genes, last))
+
+		r0, r1 = bounds(self.exon_gene)
+		c0, c1 = bounds(self.event_gene)
+		return IncidenceMatrix(self.indptr[r0:r1 + 1] - self.indptr[r0], (self.indices[self.indptr[r0]:self.indptr[r1]] - c0).astype(np.int32),
+							   self.exon_gene[r0:r1], self.exon_part[r0:r1], self.event_gene[c0:c1], self.event_id[c0:c1])
+
+	def exon_rows(self):
+		# the row of every stored incidence
+		return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+	def transposed(self):
+		"""
+		:return: (indptr, indices) of the events x exons matrix (CSC of this one)
+		"""
+		if self._transposed is None:
+			order = np.argsort(self.indices, kind="stable")
+			indptr = np.zeros(self.shape[1] + 1, dtype=np.int64)
+			np.cumsum(np.bincount(self.indices, minlength=self.shape[1]), out=indptr[1:])
+			self._transposed = (indptr, self.exon_rows()[order].astype(np.int32))
+		return self._transposed
+
+	def events_of(self, exon):
+		return self.indices[self.indptr[exon]:self.indptr[exon + 1]]
+
+	def exons_of(self, event):
+		indptr, indices = self.transposed()
+		return indices[indptr[event]:indptr[event + 1]]
+
+	def exon_degree(self):
+		return np.diff(self.indptr)
+
+	def event_degree(self):
+		return np.bincount(self.indices, minlength=self.shape[1])
+
+	def events_with_any(self, exon_mask):
+		"""
+		:param exon_mask: boolean per exon (e.g. DEXSeq padj <= .05)
+		:return: boolean per event, True if any of its exons is in exon_mask (the product M^T x > 0)
+		"""
+		return np.bincount(self.indices, weights=np.repeat(exon_mask, np.diff(self.indptr)), minlength=self.shape[1]) > 0
+
+	def exons_with_any(self, event_mask):
+		"""
+		:param event_mask: boolean per event (e.g. rMATS FDR <= .05)
+		:return: boolean per exon, True if any of its events is in event_mask (the product M x > 0)
+		"""
+		return np.bincount(self.exon_rows(), weights=event_mask[self.indices], minlength=self.shape[0]) > 0
+
+
+
+def exonic_parts(dexseqResults, exon_tables):
+	"""
+	:return: DataFrame (GeneID, DexseqFragment) of the exonic parts of the DEXSeq results and of the exon -> events tables
+	"""
+	return pd.concat([dexseqResults[["groupID", "featureID"]].set_axis(["GeneID", "DexseqFragment"], axis=1)]
+					 + [df[["GeneID", "DexseqFragment"]] for df in exon_tables]).dropna().drop_duplicates()
+
+
+
+def save_incidence(output_dir, dexseqResults, exon_tables, event_tables, event_column):
+	"""
+	Builds the incidence matrix from the comma-joined DexseqFragment column of the event -> exon tables and saves it
+	to results/incidence.npz. Its rows are the exonic parts of the DEXSeq results and of the exon -> events tables, and
+	the fragments of the events that are not exonic parts (MAJIQ's novel_junc); its columns are the events of the
+	event -> exon tables.
+	:return: the matrix, and its pairs (GeneID, DexseqFragment, event ID, event_position): by event, in the order of the
+	event's comma-joined exonic parts, event_position being the place of the event in its exonic part's comma-joined
+	events (the event types one after the other, as results_partial joins them)
+	"""
+	events = pd.concat(event_tables)[["GeneID", event_column, "DexseqFragment"]]
+	pairs = events.assign(DexseqFragment=events["DexseqFragment"].str.split(",")).explode("DexseqFragment")
+	pairs = pairs[pairs["DexseqFragment"].notna() & (pairs["DexseqFragment"] != "")][["GeneID", "DexseqFragment", event_column]]
+
+	exon_events = []
+	for df in exon_tables:
+		ids = [column for column in df.columns if column not in ("GeneID", "DexseqFragment")][0]
+		exon_events.append(df[["GeneID", "DexseqFragment", ids]].set_axis(["GeneID", "DexseqFragment", event_column], axis=1))
+	exon_events = pd.concat(exon_events, ignore_index=True)
+	exon_events = exon_events.assign(**{event_column: exon_events[event_column].str.split(",")}).explode(event_column)
+	exon_events["event_position"] = exon_events.groupby(["GeneID", "DexseqFragment"]).cumcount()
+	exon_events = exon_events.drop_duplicates(subset=["GeneID", "DexseqFragment", event_column])
+	pairs = pairs.merge(exon_events, how="left", on=["GeneID", "DexseqFragment", event_column])
+
+	incidence = IncidenceMatrix.from_pairs(exonic_parts(dexseqResults, exon_tables), pairs.iloc[:, :3], events[["GeneID", event_column]])
+	incidence.save(output_dir + "/" + INCIDENCE_FILE)
+	return incidence, pairs
+
+
+
+# With --edge-table, the vertices and edges of the annotated graphs of all genes are written to results/edge_table as
+# one .npz per chromosome, so that they can be read with a single numpy.load instead of parsing every gene's GraphML.
+# The workers append each mapped gene's rows to the combined files combined.edge_table.vertices.txt / .edges.txt,
+# which write_edge_table partitions by chromosome at the end of the run. In every .npz, genes are in sorted order and
+# vertex_offsets / edge_offsets delimit each gene's rows; a vertex is its coordinate (-1 for R and L, the first and last
+# vertex of every gene), an edge its source and target vertex (numbered from 0 within the gene, as in the GraphML), its
+# start / end / width (-1 if NA), ex_or_in as an index into edge_types, its event flags as a bitmask (bit i set for
+# edge_flag_names[i]) and the number of its DEXSeq exonic part (0 if none).
+EDGE_TABLE_DIR = "edge_table"
+EDGE_TYPES = ["ex", "in", "NA", "None"]
+EDGE_TABLE_FILES = {"combined.edge_table.vertices.txt": ["gene", "chrom", "strand", "coord"],
+					"combined.edge_table.edges.txt": ["gene", "source", "target", "start", "end", "width", "type", "flags", "fragment"]}
+
+
+
+def edge_type_codes(g):
+	# the ex_or_in of every edge of g as an index into EDGE_TYPES
+	edge_types = {ex_or_in: code for code, ex_or_in in enumerate(EDGE_TYPES)}
+	edge_types[None] = edge_types["None"]
+	return [edge_types[ex_or_in] for ex_or_in in g.es["ex_or_in"]]
+
+
+
+def edge_table_rows(g):
+	"""
+	:return: {combined edge table file: DataFrame} of the vertices and edges of a mapped gene's graph
+	"""
+	def coordinate(values):
+		return [-1 if value is None or np.isnan(value) else int(value) for value in values]
+
+	vertices = pd.DataFrame({"gene": g["gene"], "chrom": g["chrom"], "strand": g["strand"],
+							 "coord": [-1 if name in ("R", "L") else int(name) for name in g.vs["name"]]})
+	edges = pd.DataFrame({"gene": g["gene"], "source": [e.source for e in g.es], "target": [e.target for e in g.es],
+						  "start": coordinate(g.es["start"]), "end": coordinate(g.es["end"]), "width": coordinate(g.es["width"]),
+						  "type": edge_type_codes(g), "flags": g.es["events"],
+						  "fragment": [int(g["fragments"][fragment]) if fragment else 0 for fragment in g.es["fragment"]]})
+	return {"combined.edge_table.vertices.txt": vertices, "combined.edge_table.edges.txt": edges}
+
+
+
+def read_combined_edge_table(path, columns):
+	# the combined file without the header line every gene's rows start with
+	df = pd.read_table(path, dtype=str)
+	df = df[df["gene"] != "gene"]
+	return df.astype({column: np.int64 for column in columns if column not in ("gene", "chrom", "strand")})
+
+
+
+def write_edge_table(grase_output_dir):
+	"""
+	Partitions the combined edge table files by chromosome into results/edge_table/<chrom>.npz.
+	:return: number of genes written
+	"""
+	tmp_dir = grase_output_dir + "/results/tmp/"
+	vertices, edges = [read_combined_edge_table(tmp_dir + file, columns) for file, columns in EDGE_TABLE_FILES.items()]
+	# the rows of a gene are consecutive; sorting by gene keeps the order of its vertices and edges
+	vertices = vertices.sort_values(by="gene", kind="stable")
+	edges = edges.sort_values(by="gene", kind="stable")
+	genes = vertices.drop_duplicates(subset="gene")[["gene", "chrom", "strand"]]
+
+	output_dir = grase_output_dir + "/results/" + EDGE_TABLE_DIR
+	shutil.rmtree(output_dir, ignore_errors=True)
+	os.makedirs(output_dir)
+	for chrom, chrom_genes in genes.groupby("chrom", sort=True):
+		chrom_vertices = vertices[vertices["chrom"] == chrom]
+		chrom_edges = edges[edges["gene"].isin(chrom_genes["gene"])]
+		gene_ids = chrom_genes["gene"].to_numpy(dtype=str)
+		vertex_offsets = np.zeros(len(gene_ids) + 1, dtype=np.int64)
+		np.cumsum(chrom_vertices.groupby("gene", sort=True).size().reindex(gene_ids).to_numpy(), out=vertex_offsets[1:])
+		edge_offsets = np.zeros(len(gene_ids) + 1, dtype=np.int64)
+		np.cumsum(chrom_edges.groupby("gene", sort=True).size().reindex(gene_ids, fill_value=0).to_numpy(), out=edge_offsets[1:])
+		with open(os.path.join(output_dir, chrom + ".npz"), "wb") as f:
+			np.savez(f, genes=gene_ids, gene_strand=chrom_genes["strand"].to_numpy(dtype=str),
+					 vertex_offsets=vertex_offsets, vertex_coord=chrom_vertices["coord"].to_numpy(dtype=np.int64),
+					 edge_offsets=edge_offsets, edge_source=chrom_edges["source"].to_numpy(dtype=np.int32),
+					 edge_target=chrom_edges["target"].to_numpy(dtype=np.int32), edge_start=chrom_edges["start"].to_numpy(dtype=np.int64),
+					 edge_end=chrom_edges["end"].to_numpy(dtype=np.int64), edge_width=chrom_edges["width"].to_numpy(dtype=np.int64),
+					 edge_type=chrom_edges["type"].to_numpy(dtype=np.int8), edge_flags=chrom_edges["flags"].to_numpy(dtype=np.uint8),
+					 edge_fragment=chrom_edges["fragment"].to_numpy(dtype=np.int32), edge_types=np.array(EDGE_TYPES, dtype=str),
+					 edge_flag_names=np.array(EDGE_FLAGS, dtype=str))
+	return len(genes)
+
+
+
+def read_edge_table(path):
+	"""
+	Reads one chromosome of results/edge_table, or all of them if path is the directory.
+	:return: DataFrames of the vertices (gene, strand, vertex, coord) and edges (gene, source, target, start, end,
+	width, ex_or_in, flags, fragment) with the genes' IDs, chromosome and strand spelt out
+	"""
+	if os.path.isdir(path):
+		tables = [read_edge_table(os.path.join(path, file)) for file in sorted(os.listdir(path)) if file.endswith(".npz")]
+		return pd.concat([t[0] for t in tables], ignore_index=True), pd.concat([t[1] for t in tables], ignore_index=True)
+	chrom = os.path.basename(path)[:-len(".npz")]
+	with np.load(path) as data:
+		vertex_genes = np.repeat(np.arange(len(data["genes"])), np.diff(data["vertex_offsets"]))
+		edge_genes = np.repeat(np.arange(len(data["genes"])), np.diff(data["edge_offsets"]))
+		vertices = pd.DataFrame({"gene": data["genes"][vertex_genes], "chrom": chrom, "strand": data["gene_strand"][vertex_genes],
+								 "vertex": np.arange(len(vertex_genes)) - data["vertex_offsets"][vertex_genes],
+								 "coord": data["vertex_coord"]})
+		edges = pd.DataFrame({"gene": data["genes"][edge_genes], "source": data["edge_source"], "target": data["edge_target"],
+							  "start": data["edge_start"], "end": data["edge_end"], "width": data["edge_width"],
+							  "ex_or_in": data["edge_types"][data["edge_type"]], "flags": data["edge_flags"],
+							  "fragment": data["edge_fragment"]})
+	return vertices, edges
+
+
+
+# With --plot viewer, the gene graphs are not rendered: style_and_plot only lays them out, and the workers append each
+# mapped gene's vertices (label and position in the rotated layout) and edges (ex_or_in, event flags and DEXSeq exonic
+# part) to the combined files combined.graph_viewer.vertices.txt / .edges.txt. At the end of the run, write_graph_viewer
+# turns them into results/graph_viewer/graphs.json, laid out like the edge table: genes in sorted order, with
+# vertex_offsets / edge_offsets delimiting each gene's rows of the vertex_* and edge_* arrays, and the visual style of
+# the png plots. viewer.html, copied next to it from graph_viewer.html, draws any of the genes as SVG in the browser.
+GRAPH_VIEWER_DIR = "graph_viewer"
+GRAPH_VIEWER_HTML = "graph_viewer.html"
+GRAPH_VIEWER_FILES = {"combined.graph_viewer.vertices.txt": ["gene", "chrom", "strand", "label", "x", "y"],
+					  "combined.graph_viewer.edges.txt": ["gene", "source", "target", "type", "flags", "fragment"]}
+
+
+
+def graph_viewer_enabled():
+	# the minimal output profile skips the plotting, and with it the graph viewer
+	return args.plot == "viewer" and args.output_profile != "minimal"
+
+
+
+def graph_viewer_rows(g, layout):
+	"""
+	:param layout: the layout style_and_plot draws g with, whose first coordinates are those of the vertices of g
+	:return: {combined graph viewer file: DataFrame} of the vertices and edges of a mapped gene's graph
+	"""
+	coords = np.round(np.array(layout.coords)[:g.vcount()], 3)
+	vertices = pd.DataFrame({"gene": g["gene"], "chrom": g["chrom"], "strand": g["strand"], "label": g.vs["id"],
+							 "x": coords[:, 0], "y": coords[:, 1]})
+	edges = pd.DataFrame({"gene": g["gene"], "source": [e.source for e in g.es], "target": [e.target for e in g.es],
+						  "type": edge_type_codes(g), "flags": g.es["events"],
+						  "fragment": [g["fragments"][fragment] for fragment in g.es["fragment"]]})
+	return {"combined.graph_viewer.vertices.txt": vertices, "combined.graph_viewer.edges.txt": edges}
+
+
+
+def graph_viewer_style():
+	"""
+	:return: the visual style of style_and_plot for the edge types EDGE_TYPES, with the colours as CSS hex codes
+	"""
+	def hex_color(name):
+		return "#" + "".join(f"{round(255 * channel):02x}" for channel in ig.color_name_to_rgb(name))
+
+	edge_types = [None if edge_type == "None" else edge_type for edge_type in EDGE_TYPES]
+	return {"edge_color": [hex_color(EDGE_COLORS[edge_type]) for edge_type in edge_types],
+			"edge_width": [EDGE_WIDTHS[edge_type] for edge_type in edge_types],
+			"edge_curved": [float(EDGE_CURVATURES[args.splicing_software][edge_type]) for edge_type in edge_types],
+			"bbox": PLOT_BBOX, "margin": PLOT_MARGIN, "label_size": PLOT_LABEL_SIZE, "vertex_label_dist": PLOT_LABEL_DIST}
+
+
+
+def write_graph_viewer(grase_output_dir):
+	"""
+	Writes the combined graph viewer files to results/graph_viewer/graphs.json, with the viewer next to it.
+	:return: number of genes written
+	"""
+	tmp_dir = grase_output_dir + "/results/tmp/"
+	vertices, edges = [pd.read_table(tmp_dir + file, dtype=str, keep_default_na=False) for file in GRAPH_VIEWER_FILES]
+	# the combined files without the header line every gene's rows start with, the rows of a gene kept in order
+	vertices = vertices[vertices["gene"] != "gene"].sort_values(by="gene", kind="stable")
+	edges = edges[edges["gene"] != "gene"].sort_values(by="gene", kind="stable")
+	genes = vertices.drop_duplicates(subset="gene")
+	gene_ids = genes["gene"].to_numpy(dtype=str)
+	vertex_offsets = np.zeros(len(gene_ids) + 1, dtype=np.int64)
+	np.cumsum(vertices.groupby("gene", sort=True).size().reindex(gene_ids).to_numpy(), out=vertex_offsets[1:])
+	edge_offsets = np.zeros(len(gene_ids) + 1, dtype=np.int64)
+	np.cumsum(edges.groupby("gene", sort=True).size().reindex(gene_ids, fill_value=0).to_numpy(), out=edge_offsets[1:])
+
+	graphs = {"software": RESULTS_ADAPTERS[args.splicing_software].name, "edge_types": EDGE_TYPES,
+			  "edge_flag_names": EDGE_FLAGS, "style": graph_viewer_style(),
+			  "genes": gene_ids.tolist(), "gene_chrom": genes["chrom"].tolist(), "gene_strand": genes["strand"].tolist(),
+			  "vertex_offsets": vertex_offsets.tolist(), "vertex_label": vertices["label"].tolist(),
+			  "vertex_x": vertices["x"].astype(float).tolist(), "vertex_y": vertices["y"].astype(float).tolist(),
+			  "edge_offsets": edge_offsets.tolist(), "edge_source": edges["source"].astype(int).tolist(),
+			  "edge_target": edges["target"].astype(int).tolist(), "edge_type": edges["type"].astype(int).tolist(),
+			  "edge_flags": edges["flags"].astype(int).tolist(), "edge_fragment": edges["fragment"].tolist()}
+
+	output_dir = grase_output_dir + "/results/" + GRAPH_VIEWER_DIR
+	shutil.rmtree(output_dir, ignore_errors=True)
+	os.makedirs(output_dir)
+	with open(output_dir + "/graphs.json", "w") as f:
+		json.dump(graphs, f, separators=(",", ":"))
+	shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), GRAPH_VIEWER_HTML), output_dir + "/viewer.html")
+	return len(gene_ids)
+
+
+
+# The results are computed in chunks of whole genes: every join of the results functions includes the gene ID, and
+# every incidence is within a gene, so the results tables are the concatenation of the chunks' tables and the counts of
+# summary.txt / intersections.txt, reductions of each chunk's slice of the incidence matrix, add up over the chunks.
+# With --nthread > 1 the tables and the matrix are split before the pool is started, so the workers inherit the chunks
+# read-only on fork instead of receiving pickled copies, and the parent only sums and concatenates.
+RESULTS_CHUNKS_PER_THREAD = 4
+
+_results_adapter = None
+_results_chunks = []
+_results_incidence = []
+
+
+
+def split_by_gene(tables, gene_columns, num_chunks):
+	"""
+	Splits tables into num_chunks chunks of consecutive (sorted) gene IDs.
+	:param gene_columns: the gene ID column of every table
+	:return: list of chunks, each a list with the rows of every table that belong to the chunk's genes, and the first
+	gene ID of every chunk but the first
+	"""
+	# rMATS quotes its gene IDs
+	keys = [table[column].str.strip().str.strip('"') for table, column in zip(tables, gene_columns)]
+	genes = np.unique(np.concatenate([key.dropna().to_numpy(dtype=str) for key in keys]))
+	num_chunks = max(1, min(num_chunks, len(genes)))
+	bounds = genes[[len(genes) * i // num_chunks for i in range(1, num_chunks)]]
+	chunks = [[] for _ in range(num_chunks)]
+	for table, key in zip(tables, keys):
+		chunk_ids = np.searchsorted(bounds, key.fillna("").to_numpy(dtype=str), side="right")
+		groups = dict(iter(table.groupby(chunk_ids, sort=True)))
+		for i in range(num_chunks):
+			chunks[i].append(groups.get(i, table.iloc[:0]))
+	return chunks, bounds
+
 
-	for vertex in g.vs:
-		vertex['id'] = vertex['id'].strip('n')
-		if vertex['name'] == 'R':
-			vertex['id'] = 'R'
-		if vertex['name'] == 'L':
-			vertex['id'] = 'L'
 
-	edge_labels = []
+def results_chunk_task(i):
+	tables = {}
+	counts = results_partial(_results_adapter, tables.__setitem__, _results_incidence[i], *_results_chunks[i])
+	return counts, tables
 
-	for x in range(len(g.es)):
-		if g.es[x]["A3SS"] == True:
-			A3SS = "A3SS"
-		else:
-			A3SS = ""
-		if g.es[x]["A5SS"] == True:
-			A5SS = " A5SS"
-		else:
-			A5SS = ""
-		if g.es[x]["SE"] == True:
-			SE = " SE"
-		else:
-			SE = ""
-		if g.es[x]["RI"] == True:
-			RI = " RI"
-		else:
-			RI = ""
 
-		edge_labels.append(g.es["dexseq_fragment"][x] + '\n' + A3SS + A5SS + SE + RI)
 
-	color_dict = {"ex": "purple", "in": "grey", "NA": "black", None: "dark green"}
-	width_dict = {"ex": 10, "in": 4, "NA": 2, None: 10}
-	order_dict = {}
-	order_num = 0
-	for name in g.vs['name']:
-		order_dict[name] = name
-		order_num += 1
-	order_dict["L"] = "100000000000"
-	order_dict["R"] = "0"
-	for name in order_dict:
-		order_dict[name] = int(order_dict[name])
+def concat_parts(parts):
+	# empty chunks are left out so that they do not change the dtypes of the concatenated columns
+	nonempty = [part for part in parts if len(part)] or parts[:1]
+	if len(nonempty) == 1:
+		return nonempty[0]
+	return pd.concat(nonempty)
 
-	if args.splicing_software == 'r':
-		curved_dict = {"ex": -0.3, "in": 0, "NA": False, None: 0}
-		visual_style = {"edge_curved": [curved_dict[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
-						"edge_color": [color_dict[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
-						"edge_width": [width_dict[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
-						"order": [order_dict[order] for order in g.vs["name"]],
-						"vertex_label": g.vs["id"], "vertex_label_size": 65, "vertex_label_dist": 1.7,
-						"edge_lty": "dashed",
-						"vertex_shape": "hidden",
-						"edge_label": edge_labels, "edge_label_size": 65,
-						"edge_arrow_size": 0.001,
-						"bbox": (3500, 1000), "margin": 100
-						}
-	elif args.splicing_software == 'm':
-		curved_dict = {"ex": -0.2, "in": -0.2, "NA": False, None: 0}
-		visual_style = {"edge_curved": [curved_dict[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
-						"edge_color": [color_dict[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
-						"edge_width": [width_dict[ex_or_in] for ex_or_in in g.es["ex_or_in"]],
-						"order": [order_dict[order] for order in g.vs["name"]],
-						"vertex_label": g.vs["id"], "vertex_label_size": 65, "vertex_label_dist": 1.7,
-						"vertex_shape": "hidden",
-						"edge_label": edge_labels, "edge_label_size": 65,
-						"edge_arrow_size": 0.001,
-						"bbox": (3500, 1000), "margin": 100
-						}
 
-	layout = g.layout_sugiyama()
-	layout.rotate(270)
 
-	ig.plot(g, gene + "/output/graph." + g["gene"] + ".png", layout=layout, **visual_style)
-	g.write_graphml(f"{gene}/output/{g['gene']}.graphml")
+def aggregate_results(adapter, incidence, tables, writer):
+	"""
+	Runs results_partial on all tables (see read_results_inputs, then the incidence pairs) at once with --nthread 1,
+	otherwise on chunks of genes in a worker pool, and hands the results tables to writer.
+	:param incidence: the incidence matrix of all genes
+	:return: the summed counts
+	"""
+	global _results_adapter
+	global _results_chunks
+	global _results_incidence
+
+	if args.nthread == 1:
+		# every table is written as soon as results_partial has it
+		return results_partial(adapter, lambda file, parts: writer.submit(file, concat_parts(parts)), incidence, *tables)
+
+	results_step("split_chunks")
+	_results_adapter = adapter
+	# the DEXSeq results are the only table with the gene ID in groupID
+	_results_chunks, bounds = split_by_gene(tables, ["groupID"] + ["GeneID"] * (len(tables) - 1), RESULTS_CHUNKS_PER_THREAD * args.nthread)
+	_results_incidence = [incidence.gene_range(first, last) for first, last in zip([None] + list(bounds), list(bounds) + [None])]
+	del tables
+
+	results_step("aggregate")
+	counts = collections.Counter()
+	chunk_tables = collections.defaultdict(list)
+	with Pool(args.nthread) as p:
+		for chunk_counts, tables in p.imap(results_chunk_task, range(len(_results_chunks))):
+			counts.update(chunk_counts)
+			for file, parts in tables.items():
+				chunk_tables[file].append(parts)
+	_results_chunks = []
+	_results_incidence = []
+
+	# a file made of several parts (e.g. one per event type) lists all chunks' rows of a part before the next part
+	for file, chunks in chunk_tables.items():
+		writer.submit(file, concat_parts([concat_parts([parts[i] for parts in chunks]) for i in range(len(chunks[0]))]))
+	return counts
+
+
+
+# The results tables are handed to a ResultsWriter as soon as each one is final, and the results stage goes on while
+# they are written. Every table is serialised by a process forked for it, which inherits the table instead of receiving
+# a pickled copy, and at most --nthread of them run at once. A table is written to a temporary file next to its
+# destination and renamed once complete, so an interrupted run never leaves a truncated results table behind. With
+# --profile, the bytes and seconds of every table are listed in results/profile/results_tables.txt.
+class ResultsWriter:
+	"""
+	Writes results tables to output_dir in forked processes, at most max_workers at a time.
+	"""
 
-	return 0
+	def __init__(self, output_dir, max_workers):
+		self.output_dir = output_dir
+		self.max_workers = max(1, max_workers)
+		self.running = {}  # {sentinel: process}
+		self.done = multiprocessing.SimpleQueue()
+		self.written = []  # [file, bytes, seconds] of every table written
+		self.errors = []
+
+	def submit(self, file, table, compress=True):
+		"""
+		:param compress: False for the tables that are not compressed with --compress-output
+		"""
+		suffix, compression = output_compression() if compress else ("", None)
+		while len(self.running) >= self.max_workers:
+			self.wait()
+		process = multiprocessing.Process(target=write_table_task, args=(self.done, self.output_dir, file + suffix, table, compression))
+		process.start()
+		self.running[process.sentinel] = process
+
+	def wait(self):
+		# waits for at least one of the running processes to finish
+		for sentinel in multiprocessing.connection.wait(list(self.running)):
+			process = self.running.pop(sentinel)
+			process.join()
+			if process.exitcode != 0:
+				self.errors.append(f"writer process {process.pid} exited with code {process.exitcode}")
+				continue
+			file, size, seconds, error = self.done.get()
+			if error is not None:
+				self.errors.append(f"{file}:\n{error}")
+			else:
+				self.written.append([file, size, seconds])
+
+	def close(self):
+		"""
+		Waits for all tables to be written.
+		:return: list of [file, bytes, seconds]
+		"""
+		while self.running:
+			self.wait()
+		if self.errors:
+			raise RuntimeError("Writing the results tables failed:\n" + "\n".join(self.errors))
+		return self.written
+
+
+
+def write_table_task(done, output_dir, file, table, compression):
+	# runs in the process forked by ResultsWriter.submit, and reports to done with (file, bytes, seconds, error)
+	start = time.perf_counter()
+	path = output_dir + "/" + file
+	tmp_path = f"{path}.tmp.{os.getpid()}"
+	try:
+		table.to_csv(tmp_path, sep='\t', index=False, compression=compression)
+		os.replace(tmp_path, path)
+		done.put((file, os.path.getsize(path), time.perf_counter() - start, None))
+	except Exception:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		done.put((file, 0, time.perf_counter() - start, traceback.format_exc()))
 
 
 
@@ -678,270 +2786,20 @@ def mats_to_dex(file, eventType):
 	return df
 
 
-def filter_df_rmats(input_df, type, level, criteria):
-	df = input_df.copy()
-	df = df[eval(criteria)]
-
-	if type == "Event":
-		if level == "Secondary":
-			df = df.drop_duplicates(subset=["GeneID", "ID"], keep="first")
-			df = df[["GeneID", "ID", "FDR", "DexseqFragment","padj"]]
-		num_events = len(df)
-
-	if type == "Exon":
-		if level == "Secondary":
-			df = df.drop_duplicates(subset=["groupID", "featureID"], keep="first")
-			df = df[["groupID", "featureID", "padj", "rMATS_ID", "FDR"]]
-		num_events = len(df)
 
-	return df, num_events
-
-
-
-def get_grase_results_rmats():
-
-	(output_dir, dexseqResults,
-	A3SS_MATS, A5SS_MATS, SE_MATS, RI_MATS,
-	dex_to_A3SS, dex_to_A5SS, dex_to_SE, dex_to_RI,
-	A3SS_to_dex, A5SS_to_dex, SE_to_dex, RI_to_dex) = get_results_files()
-
-
-	# Exon Counts ###############################################################################
-	dex_to_SE_A5 = pd.merge(dex_to_SE, dex_to_A5SS, how="outer", on=["GeneID", "DexseqFragment"])
-	dex_to_SE_A5_A3 = pd.merge(dex_to_SE_A5, dex_to_A3SS, how="outer", on=["GeneID", "DexseqFragment"])
-	dex_to_rmats = pd.merge(dex_to_SE_A5_A3, dex_to_RI, how="outer", on=["GeneID", "DexseqFragment"])
-	del dex_to_A3SS, dex_to_A5SS, dex_to_SE, dex_to_RI, dex_to_SE_A5, dex_to_SE_A5_A3
-
-	dex_to_rmats["rMATS_ID"] = dex_to_rmats[["rMATS_ID_A3SS", "rMATS_ID_A5SS", "rMATS_ID_SE", "rMATS_ID_RI"]].stack().groupby(level=0).agg(','.join)
-	dex_to_rmats = dex_to_rmats.drop(columns=["rMATS_ID_A3SS", "rMATS_ID_A5SS", "rMATS_ID_SE", "rMATS_ID_RI"])
-
-	dex_to_rmats_dexRes = pd.merge(dexseqResults, dex_to_rmats, how="outer", left_on=["groupID", "featureID"], right_on=["GeneID", "DexseqFragment"])
-	rmatsID_col = dex_to_rmats_dexRes.pop("rMATS_ID")
-	dex_to_rmats_dexRes.insert(2, rmatsID_col.name, rmatsID_col)
-	dex_to_rmats_dexRes["groupID"] = dex_to_rmats_dexRes["groupID"].fillna(dex_to_rmats_dexRes["GeneID"])
-	dex_to_rmats_dexRes["featureID"] = dex_to_rmats_dexRes["featureID"].fillna(dex_to_rmats_dexRes["DexseqFragment"])
-	dex_to_rmats_dexRes = dex_to_rmats_dexRes.drop(columns=["GeneID", "DexseqFragment"])
-	dex_to_rmats_dexRes = dex_to_rmats_dexRes.sort_values(by=["groupID", "featureID"])
-	dex_to_rmats_dexRes = dex_to_rmats_dexRes.reset_index(drop=True)
-	del rmatsID_col
-
-	dex_to_rmats_exploded = dex_to_rmats.copy()
-	dex_to_rmats_exploded["rMATS_ID"] = dex_to_rmats_exploded["rMATS_ID"].str.split(",")
-	dex_to_rmats_exploded = dex_to_rmats_exploded.explode("rMATS_ID")
-	dex_to_rmats_ex_A3 = dex_to_rmats_exploded.merge(A3SS_MATS, how="left",
-	                                                 left_on=["GeneID", "rMATS_ID"],
-	                                                 right_on=["GeneID", "ID"])
-	dex_to_rmats_ex_A5 = dex_to_rmats_exploded.merge(A5SS_MATS, how="left",
-	                                                 left_on=["GeneID", "rMATS_ID"],
-	                                                 right_on=["GeneID", "ID"])
-	dex_to_rmats_ex_SE = dex_to_rmats_exploded.merge(SE_MATS, how="left",
-	                                                 left_on=["GeneID", "rMATS_ID"],
-	                                                 right_on=["GeneID", "ID"])
-	dex_to_rmats_ex_RI = dex_to_rmats_exploded.merge(RI_MATS, how="left",
-	                                                 left_on=["GeneID", "rMATS_ID"],
-	                                                 right_on=["GeneID", "ID"])
-
-	dex_to_rmats_ex_MATS = pd.concat([dex_to_rmats_ex_A3, dex_to_rmats_ex_A5, dex_to_rmats_ex_SE, dex_to_rmats_ex_RI])
-	dex_to_rmats_ex_MATS.dropna(subset="ID.1", inplace=True)
-
-	del dex_to_rmats, dex_to_rmats_ex_A3, dex_to_rmats_ex_A5, dex_to_rmats_ex_SE, dex_to_rmats_ex_RI
-
-	dex_to_rmats_ex_dexRes = dex_to_rmats_dexRes.copy()
-	dex_to_rmats_ex_dexRes["rMATS_ID"] = dex_to_rmats_ex_dexRes["rMATS_ID"].str.split(",")
-	dex_to_rmats_ex_dexRes = dex_to_rmats_ex_dexRes.explode("rMATS_ID")
-	dex_to_rmats_ex_dexRes_MATS = dex_to_rmats_ex_dexRes.merge(dex_to_rmats_ex_MATS, how="left",
-	                                                           left_on=["groupID", "rMATS_ID", "featureID"],
-	                                                           right_on=["GeneID", "rMATS_ID", "DexseqFragment"])
-	dex_to_rmats_ex_dexRes_MATS[["padj", "FDR"]] = dex_to_rmats_ex_dexRes_MATS[["padj", "FDR"]].apply(pd.to_numeric)
-	del dex_to_rmats_ex_dexRes, dex_to_rmats_ex_MATS
-
-	num_exons_detected = len(dex_to_rmats_dexRes)
-
-	### rMATS Detected Exons
-	exon_rmats_detected, num_exons_rmats_detected = filter_df_rmats(dex_to_rmats_ex_dexRes_MATS, "Exon", "Secondary", "df['rMATS_ID'].notna()")
-
-	### rMATS Tested Exons
-	exon_rmats_tested, num_exons_rmats_tested = filter_df_rmats(dex_to_rmats_ex_dexRes_MATS, "Exon", "Secondary", "df['ID.1'].notna()")
-
-	### rMATS Significant Exons
-	exon_rmats_sig, num_exons_rmats_sig = filter_df_rmats(dex_to_rmats_ex_dexRes_MATS, "Exon", "Secondary", "df['FDR'] <= .05")
-
-	### Get DEXSeq Tested Exons Intersected with rMATS Detected, Tested, Significant
-	exon_dex_tested, num_exons_dex_tested = filter_df_rmats(dex_to_rmats_ex_dexRes_MATS, "Exon", "Primary", "df['padj'].notna()")
-	exon_dex_tested_rmats_detected, num_exons_dex_tested_rmats_detected = filter_df_rmats(exon_dex_tested, "Exon", "Secondary", "df['rMATS_ID'].notna()")
-	exon_dex_tested_rmats_tested, num_exons_dex_tested_rmats_tested = filter_df_rmats(exon_dex_tested, "Exon", "Secondary", "df['ID.1'].notna()")
-	exon_dex_tested_rmats_sig, num_exons_dex_tested_rmats_sig = filter_df_rmats(exon_dex_tested, "Exon", "Secondary", "df['FDR'] <= .05")
-	exon_dex_tested = exon_dex_tested.drop_duplicates(subset=["groupID", "featureID"], keep="first")
-	exon_dex_tested = exon_dex_tested[["groupID", "featureID", "padj", "rMATS_ID", "FDR"]]
-	num_exons_dex_tested = len(exon_dex_tested)
-
-	### Get DEXSeq Significant Exons Intersected with rMATS Detected, Tested, Significant
-	exon_dex_sig, num_exons_dex_sig = filter_df_rmats(dex_to_rmats_ex_dexRes_MATS, "Exon", "Primary", "df['padj'] <= .05")
-	exon_dex_sig_rmats_detected, num_exons_dex_sig_rmats_detected = filter_df_rmats(exon_dex_sig, "Exon", "Secondary", "df['rMATS_ID'].notna()")
-	exon_dex_sig_rmats_tested, num_exons_dex_sig_rmats_tested = filter_df_rmats(exon_dex_sig, "Exon", "Secondary", "df['ID.1'].notna()")
-	exon_dex_sig_rmats_sig, num_exons_dex_sig_rmats_sig = filter_df_rmats(exon_dex_sig, "Exon", "Secondary", "df['FDR'] <= .05")
-	exon_dex_sig = exon_dex_sig.drop_duplicates(subset=["groupID", "featureID"], keep="first")
-	exon_dex_sig = exon_dex_sig[["groupID", "featureID", "padj", "rMATS_ID", "FDR"]]
-	num_exons_dex_sig = len(exon_dex_sig)
-
-
-	# Event Counts ##################################################################################
-	rmats_to_dex = pd.concat([A3SS_to_dex, A5SS_to_dex, SE_to_dex, RI_to_dex])
-	rmats_to_dex = rmats_to_dex.sort_values(by=["GeneID", "ID"])
-	rmats_to_dex = rmats_to_dex.reset_index(drop=True)
-	del A3SS_to_dex, A5SS_to_dex, SE_to_dex, RI_to_dex
-
-	rmats_to_dex_A3 = rmats_to_dex.merge(A3SS_MATS, how="left", on=["GeneID", "ID"])
-	rmats_to_dex_A5 = rmats_to_dex.merge(A5SS_MATS, how="left", on=["GeneID", "ID"])
-	rmats_to_dex_SE = rmats_to_dex.merge(SE_MATS, how="left", on=["GeneID", "ID"])
-	rmats_to_dex_RI = rmats_to_dex.merge(RI_MATS, how="left", on=["GeneID", "ID"])
-	del A3SS_MATS, A5SS_MATS, SE_MATS, RI_MATS
-
-	rmats_to_dex_MATS = pd.concat([rmats_to_dex_A3, rmats_to_dex_A5, rmats_to_dex_SE, rmats_to_dex_RI])
-	rmats_to_dex_MATS = rmats_to_dex_MATS.dropna(subset="ID.1")
-	del rmats_to_dex_A3, rmats_to_dex_A5, rmats_to_dex_SE, rmats_to_dex_RI
-
-	rmats_to_dex_exploded = rmats_to_dex.copy()
-	rmats_to_dex_exploded["DexseqFragment"] = rmats_to_dex_exploded["DexseqFragment"].str.split(",")
-	rmats_to_dex_exploded = rmats_to_dex_exploded.explode("DexseqFragment")
-
-	rmats_to_dex_ex_dexRes = rmats_to_dex_exploded.merge(dexseqResults.rename(columns={"groupID":"GeneID", "featureID":"DexseqFragment"}),
-	                                                     how="left", on=["GeneID", "DexseqFragment"])
-	rmats_to_dex_ex_dexRes[["padj"]] = rmats_to_dex_ex_dexRes[["padj"]].apply(pd.to_numeric)
-	del rmats_to_dex_exploded
-
-	rmats_to_dex_ex_MATS = rmats_to_dex_MATS.copy()
-	rmats_to_dex_ex_MATS["DexseqFragment"] = rmats_to_dex_ex_MATS["DexseqFragment"].str.split(",")
-	rmats_to_dex_ex_MATS = rmats_to_dex_ex_MATS.explode("DexseqFragment")
-
-	rmats_to_dex_ex_MATS_dexRes = rmats_to_dex_ex_MATS.merge(rmats_to_dex_ex_dexRes, how="outer", on=["GeneID", "ID", "DexseqFragment"])
-	rmats_to_dex_ex_MATS_dexRes[["padj", "FDR"]] = rmats_to_dex_ex_MATS_dexRes[["padj", "FDR"]].apply(pd.to_numeric)
-
-	num_events_detected = len(rmats_to_dex)
-	del rmats_to_dex, rmats_to_dex_ex_dexRes, rmats_to_dex_ex_MATS
-
-	### DEXSeq Tested Events
-	event_dex_tested, num_events_dex_tested = filter_df_rmats(rmats_to_dex_ex_MATS_dexRes, "Event", "Secondary", "df['padj'].notna()")
-
-	### DEXSeq Significant Events
-	event_dex_sig, num_events_dex_sig = filter_df_rmats(rmats_to_dex_ex_MATS_dexRes, "Event", "Secondary", "df['padj'] <= .05")
-
-	### Get rMATS Tested Events Intersected with DEXSeq Tested, Significant (Detected is just rmats_tested)
-	event_rmats_tested, num_events_rmats_tested = filter_df_rmats(rmats_to_dex_ex_MATS_dexRes, "Event", "Primary", "df['ID.1'].notna()")
-	event_rmats_tested_dex_tested, num_events_rmats_tested_dex_tested = filter_df_rmats(event_rmats_tested, "Event", "Secondary", "df['padj'].notna()")
-	event_rmats_tested_dex_sig, num_events_rmats_tested_dex_sig = filter_df_rmats(event_rmats_tested, "Event", "Secondary", "df['padj'] <= .05")
-	event_rmats_tested = event_rmats_tested.drop_duplicates(subset=["GeneID", "ID"], keep="first")
-	event_rmats_tested = event_rmats_tested[["GeneID", "ID", "FDR", "DexseqFragment","padj"]]
-	num_events_rmats_tested = len(event_rmats_tested)
-
-	### Get rMATS Significant Events Intersected with DEXSeq Tested, Significant (Detected is just rmats_sig)
-	event_rmats_sig, num_events_rmats_sig = filter_df_rmats(rmats_to_dex_ex_MATS_dexRes, "Event", "Primary", "df['FDR'] <= .05")
-	event_rmats_sig_dex_tested, num_events_rmats_sig_dex_tested = filter_df_rmats(event_rmats_sig, "Event", "Secondary", "df['padj'].notna()")
-	event_rmats_sig_dex_sig, num_events_rmats_sig_dex_sig = filter_df_rmats(event_rmats_sig, "Event", "Secondary", "df['padj'] <= .05")
-	event_rmats_sig = event_rmats_sig.drop_duplicates(subset=["GeneID", "ID"], keep="first")
-	event_rmats_sig = event_rmats_sig[["GeneID", "ID", "FDR", "DexseqFragment","padj"]]
-	num_events_rmats_sig = len(event_rmats_sig)
-
-	# output results #############################################################################
-	data = [["Total Exons Detected", num_exons_detected],
-
-	        ["rMATS Detected Exons", num_exons_rmats_detected],
-	        ["rMATS Tested Exons", num_exons_rmats_tested],
-	        ["rMATS Sig Exons", num_exons_rmats_sig],
-
-	        ["DEXSeq Tested Exons", num_exons_dex_tested],
-	        ["DEXSeq Tested & rMATS Detected Exons", num_exons_dex_tested_rmats_detected],
-	        ["DEXSeq Tested & rMATS Tested Exons", num_exons_dex_tested_rmats_tested],
-	        ["DEXSeq Tested & rMATS Sig Exons", num_exons_dex_tested_rmats_sig],
-
-	        ["DEXSeq Sig Exons", num_exons_dex_sig],
-	        ["DEXSeq Sig & rMATS Detected Exons", num_exons_dex_sig_rmats_detected],
-	        ["DEXSeq Sig & rMATS Tested Exons", num_exons_dex_sig_rmats_tested],
-	        ["DEXSeq Sig & rMATS Sig Exons", num_exons_dex_sig_rmats_sig],
-
-	        ["Total Events Detected", num_events_detected],
-
-	        ["DEXSeq Tested Events", num_events_dex_tested],
-	        ["DEXSeq Sig Events", num_events_dex_sig],
-
-	        ["rMATS Tested Events", num_events_rmats_tested],
-	        ["rMATS Tested & DEXSeq Tested Events", num_events_rmats_tested_dex_tested],
-	        ["rMATS Tested & DEXSeq Sig Events", num_events_rmats_tested_dex_sig],
-
-	        ["rMATS Sig Events", num_events_rmats_sig],
-	        ["rMATS Sig & DEXSeq Tested Events", num_events_rmats_sig_dex_tested],
-	        ["rMATS Sig & DEXSeq Sig Events", num_events_rmats_sig_dex_sig]]
-
-	summary_table = pd.DataFrame(data, columns=["CountType", "Counts"])
-	summary_table.to_csv(output_dir + "/summary.txt", sep='\t', index=False)
-
-	intersections = [["DEXSeq Detected Exons Only", num_exons_detected - num_exons_rmats_detected - num_exons_dex_tested + num_exons_dex_tested_rmats_detected],
-	                 ["DEXSeq Detected & rMATS Detected Exons Only", num_exons_rmats_detected - num_exons_dex_tested_rmats_detected - num_exons_rmats_tested + num_exons_dex_tested_rmats_tested],
-	                 ["DEXSeq Detected & rMATS Tested Exons Only", num_exons_rmats_tested - num_exons_dex_tested_rmats_tested - num_exons_rmats_sig + num_exons_dex_tested_rmats_sig],
-	                 ["DEXSeq Detected & rMATS Sig Exons Only", num_exons_rmats_sig - num_exons_dex_tested_rmats_sig],
-
-	                 ["DEXSeq Tested Exons Only", num_exons_dex_tested - num_exons_dex_tested_rmats_detected - num_exons_dex_sig + num_exons_dex_sig_rmats_detected],
-	                 ["DEXSeq Tested & rMATS Detected Exons Only", num_exons_dex_tested_rmats_detected - num_exons_dex_tested_rmats_tested - num_exons_dex_sig_rmats_detected + num_exons_dex_sig_rmats_tested],
-	                 ["DEXSeq Tested & rMATS Tested Exons Only", num_exons_dex_tested_rmats_tested - num_exons_dex_tested_rmats_sig - num_exons_dex_sig_rmats_tested + num_exons_dex_sig_rmats_sig],
-	                 ["DEXSeq Tested & rMATS Sig Exons Only", num_exons_dex_tested_rmats_sig - num_exons_dex_sig_rmats_sig],
-
-	                 ["DEXSeq Sig Exons Only", num_exons_dex_sig - num_exons_dex_sig_rmats_detected],
-	                 ["DEXSeq Sig & rMATS Detected Exons Only", num_exons_dex_sig_rmats_detected - num_exons_dex_sig_rmats_tested],
-	                 ["DEXSeq Sig & rMATS Tested Exons Only", num_exons_dex_sig_rmats_tested - num_exons_dex_sig_rmats_sig],
-	                 ["DEXSeq Sig & rMATS Sig Exons", num_exons_dex_sig_rmats_sig],
-
-	                 ["rMATS Detected Events Only", num_events_detected - num_events_dex_tested - num_events_rmats_tested + num_events_rmats_tested_dex_tested],
-	                 ["rMATS Detected & DEXSeq Tested Events Only", num_events_dex_tested - num_events_dex_sig - num_events_rmats_tested_dex_tested + num_events_rmats_tested_dex_sig],
-	                 ["rMATS Detected & DEXSeq Sig Events Only", num_events_dex_sig - num_events_rmats_tested_dex_sig],
-
-	                 ["rMATS Tested Events Only", num_events_rmats_tested - num_events_rmats_tested_dex_tested - num_events_rmats_sig + num_events_rmats_sig_dex_tested],
-	                 ["rMATS Tested & DEXSeq Tested Events Only", num_events_rmats_tested_dex_tested - num_events_rmats_tested_dex_sig - num_events_rmats_sig_dex_tested + num_events_rmats_sig_dex_sig],
-	                 ["rMATS Tested & DEXSeq Sig Events Only", num_events_rmats_tested_dex_sig - num_events_rmats_sig_dex_sig],
-
-	                 ["rMATS Sig Events Only", num_events_rmats_sig - num_events_rmats_sig_dex_tested],
-	                 ["rMATS Sig & DEXSeq Tested Events Only", num_events_rmats_sig_dex_tested - num_events_rmats_sig_dex_sig],
-	                 ["rMATS Sig & DEXSeq Sig Events Only", num_events_rmats_sig_dex_sig]]
-
-	intersection_table = pd.DataFrame(intersections, columns=["Intersection", "Counts"])
-	intersection_table.to_csv(output_dir + "/intersections.txt", sep='\t', index=False)
-
-	event_rmats_tested.to_csv(output_dir + "/SplicingEvents/rMATS_TestedEvents.txt", sep='\t', index=False)
-	event_rmats_sig.to_csv(output_dir + "/SplicingEvents/rMATS_SigEvents.txt", sep='\t', index=False)
-	event_dex_tested.to_csv(output_dir + "/SplicingEvents/DexTestedEvents.txt", sep='\t', index=False)
-	event_dex_sig.to_csv(output_dir + "/SplicingEvents/DexSigEvents.txt", sep='\t', index=False)
-	event_rmats_tested_dex_tested.to_csv(output_dir + "/SplicingEvents/rMATS_Tested__DexTestedEvents.txt", sep='\t', index=False)
-	event_rmats_tested_dex_sig.to_csv(output_dir + "/SplicingEvents/rMATS_Tested__DexSigEvents.txt", sep='\t', index=False)
-	event_rmats_sig_dex_tested.to_csv(output_dir + "/SplicingEvents/rMATS_Sig__DexTestedEvents.txt", sep='\t', index=False)
-	event_rmats_sig_dex_sig.to_csv(output_dir + "/SplicingEvents/rMATS_Sig__DexSigEvents.txt", sep='\t', index=False)
-
-	exon_dex_tested.to_csv(output_dir + "/ExonParts/DexTestedExons.txt", sep='\t', index=False)
-	exon_dex_sig.to_csv(output_dir + "/ExonParts/DexSigExons.txt", sep='\t', index=False)
-	exon_rmats_detected.to_csv(output_dir + "/ExonParts/rMATS_DetectedExons.txt", sep='\t', index=False)
-	exon_rmats_tested.to_csv(output_dir + "/ExonParts/rMATS_TestedExons.txt", sep='\t', index=False)
-	exon_rmats_sig.to_csv(output_dir + "/ExonParts/rMATS_SigExons.txt", sep='\t', index=False)
-	exon_dex_tested_rmats_detected.to_csv(output_dir + "/ExonParts/DexTested__rMATS_DetectedExons.txt", sep='\t', index=False)
-	exon_dex_tested_rmats_tested.to_csv(output_dir + "/ExonParts/DexTested__rMATS_TestedExons.txt", sep='\t', index=False)
-	exon_dex_tested_rmats_sig.to_csv(output_dir + "/ExonParts/DexTested__rMATS_SigExons.txt", sep='\t', index=False)
-	exon_dex_tested_rmats_detected.to_csv(output_dir + "/ExonParts/DexSig__rMATS_DetectedExons.txt", sep='\t', index=False)
-	exon_dex_tested_rmats_tested.to_csv(output_dir + "/ExonParts/DexSig__rMATS_TestedExons.txt", sep='\t', index=False)
-	exon_dex_tested_rmats_sig.to_csv(output_dir + "/ExonParts/DexSig__rMATS_SigExons.txt", sep='\t', index=False)
-
-	dex_to_rmats_dexRes.to_csv(output_dir + "/DEX_to_rMATS_Events.txt", sep='\t', index=False)
-	rmats_to_dex_MATS.to_csv(output_dir + "/rMATS_to_DEX_Exons.txt", sep='\t', index=False)
-	dex_to_rmats_ex_dexRes_MATS.to_csv(output_dir + "/Mapped.ExonsToEvents.txt", sep='\t', index=False)
-	rmats_to_dex_ex_MATS_dexRes.to_csv(output_dir + "/Mapped.EventsToExons.txt", sep='\t', index=False)
-
-	return 0
+def prefix_lsv_ids(df):
+	# prefixes the LSV IDs of a MAJIQ table with their event type, in place
+	df.loc[df.A5SS == 'True', 'LSV ID'] = "A5SS_" + df['LSV ID']
+	df.loc[df.A3SS == 'True', 'LSV ID'] = "A3SS_" + df['LSV ID']
+	df.loc[df.ES == 'True', 'LSV ID'] = "SE_" + df['LSV ID']
+	df.loc[(df.ES == 'False') & (df.A3SS == 'False') & (df.A5SS == 'False'), 'LSV ID'] = "RI_" + df['LSV ID']
 
 
 
 def convert_majiq_to_dex(file):
 	df = pd.read_table(file, dtype=str)
 	df = df[df["Gene ID"] != "Gene ID"]
-	df.loc[df.A5SS == 'True', 'LSV ID'] = "A5SS_" + df['LSV ID']
-	df.loc[df.A3SS == 'True', 'LSV ID'] = "A3SS_" + df['LSV ID']
-	df.loc[df.ES == 'True', 'LSV ID'] = "SE_" + df['LSV ID']
-	df.loc[(df.ES == 'False') & (df.A3SS == 'False') & (df.A5SS == 'False'), 'LSV ID'] = "RI_" + df['LSV ID']
+	prefix_lsv_ids(df)
 	df = df.rename(columns={"Gene ID": "GeneID", "LSV ID": "LSV_ID"})
 	df = df[["GeneID", "LSV_ID", "DexseqFragment"]]
 	df = df.sort_values(by=["GeneID", "LSV_ID"])
@@ -957,284 +2815,1430 @@ def convert_dex_to_majiq(file):
 
 
 
-def filter_df_majiq(df, type, level, criteria):
-	df = df[eval(criteria)]
+def find_input(directory, suffix):
+	"""
+	:return: the path of the file of directory whose name, without a .gz / .zst extension, ends with suffix
+	"""
+	for file in os.listdir(directory):
+		if strip_compression(file).endswith(suffix):
+			return os.path.join(directory, file)
+	sys.exit(f"No *{suffix} file in {directory}")
+
+
+
+# The results stage is the same for every splicing software. The DEXSeq results are joined with the combined files of
+# the mapping (exonic part -> events and event -> exonic parts) and with the software's results, then the exonic parts
+# are filtered by their DEXSeq level (Tested, Sig) and, within each, by the level of their events, and the events by
+# their level in the software's results and, within each, by the DEXSeq level of their exonic parts. Every filtered
+# table is written to ExonParts / SplicingEvents; its count in summary.txt and intersections.txt is a reduction of the
+# incidence matrix (see incidence_counts), whose pairs also give the events of every exonic part and the exonic parts of
+# every event in the joins. A ResultsAdapter describes a software to this engine: its ID and significance columns, its
+# threshold and how its results and combined files are read. Another splicing software is added with an adapter in
+# RESULTS_ADAPTERS.
+DEXSEQ_PADJ = .05
+DEXSEQ_LEVELS = [("Tested", lambda df: df["padj"].notna()), ("Sig", lambda df: df["padj"] <= DEXSEQ_PADJ)]
+
 
-	if type == "Event":
-		if level == "Secondary":
-			df = df.drop_duplicates(subset=["GeneID", "LSV_ID"], keep="first")
-			df = df[["GeneID", "LSV_ID", "P(|dPSI|>=0.20) per LSV junction", "DexseqFragment", "padj"]]
-		num_events = len(df)
 
-	if type == "Exon":
-		if level == "Secondary":
-			df = df.drop_duplicates(subset=["groupID", "featureID"], keep="first")
-			df = df[["groupID", "featureID", "padj", "LSV_ID", "P(|dPSI|>=0.20) per LSV junction"]]
-		num_events = len(df)
+class ResultsAdapter(abc.ABC):
+	"""
+	The columns, threshold and inputs of a splicing software's results. Its results and combined files are read as one
+	table per event type (event_types), or one table for all types (event type None). The read_* methods are abstract,
+	so an adapter missing one fails when it is created in RESULTS_ADAPTERS.
+	"""
+	# name of the software in the output file names and in summary.txt / intersections.txt
+	name = None
+	event_types = [None]
+	# event ID column of the software's results and of the event -> exonic parts tables
+	event_id = None
+	# column of the comma-joined event IDs of the exonic part -> events tables
+	exon_events_id = None
+	# column that is only set for the events the software tested
+	tested_column = None
+	sig_column = None
+	sig_threshold = None
+	# True if events are significant above sig_threshold, False if below
+	sig_greater = False
+	# True if the software also lists events it did not test, which gives the exonic parts a Detected level
+	detected = False
+
+	@abc.abstractmethod
+	def read_results(self, event_type):
+		"""
+		:return: the software's results table of event_type, with a GeneID column and event IDs as in the combined files
+		"""
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def read_exon_events(self, tmp_dir, event_type):
+		"""
+		:return: the exonic part -> events combined table of event_type (GeneID, DexseqFragment, event IDs)
+		"""
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def read_event_exons(self, tmp_dir, event_type):
+		"""
+		:return: the event -> exonic parts combined table of event_type (GeneID, event ID, DexseqFragment)
+		"""
+		raise NotImplementedError
+
+	def expand(self, df):
+		"""
+		:return: the joined results df, with the software's results split into one row per reported value if needed
+		"""
+		return df
+
+	def significant(self, df):
+		if self.sig_greater:
+			return df[self.sig_column] >= self.sig_threshold
+		return df[self.sig_column] <= self.sig_threshold
+
+	def levels(self, exons=False):
+		"""
+		:return: list of (level, function returning the mask of the rows of a joined table in the level)
+		"""
+		levels = [("Tested", lambda df: df[self.tested_column].notna()), ("Sig", self.significant)]
+		if exons and self.detected:
+			levels.insert(0, ("Detected", lambda df: df[self.exon_events_id].notna()))
+		return levels
+
+
+
+class RmatsResults(ResultsAdapter):
+	name = "rMATS"
+	event_types = ["A3SS", "A5SS", "SE", "RI"]
+	event_id = "ID"
+	exon_events_id = "rMATS_ID"
+	# the second ID column of the *.MATS.JCEC.txt tables, only set once the event is joined with them
+	tested_column = "ID.1"
+	sig_column = "FDR"
+	sig_threshold = .05
+	detected = True
+
+	def read_results(self, event_type):
+		df = read_table(find_input(os.path.abspath(args.rmats_directory), event_type + ".MATS.JCEC.txt"), dtype=str)
+		df["ID"] = event_type + "_" + df["ID"].astype(str)
+		return df
+
+	def read_exon_events(self, tmp_dir, event_type):
+		return dex_to_mats(tmp_dir + "/combined.dexseq." + event_type + ".mapped.txt")
+
+	def read_event_exons(self, tmp_dir, event_type):
+		return mats_to_dex(tmp_dir + "/combined.fromGTF." + event_type + ".txt", event_type)
+
+
+
+class MajiqResults(ResultsAdapter):
+	name = "MAJIQ"
+	event_id = "LSV_ID"
+	exon_events_id = "LSV_ID"
+	tested_column = "LSV_ID"
+	sig_column = "P(|dPSI|>=0.20) per LSV junction"
+	sig_threshold = .9
+	sig_greater = True
+
+	def read_results(self, event_type):
+		df = read_table(find_input(os.path.abspath(args.majiq_directory) + "/majiq_delta_psi", "deltapsi.tsv"), dtype=str, sep='\t')
+		prefix_lsv_ids(df)
+		return df.rename(columns={"Gene ID": "GeneID", "LSV ID": "LSV_ID"})
+
+	def read_exon_events(self, tmp_dir, event_type):
+		return convert_dex_to_majiq(tmp_dir + "/combined.dexseq.majiq.mapped.txt")
+
+	def read_event_exons(self, tmp_dir, event_type):
+		return convert_majiq_to_dex(tmp_dir + "/combined.majiq.deltapsi.mapped.tsv")
+
+	def expand(self, df):
+		# one row per junction of the LSV, the intron retention counting as the last junction
+		coords = df["Junctions coords"].astype(str)
+		df["Junction coords"] = coords.where(df["IR coords"].isna(), coords + ";" + df["IR coords"].astype(str))
+		columns = ["E(dPSI) per LSV junction", "P(|dPSI|>=0.20) per LSV junction", "P(|dPSI|<=0.05) per LSV junction",
+				   "Junction coords"] + [column for column in df.columns if 'E(PSI)' in column]
+		for column in columns:
+			df[column] = df[column].str.split(';')
+		return df.explode(columns)
+
+
+
+RESULTS_ADAPTERS = {'r': RmatsResults(), 'm': MajiqResults()}
+
+
+
+# The inputs of the results stage are read one table per task: the DEXSeq results, and the software's results and both
+# combined files of every event type. The tasks are independent, so with --nthread > 1 they run in a worker pool while
+# the gene pool is no longer using the cores, and the parent gets the parsed tables back in the order of the tasks.
+def read_dexseq_results():
+	dexseqResults = read_table(args.dexseq_results, dtype=str)
+	dexseqResults["padj"] = dexseqResults["padj"].astype(float)
+	return dexseqResults
+
 
-	return df, num_events
 
+def read_input_task(func, func_args):
+	return func(*func_args)
 
 
-def get_grase_results_majiq():
-	(output_dir, dexseqResults, majiq_output, dex_to_majiq, majiq_to_dex) = get_results_files()
 
-	# Exon Counts ###############################################################################
-	dex_to_majiq_dexRes = pd.merge(dexseqResults, dex_to_majiq, how="outer", left_on=["groupID", "featureID"],
-								   right_on=["GeneID", "DexseqFragment"])
-	majiqID_col = dex_to_majiq_dexRes.pop("LSV_ID")
-	dex_to_majiq_dexRes.insert(2, majiqID_col.name, majiqID_col)
-	dex_to_majiq_dexRes["groupID"] = dex_to_majiq_dexRes["groupID"].fillna(dex_to_majiq_dexRes["GeneID"])
-	dex_to_majiq_dexRes["featureID"] = dex_to_majiq_dexRes["featureID"].fillna(dex_to_majiq_dexRes["DexseqFragment"])
-	dex_to_majiq_dexRes = dex_to_majiq_dexRes.drop(columns=["GeneID", "DexseqFragment"])
-	dex_to_majiq_dexRes = dex_to_majiq_dexRes.sort_values(by=["groupID", "featureID"])
-	dex_to_majiq_dexRes = dex_to_majiq_dexRes.reset_index(drop=True)
-	del majiqID_col
-
-	majiq_output.loc[majiq_output.A5SS == 'True', 'LSV ID'] = "A5SS_" + majiq_output['LSV ID']
-	majiq_output.loc[majiq_output.A3SS == 'True', 'LSV ID'] = "A3SS_" + majiq_output['LSV ID']
-	majiq_output.loc[majiq_output.ES == 'True', 'LSV ID'] = "SE_" + majiq_output['LSV ID']
-	majiq_output.loc[(majiq_output.ES == 'False') & (majiq_output.A3SS == 'False') & (majiq_output.A5SS == 'False'), 'LSV ID'] = "RI_" + majiq_output['LSV ID']
-	majiq_output = majiq_output.rename(columns={"Gene ID": "GeneID", "LSV ID": "LSV_ID"})
-
-	dex_to_majiq_exploded = dex_to_majiq.copy()
-	dex_to_majiq_exploded["LSV_ID"] = dex_to_majiq_exploded["LSV_ID"].str.split(",")
-	dex_to_majiq_exploded = dex_to_majiq_exploded.explode("LSV_ID")
-	dex_to_majiq_ex_deltapsi = dex_to_majiq_exploded.merge(majiq_output, how="left",
-													 on=["GeneID", "LSV_ID"])
-
-	dex_to_majiq_ex_deltapsi.dropna(subset=["LSV_ID"], inplace=True)
-
-	dex_to_majiq_ex_dexRes = dex_to_majiq_dexRes.copy()
-	dex_to_majiq_ex_dexRes["LSV_ID"] = dex_to_majiq_ex_dexRes["LSV_ID"].str.split(",")
-	dex_to_majiq_ex_dexRes = dex_to_majiq_ex_dexRes.explode("LSV_ID")
-	dex_to_majiq_ex_dexRes_deltapsi = dex_to_majiq_ex_dexRes.merge(dex_to_majiq_ex_deltapsi, how="left",
-															   left_on=["groupID", "LSV_ID", "featureID"],
-															   right_on=["GeneID", "LSV_ID", "DexseqFragment"])
-
-	dex_to_majiq_ex_dexRes_deltapsi["Junction coords"] = dex_to_majiq_ex_dexRes_deltapsi.apply(lambda row: f"{row['Junctions coords']};{row['IR coords']}" if pd.notna(row['IR coords']) else f"{row['Junctions coords']}", axis=1)
-	dex_to_majiq_ex_dexRes_deltapsi["E(dPSI) per LSV junction"] = dex_to_majiq_ex_dexRes_deltapsi["E(dPSI) per LSV junction"].str.split(';')
-	dex_to_majiq_ex_dexRes_deltapsi["P(|dPSI|>=0.20) per LSV junction"] = dex_to_majiq_ex_dexRes_deltapsi["P(|dPSI|>=0.20) per LSV junction"].str.split(';')
-	dex_to_majiq_ex_dexRes_deltapsi["P(|dPSI|<=0.05) per LSV junction"] = dex_to_majiq_ex_dexRes_deltapsi["P(|dPSI|<=0.05) per LSV junction"].str.split(';')
-	dex_to_majiq_ex_dexRes_deltapsi["Junction coords"] = dex_to_majiq_ex_dexRes_deltapsi["Junction coords"].str.split(';')
-	for item in [col for col in dex_to_majiq_ex_dexRes_deltapsi.columns if 'E(PSI)' in col]:
-		dex_to_majiq_ex_dexRes_deltapsi[item] = dex_to_majiq_ex_dexRes_deltapsi[item].str.split(';')
-	columns_to_explode = ["E(dPSI) per LSV junction",
-		 "P(|dPSI|>=0.20) per LSV junction",
-		 "P(|dPSI|<=0.05) per LSV junction",
-		 "Junction coords"]
-	for item in [col for col in dex_to_majiq_ex_dexRes_deltapsi.columns if 'E(PSI)' in col]:
-		columns_to_explode.append(item)
-	dex_to_majiq_ex_dexRes_deltapsi = dex_to_majiq_ex_dexRes_deltapsi.explode(columns_to_explode)
-	dex_to_majiq_ex_dexRes_deltapsi[["padj", "P(|dPSI|>=0.20) per LSV junction"]] = dex_to_majiq_ex_dexRes_deltapsi[["padj", "P(|dPSI|>=0.20) per LSV junction"]].apply(pd.to_numeric)
-	del dex_to_majiq_ex_dexRes, dex_to_majiq_ex_deltapsi
-
-	num_exons_detected = len(dex_to_majiq_dexRes)
-
-	### MAJIQ Tested Exons
-	exon_majiq_tested, num_exons_majiq_tested = filter_df_majiq(dex_to_majiq_ex_dexRes_deltapsi, "Exon", "Secondary",
-																	"df['LSV_ID'].notna()")
-
-	### MAJIQ Significant Exons
-	exon_majiq_sig, num_exons_majiq_sig = filter_df_majiq(dex_to_majiq_ex_dexRes_deltapsi, "Exon", "Secondary",
-														  "df['P(|dPSI|>=0.20) per LSV junction'] >= .9")
-
-	### Get DEXSeq Tested Exons Intersected with MAJIQ Tested, Significant
-	exon_dex_tested, num_exons_dex_tested = filter_df_majiq(dex_to_majiq_ex_dexRes_deltapsi, "Exon", "Primary",
-															"df['padj'].notna()")
-	#exon_dex_tested_majiq_detected, num_exons_dex_tested_majiq_detected = filter_df_majiq(exon_dex_tested, "Exon", "Secondary",
-	#																					  "df['LSV_ID'].notna()")
-
-	exon_dex_tested_majiq_tested, num_exons_dex_tested_majiq_tested = filter_df_majiq(exon_dex_tested, "Exon",
-																					  "Secondary", "df['LSV_ID'].notna()")
-	exon_dex_tested_majiq_sig, num_exons_dex_tested_majiq_sig = filter_df_majiq(exon_dex_tested, "Exon", "Secondary",
-																				"df['P(|dPSI|>=0.20) per LSV junction'] >= .9")
-	exon_dex_tested = exon_dex_tested.drop_duplicates(subset=["groupID", "featureID"], keep="first")
-	exon_dex_tested = exon_dex_tested[["groupID", "featureID", "padj", "LSV_ID", "P(|dPSI|>=0.20) per LSV junction"]]
-	num_exons_dex_tested = len(exon_dex_tested)
-
-	### Get DEXSeq Significant Exons Intersected with MAJIQ Tested, Significant
-	exon_dex_sig, num_exons_dex_sig = filter_df_majiq(dex_to_majiq_ex_dexRes_deltapsi, "Exon", "Primary",
-													  "df['padj'] <= .05")
-	#exon_dex_sig_majiq_detected, num_exons_dex_sig_majiq_detected = filter_df_majiq(exon_dex_sig, "Exon", "Secondary",
-	#																					"df['LSV_ID'].notna()")
-	exon_dex_sig_majiq_tested, num_exons_dex_sig_majiq_tested = filter_df_majiq(exon_dex_sig, "Exon", "Secondary",
-																				"df['LSV_ID'].notna()")
-	exon_dex_sig_majiq_sig, num_exons_dex_sig_majiq_sig = filter_df_majiq(exon_dex_sig, "Exon", "Secondary",
-																		  "df['P(|dPSI|>=0.20) per LSV junction'] >= .9")
-	exon_dex_sig = exon_dex_sig.drop_duplicates(subset=["groupID", "featureID"], keep="first")
-	exon_dex_sig = exon_dex_sig[["groupID", "featureID", "padj", "LSV_ID", "P(|dPSI|>=0.20) per LSV junction"]]
-	num_exons_dex_sig = len(exon_dex_sig)
+def read_results_inputs(adapter, tmp_dir):
+	"""
+	:return: list of the DEXSeq results, then the software's results, exonic part -> events and event -> exonic parts
+	tables of every event type
+	"""
+	types = adapter.event_types
+	tasks = ([(read_dexseq_results, ())] + [(adapter.read_results, (event_type,)) for event_type in types]
+			 + [(adapter.read_exon_events, (tmp_dir, event_type)) for event_type in types]
+			 + [(adapter.read_event_exons, (tmp_dir, event_type)) for event_type in types])
+	if args.nthread == 1:
+		tables = [func(*func_args) for func, func_args in tasks]
+	else:
+		with Pool(min(args.nthread, len(tasks))) as p:
+			tables = p.starmap(read_input_task, tasks)
+	dexseqResults, results, combined = tables[0], tables[1:1 + len(types)], tables[1 + len(types):]
+
+	if _failed_genes:
+		# genes that failed to map have no rows in the combined files, leave their DEXSeq / splicing results out too
+		dexseqResults = dexseqResults[~dexseqResults["groupID"].isin(_failed_genes)]
+		results = [df[~df["GeneID"].str.strip('"').isin(_failed_genes)] for df in results]
+
+	return [dexseqResults] + results + combined
+
+
+
+def filter_levels(df, primary, secondary, keys, columns):
+	"""
+	Filters df by every primary level, and the rows of every primary level (or all rows) by every secondary level.
+	:param primary: list of (level, mask function), see ResultsAdapter.levels
+	:param keys: the columns identifying an exonic part / event, every table keeps its first row of each
+	:param columns: the columns of the tables
+	:return: {(primary level, secondary level): table}, None standing for all rows
+	"""
+	tables = {}
+	for p, p_mask in [(None, None)] + primary:
+		selected = df if p_mask is None else df[p_mask(df)]
+		for s, s_mask in ([] if p is None else [(None, None)]) + secondary:
+			table = selected if s_mask is None else selected[s_mask(selected)]
+			tables[p, s] = table.drop_duplicates(subset=keys, keep="first")[columns]
+	return tables
+
+
+
+def level_file(primary, secondary, p, s, unit):
+	# e.g. DexSig__rMATS_TestedExons.txt
+	return "__".join(prefix + level for prefix, level in ((primary, p), (secondary, s)) if level) + unit + ".txt"
+
+
+
+def explode_fragments(events, pairs, event_id):
+	"""
+	:param pairs: the (GeneID, DexseqFragment, event ID) pairs of the incidence matrix, by event
+	:return: events with a row per exonic part of every event in place of its comma-joined DexseqFragment, in the order
+	of pairs; events without exonic parts keep their (empty) DexseqFragment
+	"""
+	exploded = events.merge(pairs, how="left", on=["GeneID", event_id], suffixes=("_joined", ""))
+	exploded["DexseqFragment"] = exploded["DexseqFragment"].fillna(exploded.pop("DexseqFragment_joined"))
+	return exploded[events.columns]
+
+
+
+def split_segments(df, segments, num_segments):
+	"""
+	:param segments: the segment number of every index label of df
+	:return: list of the rows of df in each segment
+	"""
+	df_segments = segments.loc[df.index].to_numpy()
+	return [df[df_segments == i] for i in range(num_segments)]
+
 
+
+def results_partial(adapter, emit, incidence, dexseqResults, *tables):
+	"""
+	Joins, filters and counts the results tables of a set of genes: all of them, or a chunk of aggregate_results.
+	:param emit: called with (output file, [tables]) as soon as the tables of an output file are final, [tables] being
+	concatenated in order
+	:param incidence: the incidence matrix of the genes
+	:param tables: the software's results, exonic part -> events and event -> exonic parts tables of every event type,
+	then the pairs of the incidence matrix (see save_incidence)
+	:return: the summary counts of the genes
+	"""
+	n = len(adapter.event_types)
+	results, exon_events, event_exons, pairs = tables[:n], tables[n:2 * n], tables[2 * n:3 * n], tables[3 * n]
+	name = adapter.name
+	event_id = adapter.event_id
+	ids = adapter.exon_events_id
+	tested = adapter.tested_column
+	sig = adapter.sig_column
+
+	results_step("exon_merge")
+	# Exon Counts ###############################################################################
+	dex_to_events = exon_events[0]
+	if n > 1:
+		# one column of event IDs per type, joined into one
+		for df in exon_events[1:]:
+			dex_to_events = pd.merge(dex_to_events, df, how="outer", on=["GeneID", "DexseqFragment"])
+		id_columns = [column for column in dex_to_events.columns if column not in ("GeneID", "DexseqFragment")]
+		dex_to_events[ids] = dex_to_events[id_columns].stack().groupby(level=0).agg(','.join)
+		dex_to_events = dex_to_events.drop(columns=id_columns)
+
+	dex_to_events_dexRes = pd.merge(dexseqResults, dex_to_events, how="outer", left_on=["groupID", "featureID"], right_on=["GeneID", "DexseqFragment"])
+	ids_col = dex_to_events_dexRes.pop(ids)
+	dex_to_events_dexRes.insert(2, ids_col.name, ids_col)
+	dex_to_events_dexRes["groupID"] = dex_to_events_dexRes["groupID"].fillna(dex_to_events_dexRes["GeneID"])
+	dex_to_events_dexRes["featureID"] = dex_to_events_dexRes["featureID"].fillna(dex_to_events_dexRes["DexseqFragment"])
+	dex_to_events_dexRes = dex_to_events_dexRes.drop(columns=["GeneID", "DexseqFragment"])
+	dex_to_events_dexRes = dex_to_events_dexRes.sort_values(by=["groupID", "featureID"])
+	dex_to_events_dexRes = dex_to_events_dexRes.reset_index(drop=True)
+	emit("DEX_to_" + name + "_Events.txt", [dex_to_events_dexRes])
+	del ids_col
+
+	# the events of every exonic part are the incidence matrix's pairs, in the order of its comma-joined events
+	exon_pairs = pairs.sort_values(by=["GeneID", "DexseqFragment", "event_position"], kind="stable")
+	exon_pairs = exon_pairs[["GeneID", "DexseqFragment", event_id]].rename(columns={event_id: ids})
+	pairs = pairs[["GeneID", "DexseqFragment", event_id]]
+	dex_to_events_ex_results = pd.concat([exon_pairs.merge(df, how="left", left_on=["GeneID", ids], right_on=["GeneID", event_id])
+										  for df in results])
+	dex_to_events_ex_results = dex_to_events_ex_results.dropna(subset=[tested])
+	del dex_to_events
+
+	dex_to_events_ex_dexRes = dex_to_events_dexRes.drop(columns=ids).merge(
+		exon_pairs.rename(columns={"GeneID": "groupID", "DexseqFragment": "featureID"}), how="left", on=["groupID", "featureID"])
+	dex_to_events_ex_dexRes = dex_to_events_ex_dexRes[dex_to_events_dexRes.columns]
+	mapped_exons = dex_to_events_ex_dexRes.merge(dex_to_events_ex_results, how="left",
+												 left_on=["groupID", ids, "featureID"],
+												 right_on=["GeneID", ids, "DexseqFragment"])
+	mapped_exons = adapter.expand(mapped_exons)
+	mapped_exons[["padj", sig]] = mapped_exons[["padj", sig]].apply(pd.to_numeric)
+	emit("Mapped.ExonsToEvents.txt", [mapped_exons])
+	del dex_to_events_ex_dexRes, dex_to_events_ex_results
+
+	results_step("exon_filter")
+	exon_tables = filter_levels(mapped_exons, DEXSEQ_LEVELS, adapter.levels(exons=True), ["groupID", "featureID"],
+								["groupID", "featureID", "padj", ids, sig])
+	for (dex, tool), df in exon_tables.items():
+		emit("ExonParts/" + level_file("Dex", name + "_", dex, tool, "Exons"), [df])
+	del dex_to_events_dexRes, mapped_exons, exon_tables
+
+	results_step("event_merge")
 	# Event Counts ##################################################################################
-	majiq_to_dex_exploded = majiq_to_dex.copy()
-	majiq_to_dex_exploded["DexseqFragment"] = majiq_to_dex_exploded["DexseqFragment"].str.split(",")
-	majiq_to_dex_exploded = majiq_to_dex_exploded.explode("DexseqFragment")
-
-	majiq_to_dex_ex_dexRes = majiq_to_dex_exploded.merge(
-		dexseqResults.rename(columns={"groupID": "GeneID", "featureID": "DexseqFragment"}),
-		how="left", on=["GeneID", "DexseqFragment"])
-	majiq_to_dex_ex_dexRes[["padj"]] = majiq_to_dex_ex_dexRes[["padj"]].apply(pd.to_numeric)
-	del majiq_to_dex_exploded
-
-	majiq_to_dex_deltapsi = pd.merge(majiq_to_dex, majiq_output, how="left", on=["GeneID", "LSV_ID"])
-	majiq_to_dex_ex_deltapsi = majiq_to_dex_deltapsi.copy()
-	majiq_to_dex_ex_deltapsi["DexseqFragment"] = majiq_to_dex_ex_deltapsi["DexseqFragment"].str.split(",")
-	majiq_to_dex_ex_deltapsi = majiq_to_dex_ex_deltapsi.explode("DexseqFragment")
-
-	majiq_to_dex_ex_deltapsi_dexRes = majiq_to_dex_ex_deltapsi.merge(majiq_to_dex_ex_dexRes, how="outer",
-															 on=["GeneID", "LSV_ID", "DexseqFragment"])
-
-	majiq_to_dex_ex_deltapsi_dexRes["Junction coords"] = majiq_to_dex_ex_deltapsi_dexRes.apply(
-		lambda row: f"{row['Junctions coords']};{row['IR coords']}" if pd.notna(
-			row['IR coords']) else f"{row['Junctions coords']}", axis=1)
-	majiq_to_dex_ex_deltapsi_dexRes["E(dPSI) per LSV junction"] = majiq_to_dex_ex_deltapsi_dexRes[
-		"E(dPSI) per LSV junction"].str.split(';')
-	majiq_to_dex_ex_deltapsi_dexRes["P(|dPSI|>=0.20) per LSV junction"] = majiq_to_dex_ex_deltapsi_dexRes[
-		"P(|dPSI|>=0.20) per LSV junction"].str.split(';')
-	majiq_to_dex_ex_deltapsi_dexRes["P(|dPSI|<=0.05) per LSV junction"] = majiq_to_dex_ex_deltapsi_dexRes[
-		"P(|dPSI|<=0.05) per LSV junction"].str.split(';')
-	majiq_to_dex_ex_deltapsi_dexRes["Junction coords"] = majiq_to_dex_ex_deltapsi_dexRes["Junction coords"].str.split(
-		';')
-	for item in [col for col in majiq_to_dex_ex_deltapsi_dexRes.columns if 'E(PSI)' in col]:
-		majiq_to_dex_ex_deltapsi_dexRes[item] = majiq_to_dex_ex_deltapsi_dexRes[item].str.split(';')
-	columns_to_explode = ["E(dPSI) per LSV junction",
-						  "P(|dPSI|>=0.20) per LSV junction",
-						  "P(|dPSI|<=0.05) per LSV junction",
-						  "Junction coords"]
-	for item in [col for col in majiq_to_dex_ex_deltapsi_dexRes.columns if 'E(PSI)' in col]:
-		columns_to_explode.append(item)
-	majiq_to_dex_ex_deltapsi_dexRes = majiq_to_dex_ex_deltapsi_dexRes.explode(columns_to_explode)
-
-	majiq_to_dex_ex_deltapsi_dexRes[["padj", "P(|dPSI|>=0.20) per LSV junction"]] = majiq_to_dex_ex_deltapsi_dexRes[
-		["padj", "P(|dPSI|>=0.20) per LSV junction"]].apply(pd.to_numeric)
-
-	num_events_detected = len(majiq_to_dex)
-	del majiq_to_dex, majiq_to_dex_ex_dexRes, majiq_to_dex_ex_deltapsi
-
-	### DEXSeq Tested Events
-	event_dex_tested, num_events_dex_tested = filter_df_majiq(majiq_to_dex_ex_deltapsi_dexRes, "Event", "Secondary",
-															  "df['padj'].notna()")
-
-	### DEXSeq Significant Events
-	event_dex_sig, num_events_dex_sig = filter_df_majiq(majiq_to_dex_ex_deltapsi_dexRes, "Event", "Secondary",
-														"df['padj'] <= .05")
-
-	### Get MAJIQ Tested Events Intersected with DEXSeq Tested, Significant (Detected is just rmats_tested)
-	event_majiq_tested, num_events_majiq_tested = filter_df_majiq(majiq_to_dex_ex_deltapsi_dexRes, "Event", "Primary",
-																  "df['LSV_ID'].notna()")
-	event_majiq_tested_dex_tested, num_events_majiq_tested_dex_tested = filter_df_majiq(event_majiq_tested, "Event",
-																						"Secondary",
-																						"df['padj'].notna()")
-	event_majiq_tested_dex_sig, num_events_majiq_tested_dex_sig = filter_df_majiq(event_majiq_tested, "Event",
-																				  "Secondary", "df['padj'] <= .05")
-	event_majiq_tested = event_majiq_tested.drop_duplicates(subset=["GeneID", "LSV_ID"], keep="first")
-	event_majiq_tested = event_majiq_tested[["GeneID", "LSV_ID", "P(|dPSI|>=0.20) per LSV junction", "DexseqFragment", "padj"]]
-	num_events_majiq_tested = len(event_majiq_tested)
-
-	### Get rMATS Significant Events Intersected with DEXSeq Tested, Significant (Detected is just rmats_sig)
-	event_majiq_sig, num_events_majiq_sig = filter_df_majiq(majiq_to_dex_ex_deltapsi_dexRes, "Event", "Primary",
-															"df['P(|dPSI|>=0.20) per LSV junction'] >= .9")
-	event_majiq_sig_dex_tested, num_events_majiq_sig_dex_tested = filter_df_majiq(event_majiq_sig, "Event", "Secondary",
-																				  "df['padj'].notna()")
-	event_majiq_sig_dex_sig, num_events_majiq_sig_dex_sig = filter_df_majiq(event_majiq_sig, "Event", "Secondary",
-																			"df['padj'] <= .05")
-	event_majiq_sig = event_majiq_sig.drop_duplicates(subset=["GeneID", "LSV_ID"], keep="first")
-	event_majiq_sig = event_majiq_sig[["GeneID", "LSV_ID", "P(|dPSI|>=0.20) per LSV junction", "DexseqFragment", "padj"]]
-	num_events_majiq_sig = len(event_majiq_sig)
+	events_to_dex = pd.concat(event_exons)
+	events_to_dex = events_to_dex.sort_values(by=["GeneID", event_id])
+	events_to_dex = events_to_dex.reset_index(drop=True)
+
+	# {name}_to_DEX_Exons.txt lists the events by type, so the types are kept apart for aggregate_results
+	events_results_parts = [events_to_dex.merge(df, how="left", on=["GeneID", event_id]).dropna(subset=[tested]) for df in results]
+	events_results = pd.concat(events_results_parts)
+	emit(name + "_to_DEX_Exons.txt", events_results_parts)
+
+	events_ex_dexRes = explode_fragments(events_to_dex, pairs, event_id)
+	events_ex_dexRes = events_ex_dexRes.merge(dexseqResults.rename(columns={"groupID": "GeneID", "featureID": "DexseqFragment"}),
+											  how="left", on=["GeneID", "DexseqFragment"])
+	events_ex_dexRes[["padj"]] = events_ex_dexRes[["padj"]].apply(pd.to_numeric)
+
+	events_ex_results = explode_fragments(events_results, pairs, event_id)
+	mapped_events = events_ex_results.merge(events_ex_dexRes, how="outer", on=["GeneID", event_id, "DexseqFragment"])
+	# the outer merge lists the events the software tested by type, then the untested ones; Mapped.EventsToExons.txt and
+	# the event tables filtered from it are kept apart by these segments for aggregate_results
+	if n > 1:
+		segments = mapped_events[event_id].str.split("_").str[0].map({eventType: i for i, eventType in enumerate(adapter.event_types)})
+	else:
+		segments = pd.Series(0, index=mapped_events.index)
+	segments = segments.where(mapped_events[tested].notna(), n)
+	mapped_events = adapter.expand(mapped_events)
+	mapped_events[["padj", sig]] = mapped_events[["padj", sig]].apply(pd.to_numeric)
+	emit("Mapped.EventsToExons.txt", split_segments(mapped_events, segments, n + 1))
+	del events_results, events_results_parts, events_ex_dexRes, events_ex_results
+
+	results_step("event_filter")
+	event_tables = filter_levels(mapped_events, adapter.levels(), DEXSEQ_LEVELS, ["GeneID", event_id],
+								 ["GeneID", event_id, sig, "DexseqFragment", "padj"])
+	for (tool, dex), df in event_tables.items():
+		emit("SplicingEvents/" + level_file(name + "_", "Dex", tool, dex, "Events"), split_segments(df, segments, n + 1))
+	del mapped_events, event_tables
+
+	results_step("counts")
+	return incidence_counts(adapter, incidence, dexseqResults, exon_events, results)
+
 
+
+def level_masks(levels, table, index, size):
+	"""
+	:param levels: list of (level, mask function) evaluated on the rows of table
+	:param index: the column of table with the incidence row (exonic part) or column (event) of each of its rows
+	:param size: the number of incidence rows / columns
+	:return: {level: boolean per incidence row / column, True if any of its rows in table is in the level}
+	"""
+	index = table[index].to_numpy(dtype=np.int64)
+	return {level: np.bincount(index, weights=mask(table).to_numpy(dtype=bool), minlength=size) > 0 for level, mask in levels}
+
+
+
+def count_levels(unit, counted, primary, secondary):
+	"""
+	The counts of the tables of filter_levels: every primary level, and within each (or within all) every secondary level.
+	:param counted: boolean per incidence row / column, True for those counted
+	"""
+	counts = {(unit, None, None): int(counted.sum())}
+	for p in [None] + list(primary):
+		for s in ([] if p is None else [None]) + list(secondary):
+			mask = counted.copy()
+			for level, masks in ((p, primary), (s, secondary)):
+				if level is not None:
+					mask &= masks[level]
+			counts[unit, p, s] = int(mask.sum())
+	return counts
+
+
+
+def incidence_counts(adapter, incidence, dexseqResults, exon_tables, results):
+	"""
+	Counts the exonic parts and events of every level of summary.txt from the incidence matrix: the software's levels
+	of the exonic parts, and the DEXSeq levels of the events, are those of any of their neighbours in the matrix.
+	:param exon_tables: the exonic part -> events tables of every event type
+	:param results: the software's results of every event type
+	:return: {(unit, primary level, secondary level): count}, as the tables of results_partial
+	"""
+	event_id = adapter.event_id
+	# rows that are not exonic parts (MAJIQ's novel_junc) are not counted
+	is_exon = pd.MultiIndex.from_arrays([incidence.exon_gene, incidence.exon_part]).isin(
+		pd.MultiIndex.from_frame(exonic_parts(dexseqResults, exon_tables)))
+	exons = pd.DataFrame({"groupID": incidence.exon_gene, "featureID": incidence.exon_part, "row": np.arange(incidence.shape[0])})
+	exons = exons.merge(dexseqResults, how="left", on=["groupID", "featureID"])
+	exon_levels = level_masks(DEXSEQ_LEVELS, exons, "row", incidence.shape[0])
+
+	# the event ID is also the exonic parts' event column, which every event has (the Detected level)
+	events = pd.DataFrame({"GeneID": incidence.event_gene, event_id: incidence.event_id, "column": np.arange(incidence.shape[1])})
+	events = events.merge(pd.concat(results), how="left", on=["GeneID", event_id])
+	events[adapter.exon_events_id] = events[event_id]
+	events = adapter.expand(events)
+	events[adapter.sig_column] = pd.to_numeric(events[adapter.sig_column])
+	event_levels = level_masks(adapter.levels(exons=True), events, "column", incidence.shape[1])
+
+	counts = count_levels("exons", is_exon, exon_levels,
+						  {level: incidence.exons_with_any(event_levels[level]) for level, _ in adapter.levels(exons=True)})
+	counts.update(count_levels("events", np.ones(incidence.shape[1], dtype=bool), {level: event_levels[level] for level, _ in adapter.levels()},
+							   {level: incidence.events_with_any(exon_levels[level]) for level, _ in DEXSEQ_LEVELS}))
+	return counts
+
+
+
+def write_summary(adapter, n, writer):
+	"""
+	Writes summary.txt and intersections.txt from the summed counts n.
+	"""
 	# output results #############################################################################
-	data = [["Total Exons Detected", num_exons_detected],
-
-			["MAJIQ Tested Exons", num_exons_majiq_tested],
-			["MAJIQ Sig Exons", num_exons_majiq_sig],
-
-			["DEXSeq Tested Exons", num_exons_dex_tested],
-			["DEXSeq Tested & MAJIQ Tested Exons", num_exons_dex_tested_majiq_tested],
-			["DEXSeq Tested & MAJIQ Sig Exons", num_exons_dex_tested_majiq_sig],
-
-			["DEXSeq Sig Exons", num_exons_dex_sig],
-			["DEXSeq Sig & MAJIQ Tested Exons", num_exons_dex_sig_majiq_tested],
-			["DEXSeq Sig & MAJIQ Sig Exons", num_exons_dex_sig_majiq_sig],
-
-			["Total Events Detected", num_events_detected],
-
-			["DEXSeq Tested Events", num_events_dex_tested],
-			["DEXSeq Sig Events", num_events_dex_sig],
-
-			["MAJIQ Sig Events", num_events_majiq_sig],
-			["MAJIQ Sig & DEXSeq Tested Events", num_events_majiq_sig_dex_tested],
-			["MAJIQ Sig & DEXSeq Sig Events", num_events_majiq_sig_dex_sig]]
-
-	summary_table = pd.DataFrame(data, columns=["CountType", "Counts"])
-	summary_table.to_csv(output_dir + "/summary.txt", sep='\t', index=False)
-
-	intersections = [["DEXSeq Detected Exons Only",
-					  num_exons_detected - num_exons_majiq_tested - num_exons_dex_tested + num_exons_dex_tested_majiq_tested],
-					 ["DEXSeq Detected & MAJIQ Tested Exons Only",
-					  num_exons_majiq_tested - num_exons_dex_tested_majiq_tested - num_exons_majiq_sig + num_exons_dex_tested_majiq_sig],
-					 ["DEXSeq Detected & MAJIQ Sig Exons Only", num_exons_majiq_sig - num_exons_dex_tested_majiq_sig],
-
-					 ["DEXSeq Tested Exons Only",
-					  num_exons_dex_tested - num_exons_dex_tested_majiq_tested - num_exons_dex_sig + num_exons_dex_sig_majiq_tested],
-					 ["DEXSeq Tested & MAJIQ Tested Exons Only",
-					  num_exons_dex_tested_majiq_tested - num_exons_dex_tested_majiq_sig - num_exons_dex_sig_majiq_tested + num_exons_dex_sig_majiq_sig],
-					 ["DEXSeq Tested & MAJIQ Sig Exons Only",
-					  num_exons_dex_tested_majiq_sig - num_exons_dex_sig_majiq_sig],
-
-					 ["DEXSeq Sig Exons Only", num_exons_dex_sig - num_exons_dex_sig_majiq_tested],
-					 ["DEXSeq Sig & MAJIQ Tested Exons Only",
-					  num_exons_dex_sig_majiq_tested - num_exons_dex_sig_majiq_sig],
-					 ["DEXSeq Sig & MAJIQ Sig Exons", num_exons_dex_sig_majiq_sig],
-
-					 ["MAJIQ Tested Events Only",
-					  num_events_majiq_tested - num_events_majiq_tested_dex_tested - num_events_majiq_sig + num_events_majiq_sig_dex_tested],
-					 ["MAJIQ Tested & DEXSeq Tested Events Only",
-					  num_events_majiq_tested_dex_tested - num_events_majiq_tested_dex_sig - num_events_majiq_sig_dex_tested + num_events_majiq_sig_dex_sig],
-					 ["MAJIQ Tested & DEXSeq Sig Events Only",
-					  num_events_majiq_tested_dex_sig - num_events_majiq_sig_dex_sig],
-
-					 ["MAJIQ Sig Events Only", num_events_majiq_sig - num_events_majiq_sig_dex_tested],
-					 ["MAJIQ Sig & DEXSeq Tested Events Only",
-					  num_events_majiq_sig_dex_tested - num_events_majiq_sig_dex_sig],
-					 ["MAJIQ Sig & DEXSeq Sig Events Only", num_events_majiq_sig_dex_sig]]
-
-	intersection_table = pd.DataFrame(intersections, columns=["Intersection", "Counts"])
-	intersection_table.to_csv(output_dir + "/intersections.txt", sep='\t', index=False)
-
-	event_majiq_tested.to_csv(output_dir + "/SplicingEvents/MAJIQ_TestedEvents.txt", sep='\t', index=False)
-	event_majiq_sig.to_csv(output_dir + "/SplicingEvents/MAJIQ_SigEvents.txt", sep='\t', index=False)
-	event_dex_tested.to_csv(output_dir + "/SplicingEvents/DexTestedEvents.txt", sep='\t', index=False)
-	event_dex_sig.to_csv(output_dir + "/SplicingEvents/DexSigEvents.txt", sep='\t', index=False)
-	event_majiq_tested_dex_tested.to_csv(output_dir + "/SplicingEvents/MAJIQ_Tested__DexTestedEvents.txt", sep='\t',
-										 index=False)
-	event_majiq_tested_dex_sig.to_csv(output_dir + "/SplicingEvents/MAJIQ_Tested__DexSigEvents.txt", sep='\t',
-									  index=False)
-	event_majiq_sig_dex_tested.to_csv(output_dir + "/SplicingEvents/MAJIQ_Sig__DexTestedEvents.txt", sep='\t',
-									  index=False)
-	event_majiq_sig_dex_sig.to_csv(output_dir + "/SplicingEvents/MAJIQ_Sig__DexSigEvents.txt", sep='\t', index=False)
-
-	exon_dex_tested.to_csv(output_dir + "/ExonParts/DexTestedExons.txt", sep='\t', index=False)
-	exon_dex_sig.to_csv(output_dir + "/ExonParts/DexSigExons.txt", sep='\t', index=False)
-	exon_majiq_tested.to_csv(output_dir + "/ExonParts/MAJIQ_TestedExons.txt", sep='\t', index=False)
-	exon_majiq_sig.to_csv(output_dir + "/ExonParts/MAJIQ_SigExons.txt", sep='\t', index=False)
-	exon_dex_tested_majiq_tested.to_csv(output_dir + "/ExonParts/DexTested__MAJIQ_TestedExons.txt", sep='\t',
-										index=False)
-	exon_dex_tested_majiq_sig.to_csv(output_dir + "/ExonParts/DexTested__MAJIQ_SigExons.txt", sep='\t', index=False)
-	exon_dex_tested_majiq_tested.to_csv(output_dir + "/ExonParts/DexSig__MAJIQ_TestedExons.txt", sep='\t', index=False)
-	exon_dex_sig_majiq_sig.to_csv(output_dir + "/ExonParts/DexSig__MAJIQ_SigExons.txt", sep='\t', index=False)
-
-	dex_to_majiq_dexRes.to_csv(output_dir + "/DEX_to_MAJIQ_Events.txt", sep='\t', index=False)
-	majiq_to_dex_deltapsi.to_csv(output_dir + "/MAJIQ_to_DEX_Exons.txt", sep='\t', index=False)
-	dex_to_majiq_ex_dexRes_deltapsi.to_csv(output_dir + "/Mapped.ExonsToEvents.txt", sep='\t', index=False)
-	majiq_to_dex_ex_deltapsi_dexRes.to_csv(output_dir + "/Mapped.EventsToExons.txt", sep='\t', index=False)
-
-	return 0
+	dex_levels = [level for level, _ in DEXSEQ_LEVELS]
+	# the exonic parts by DEXSeq level, then by the level of their events; the events by the software's level, then by
+	# the DEXSeq level of their exonic parts
+	grids = [("Exons", "DEXSeq", [None] + dex_levels, adapter.name, [None] + [level for level, _ in adapter.levels(exons=True)]),
+			 ("Events", adapter.name, [None] + [level for level, _ in adapter.levels()], "DEXSeq", [None] + dex_levels)]
+	summary = []
+	intersections = []
+	for unit, primary, rows, secondary, columns in grids:
+		count = lambda i, j: n[unit.lower(), rows[i], columns[j]] if i < len(rows) and j < len(columns) else 0
+		for i, p in enumerate(rows):
+			for j, s in enumerate(columns):
+				label = " & ".join(f"{name} {level}" for name, level in ((primary, p), (secondary, s)) if level)
+				summary.append([f"{label} {unit}" if label else f"Total {unit} Detected", count(i, j)])
+
+		# the counts in one cell of the venn diagram only: in the row's level but not the next, and the same for the column
+		first = 0 if unit == "Exons" or adapter.detected else 1
+		for i in range(first, len(rows)):
+			for j, s in enumerate(columns):
+				label = f"{primary} {rows[i] or 'Detected'}" + (f" & {secondary} {s}" if s else "")
+				intersections.append([f"{label} {unit} Only", count(i, j) - count(i, j + 1) - count(i + 1, j) + count(i + 1, j + 1)])
+		if unit == "Exons":
+			# the exonic parts significant in both are not followed by another level
+			intersections[-1][0] = intersections[-1][0].removesuffix(" Only")
+
+	writer.submit("summary.txt", pd.DataFrame(summary, columns=["CountType", "Counts"]), compress=False)
+	writer.submit("intersections.txt", pd.DataFrame(intersections, columns=["Intersection", "Counts"]), compress=False)
+
+
+
+def get_grase_results(adapter):
+	"""
+	Runs the results stage for the splicing software of adapter (see RESULTS_ADAPTERS) on the combined files.
+	"""
+	results_step("read_combined")
+	output_dir = os.path.abspath(os.path.join(args.gene_files_directory, os.pardir)) + "/results"
+	tables = read_results_inputs(adapter, output_dir + "/tmp")
+
+	results_step("incidence")
+	n = len(adapter.event_types)
+	# dexseqResults and the exonic part -> events and event -> exonic parts tables
+	incidence, pairs = save_incidence(output_dir, tables[0], tables[1 + n:1 + 2 * n], tables[1 + 2 * n:], adapter.event_id)
+	tables.append(pairs)
+	del pairs
+
+	writer = ResultsWriter(output_dir, args.nthread)
+	counts = aggregate_results(adapter, incidence, tables, writer)
+	del incidence, tables
+
+	results_step("write_results")
+	write_summary(adapter, counts, writer)
+	written = writer.close()
+	results_step(None)
+
+	slowest = max(written, key=lambda row: row[2])
+	print(f"{len(written)} results tables ({sum(row[1] for row in written) / 1e6:.1f} MB) written to {output_dir}, "
+		  f"slowest: {slowest[0]} ({slowest[2]:.2f}s)\n")
+	return written
+
+
+
+def pack_main(argv):
+	parser = argparse.ArgumentParser(prog="grase.py pack",
+	                                 description='Packs a gene_files directory into a single indexed gene bundle')
+	parser.add_argument('gene_files_directory', help='The gene_files directory created by creatingFilesByGene.sh, or - '
+	                                                 'to read gene_files directories from stdin, one per line')
+	parser.add_argument('bundle', help='The gene bundle to write (e.g. grase_results/gene_files' + BUNDLE_SUFFIX + ')')
+	parser.add_argument('--remove', action='store_true', help='Remove each gene_files directory once it is packed')
+	pack_args = parser.parse_args(argv)
+	if pack_args.gene_files_directory == "-":
+		gene_files_directories = (line.rstrip("\n") for line in sys.stdin if line.strip())
+	else:
+		gene_files_directories = [pack_args.gene_files_directory]
+	pack_gene_files(gene_files_directories, pack_args.bundle, pack_args.remove)
+
+
+
+def unpack_main(argv):
+	parser = argparse.ArgumentParser(prog="grase.py unpack",
+	                                 description='Extracts genes from a gene bundle or from results/' + GENE_OUTPUT_BUNDLE)
+	parser.add_argument('bundle', help='The gene bundle to read')
+	parser.add_argument('output_directory', help='Directory that a sub-directory per extracted gene is written to')
+	parser.add_argument('genes', nargs='*', help='The genes to extract. Default: all genes')
+	unpack_args = parser.parse_args(argv)
+	unpack_gene_bundle(unpack_args.bundle, unpack_args.output_directory, unpack_args.genes)
+
+
+
+def index_main(argv):
+	parser = argparse.ArgumentParser(prog="grase.py index",
+	                                 description='Builds the per-gene byte-offset index (<annotation>' + GENE_INDEX_SUFFIX + ') of genome-wide DEXSeq gff / GTF files')
+	parser.add_argument('annotations', nargs='+', help='Genome-wide non-aggregated DEXSeq gff and / or GTF files')
+	index_args = parser.parse_args(argv)
+	for annotation in index_args.annotations:
+		print(f"{annotation}: {len(load_gene_index(annotation))} genes indexed")
+
+
+
+def graph_differences(expected, built):
+	"""
+	:return: list of the differences between the graph of a .graphml and the one build_splicing_graph built for the
+	gene, comparing the vertex names and their order, and the edges with their attributes and transcripts (not the
+	order of the edges or of the transcript attributes)
+	"""
+	def edges(g):
+		tx_ids = [name for name in g.es.attributes() if name not in ("start", "end", "width", "ex_or_in")]
+		rows = []
+		for e in g.es:
+			coords = tuple(None if e[name] is None or np.isnan(e[name]) else int(e[name]) for name in ("start", "end", "width"))
+			# the R and L edges, added by SG2igraph after the graph is made, have NA transcripts, which R's write_graph
+			# writes as true
+			txs = "" if e["ex_or_in"] == "NA" else ",".join(sorted(tx for tx in tx_ids if e[tx]))
+			rows.append((g.vs[e.source]["name"], g.vs[e.target]["name"], e["ex_or_in"]) + coords + (txs,))
+		return collections.Counter(rows)
+
+	differences = []
+	if expected.vs["name"] != built.vs["name"]:
+		differences.append(f"vertices {','.join(expected.vs['name'])} != {','.join(built.vs['name'])}")
+	expected_edges = edges(expected)
+	built_edges = edges(built)
+	for edge in sorted(expected_edges - built_edges, key=str):
+		differences.append(f"missing edge {edge}")
+	for edge in sorted(built_edges - expected_edges, key=str):
+		differences.append(f"extra edge {edge}")
+	return differences
+
+
+
+def validate_graphs_main(argv):
+	global args
+	parser = argparse.ArgumentParser(prog="grase.py validate-graphs",
+	                                 description='Compares the splicing graphs built from the GTF (--graph-from-gtf) with the .graphml files of SplicingGraphs.igraph.R')
+	parser.add_argument('gene_files_directory', help='The gene_files directory or gene bundle, with the .graphml and .gtf of every gene')
+	parser.add_argument('genes', nargs='*', help='The genes to compare. Default: all genes')
+	parser.add_argument('--gtf', action='store', dest='gtf', help='The genome-wide GTF, if the genes have no .gtf files')
+	parser.add_argument('--max-reported', action='store', dest='max_reported', default=10, type=int,
+	                    help='Number of differences printed per gene. Default: %(default)s')
+	validate_args = parser.parse_args(argv)
+	args = argparse.Namespace(gene_files_directory=validate_args.gene_files_directory, gff=None, gtf=validate_args.gtf)
+
+	num_genes = num_skipped = num_different = 0
+	for gene in validate_args.genes or list_genes():
+		inputs = read_gene_inputs(gene)
+		graphml = next((data for file, data in inputs.items() if file.endswith(".graphml")), None)
+		built = build_splicing_graph(gene, inputs[gene + ".gtf"]) if gene + ".gtf" in inputs else None
+		if graphml is None or built is None:
+			print(f"{gene}: skipped, no {'.graphml' if graphml is None else 'exons in the GTF'}")
+			num_skipped += 1
+			continue
+		num_genes += 1
+		differences = graph_differences(read_graphml(graphml), built)
+		if differences:
+			num_different += 1
+			print(f"{gene}: {len(differences)} differences")
+			for difference in differences[:validate_args.max_reported]:
+				print("\t" + difference)
+	print(f"{num_genes} genes compared, {num_different} with differences, {num_skipped} skipped")
+	if num_different:
+		sys.exit(1)
+
+
+
+def merge_shards(grase_output_dir):
+	"""
+	Combines the outputs of the --shard runs in results/tmp/shard_<i>_of_<N>: the combined files into results/tmp, the
+	gene output bundles into results/gene_output.grase and the failure reports into results. Exits if a shard is
+	missing or did not finish.
+	"""
+	tmp_dir = grase_output_dir + "/results/tmp"
+	shards = {}
+	for directory in os.listdir(tmp_dir):
+		match = re.fullmatch(r"shard_(\d+)_of_(\d+)", directory)
+		if match:
+			shards.setdefault(int(match.group(2)), set()).add(int(match.group(1)))
+	if len(shards) != 1:
+		sys.exit(f"Expected the shards of a single --shard i/N split in {tmp_dir}, found N = {sorted(shards) or 'none'}")
+	num_shards = next(iter(shards))
+	shard_dirs = [f"{tmp_dir}/shard_{i}_of_{num_shards}" for i in range(1, num_shards + 1)]
+	missing = [shard_dir for shard_dir in shard_dirs if not os.path.exists(shard_dir + "/shard.json")]
+	if missing:
+		sys.exit("Shards missing or not finished:\n" + "\n".join(missing))
+
+	for file in os.listdir(tmp_dir):
+		if os.path.isfile(os.path.join(tmp_dir, file)):
+			os.remove(os.path.join(tmp_dir, file))
+	init_combined_files(grase_output_dir)
+	for file in sorted(os.listdir(tmp_dir)):
+		if not file.startswith("combined."):
+			continue
+		with open(os.path.join(tmp_dir, file), "ab") as out:
+			for shard_dir in shard_dirs:
+				with open(os.path.join(shard_dir, file), "rb") as f:
+					# every shard's copy starts with the header row
+					f.readline()
+					shutil.copyfileobj(f, out)
+
+	output_dir = grase_output_dir + "/results/"
+	bundles = [shard_dir + "/" + GENE_OUTPUT_BUNDLE for shard_dir in shard_dirs if os.path.exists(shard_dir + "/" + GENE_OUTPUT_BUNDLE)]
+	if bundles:
+		writer = GeneBundleWriter(output_dir + GENE_OUTPUT_BUNDLE)
+		for bundle_path in bundles:
+			bundle = GeneBundle(bundle_path)
+			for gene in bundle.genes():
+				writer.add(gene, bundle.files(gene))
+		writer.close()
+
+	_failed_genes.clear()
+	for file in ("failed_genes.txt", "failures.log"):
+		if os.path.exists(output_dir + file):
+			os.remove(output_dir + file)
+	for shard_dir in shard_dirs:
+		if os.path.exists(shard_dir + "/failed_genes.txt"):
+			failed = pd.read_table(shard_dir + "/failed_genes.txt", dtype=str)
+			failed.to_csv(output_dir + "failed_genes.txt", sep='\t', index=False, mode='a', header=not os.path.exists(output_dir + "failed_genes.txt"))
+			# the tracebacks stay in failures.log, the results only need the gene ids
+			_failed_genes.update((gene, []) for gene in failed["GeneID"])
+		if os.path.exists(shard_dir + "/failures.log"):
+			with open(shard_dir + "/failures.log", "rb") as f, open(output_dir + "failures.log", "ab") as out:
+				shutil.copyfileobj(f, out)
+	return num_shards
+
+
+
+def merge_main(argv):
+	global args
+	global _profiler
+	args = get_args(argv)
+	if args.shard:
+		sys.exit("merge combines all shards, run it without --shard")
+	grase_output_dir = os.path.abspath(os.path.join(args.gene_files_directory, os.pardir))
+	num_shards = merge_shards(grase_output_dir)
+	print(f"Merged {num_shards} shards.")
+	if _failed_genes:
+		print(f"{len(_failed_genes)} genes failed twice and are left out of the results, see {grase_output_dir}/results/failures.log")
+
+	report = None
+	if args.profile:
+		_profiler = StageProfiler()
+		report = ProfileReport(os.path.join(grase_output_dir, "results", PROFILE_DIR))
+	print("Processing results...\n")
+	process_results(report)
+	print("Done processing results.\n")
+	exit_on_failed_genes()
+
+
+
+# The query index, results/query_index.npz, holds every DEXSeq exonic part and rMATS / MAJIQ event with its
+# coordinates, its padj / FDR (MAJIQ: the highest P(|dPSI|>=0.20) of its junctions) and the IDs mapped to it. Rows are
+# sorted by chromosome and start; chrom_offsets delimit the chromosomes and max_end holds the running maximum of the
+# end coordinates within a chromosome, so the rows overlapping a region are found with two binary searches.
+QUERY_INDEX_FILE = "query_index.npz"
+QUERY_COLUMNS = ["kind", "gene", "id", "chrom", "start", "end", "strand", "stat", "mapped"]
+REGION_PATTERN = re.compile(r"([^:\s]+):([\d,]+)-([\d,]+)(?::([+-]))?")
+
+
+
+def read_gene_gff(gene):
+	# only the gene's DEXSeq gff, without reading the rest of its files
+	if args.gff:
+		return open_gene_index(args.gff).slice(gene) or b""
+	if is_bundle(args.gene_files_directory):
+		files = open_gene_bundle(args.gene_files_directory).files(gene)
+		return b"".join(decompress(file, bytes(data))[1] for file, data in files.items() if strip_compression(file).endswith(".dexseq.gff"))
+	gene_dir = os.path.join(args.gene_files_directory, gene)
+	data = b""
+	for file in os.listdir(gene_dir):
+		if strip_compression(file).endswith(".dexseq.gff"):
+			with open(os.path.join(gene_dir, file), "rb") as f:
+				data += decompress(file, f.read())[1]
+	return data
+
+
+
+def read_exonic_parts():
+	"""
+	:return: DataFrame of the exonic parts of all genes, with their padj
+	"""
+	gff = pd.read_csv(io.BytesIO(b"".join(read_gene_gff(gene) for gene in list_genes())), sep='\t', header=None,
+					  usecols=[0, 2, 3, 4, 6, 8], names=["chrom", "type", "start", "end", "strand", "attributes"], dtype=str)
+	gff = gff[gff["type"] == "exonic_part"]
+	exons = pd.DataFrame({"kind": "exon",
+						  "gene": gff["attributes"].str.extract(r'gene_id "([^"]+)"', expand=False),
+						  "id": "E" + gff["attributes"].str.extract(r'exonic_part_number "([^"]+)"', expand=False),
+						  "chrom": gff["chrom"], "start": gff["start"].astype(np.int64), "end": gff["end"].astype(np.int64),
+						  "strand": gff["strand"]})
+	dexseqResults = read_table(args.dexseq_results, dtype=str, usecols=["groupID", "featureID", "padj"])
+	dexseqResults = dexseqResults.rename(columns={"groupID": "gene", "featureID": "id", "padj": "stat"})
+	return exons.merge(dexseqResults.drop_duplicates(subset=["gene", "id"]), how="left", on=["gene", "id"])
+
+
+
+def read_events(exons):
+	"""
+	:param exons: the exonic parts, whose chromosome and strand are used for MAJIQ tables without them
+	:return: DataFrame of the rMATS / MAJIQ events with their span over all their exons, and FDR (MAJIQ: the highest
+	P(|dPSI|>=0.20) of the LSV's junctions)
+	"""
+	events = []
+	if args.splicing_software == 'r':
+		for eventType in ["A3SS", "A5SS", "SE", "RI"]:
+			for file in os.listdir(args.rmats_directory):
+				if not strip_compression(file).endswith(eventType + ".MATS.JCEC.txt"):
+					continue
+				df = read_table(os.path.join(args.rmats_directory, file), dtype=str)
+				# 0-based starts (exonStart_0base, upstreamES, ...) and ends (exonEnd, upstreamEE, ...) of the event's exons
+				starts = df[[column for column in df.columns if column.endswith(("Start_0base", "ES"))]].astype(np.int64)
+				ends = df[[column for column in df.columns if column.endswith(("End", "EE"))]].astype(np.int64)
+				events.append(pd.DataFrame({"kind": "event", "gene": df["GeneID"].str.strip('"'), "id": eventType + "_" + df["ID"],
+											"chrom": df["chr"], "start": starts.min(axis=1) + 1, "end": ends.max(axis=1),
+											"strand": df["strand"], "stat": df["FDR"]}))
+	elif args.splicing_software == 'm':
+		majiq_dir = os.path.join(args.majiq_directory, "majiq_delta_psi")
+		for file in os.listdir(majiq_dir):
+			if not strip_compression(file).endswith("deltapsi.tsv"):
+				continue
+			df = read_table(os.path.join(majiq_dir, file), dtype=str)
+			prefix_lsv_ids(df)
+			coords = pd.Series("", index=df.index)
+			for column in ("Junctions coords", "IR coords", "Exons coords"):
+				if column in df.columns:
+					coords = coords + ";" + df[column].fillna("")
+			coords = coords.str.extractall(r"(\d+)")[0].astype(np.int64).groupby(level=0)
+			stat = pd.to_numeric(df["P(|dPSI|>=0.20) per LSV junction"].str.split(";").explode(), errors="coerce").groupby(level=0).max()
+			event = pd.DataFrame({"kind": "event", "gene": df["Gene ID"], "id": df["LSV ID"], "start": coords.min(), "end": coords.max(),
+								  "stat": stat})
+			# MAJIQ tables without seqid / strand columns take them from the gene's exonic parts
+			gene_location = exons.drop_duplicates(subset="gene").set_index("gene")
+			event["chrom"] = df["seqid"] if "seqid" in df.columns else event["gene"].map(gene_location["chrom"])
+			event["strand"] = df["strand"] if "strand" in df.columns else event["gene"].map(gene_location["strand"])
+			events.append(event.dropna(subset=["start", "chrom"]))
+	return pd.concat(events)
+
+
+
+def mapped_ids(incidence, kind):
+	"""
+	:return: Series {(gene, id): comma-joined IDs mapped to the exonic part (kind "exon") or event (kind "event")}
+	"""
+	rows = incidence.exon_rows()
+	pairs = pd.DataFrame({"exon_gene": incidence.exon_gene[rows], "exon": incidence.exon_part[rows],
+						  "event_gene": incidence.event_gene[incidence.indices], "event": incidence.event_id[incidence.indices]})
+	if kind == "exon":
+		return pairs.groupby(["exon_gene", "exon"])["event"].agg(",".join)
+	return pairs.groupby(["event_gene", "event"])["exon"].agg(",".join)
+
+
+
+class QueryIndex:
+	"""
+	Interval index over the exonic parts and events of a run (see QUERY_INDEX_FILE).
+	"""
+
+	def __init__(self, columns, chroms, chrom_offsets, max_end):
+		self.columns = columns
+		self.chroms = {chrom: i for i, chrom in enumerate(chroms)}
+		self.chrom_offsets = chrom_offsets
+		self.max_end = max_end
+		self.gene_order = np.argsort(columns["gene"], kind="stable")
+		self.id_order = np.argsort(columns["id"], kind="stable")
+
+	@classmethod
+	def build(cls, grase_output_dir):
+		exons = read_exonic_parts()
+		events = read_events(exons)
+		incidence_path = os.path.join(grase_output_dir, "results", INCIDENCE_FILE)
+		if os.path.exists(incidence_path):
+			incidence = IncidenceMatrix.load(incidence_path)
+			exons["mapped"] = mapped_ids(incidence, "exon").reindex(pd.MultiIndex.from_frame(exons[["gene", "id"]])).to_numpy()
+			events["mapped"] = mapped_ids(incidence, "event").reindex(pd.MultiIndex.from_frame(events[["gene", "id"]])).to_numpy()
+		table = pd.concat([exons, events], ignore_index=True).reindex(columns=QUERY_COLUMNS)
+		table = table.dropna(subset=["chrom", "start", "end"]).sort_values(by=["chrom", "start", "end"], kind="stable")
+		table["stat"] = pd.to_numeric(table["stat"], errors="coerce")
+		columns = {column: table[column].fillna("").to_numpy(dtype=str) for column in ["kind", "gene", "id", "chrom", "strand", "mapped"]}
+		columns["start"] = table["start"].to_numpy(dtype=np.int64)
+		columns["end"] = table["end"].to_numpy(dtype=np.int64)
+		columns["stat"] = table["stat"].to_numpy(dtype=float)
+		chroms, chrom_starts = np.unique(columns["chrom"], return_index=True)
+		chrom_offsets = np.append(chrom_starts, len(table))
+		max_end = np.concatenate([np.maximum.accumulate(columns["end"][chrom_offsets[i]:chrom_offsets[i + 1]])
+								  for i in range(len(chroms))] or [np.zeros(0, dtype=np.int64)])
+		return cls(columns, chroms, chrom_offsets, max_end)
+
+	def save(self, path):
+		with open(path, "wb") as f:
+			np.savez(f, chroms=np.array(list(self.chroms), dtype=str), chrom_offsets=self.chrom_offsets, max_end=self.max_end,
+					 **self.columns)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as data:
+			return cls({column: data[column] for column in QUERY_COLUMNS}, data["chroms"], data["chrom_offsets"], data["max_end"])
+
+	def region(self, chrom, start, end, strand=None):
+		"""
+		:return: the rows overlapping chrom:start-end (1-based, inclusive), on strand if given
+		"""
+		if chrom not in self.chroms:
+			return np.zeros(0, dtype=np.int64)
+		i = self.chroms[chrom]
+		lo, hi = self.chrom_offsets[i], self.chrom_offsets[i + 1]
+		# rows starting after end cannot overlap; before first, every row (and all rows before it) ends before start
+		last = lo + np.searchsorted(self.columns["start"][lo:hi], end, side="right")
+		first = lo + np.searchsorted(self.max_end[lo:hi], start, side="left")
+		rows = np.arange(first, last)
+		rows = rows[self.columns["end"][rows] >= start]
+		if strand:
+			rows = rows[self.columns["strand"][rows] == strand]
+		return rows
+
+	def lookup(self, column, value):
+		order = self.gene_order if column == "gene" else self.id_order
+		values = self.columns[column][order]
+		return np.sort(order[np.searchsorted(values, value, side="left"):np.searchsorted(values, value, side="right")])
+
+	def query(self, term):
+		"""
+		:param term: a region (chr:start-end or chr:start-end:strand), a gene ID, an event ID or gene:exonic part
+		"""
+		match = REGION_PATTERN.fullmatch(term)
+		if match:
+			return self.region(match.group(1), int(match.group(2).replace(",", "")), int(match.group(3).replace(",", "")), match.group(4))
+		rows = self.lookup("gene", term)
+		if not len(rows):
+			rows = self.lookup("id", term)
+		if not len(rows) and ":" in term:
+			gene, exon = term.rsplit(":", 1)
+			rows = self.lookup("gene", gene)
+			rows = rows[self.columns["id"][rows] == exon]
+		return rows
+
+	def rows(self, rows):
+		return pd.DataFrame({column: self.columns[column][rows] for column in QUERY_COLUMNS})
+
+
+
+def read_bed(path):
+	"""
+	:return: list of (name, chrom, start, end, strand) of the regions of a BED file, with 1-based starts
+	"""
+	regions = []
+	with open(path) as f:
+		for line in f:
+			fields = line.rstrip("\n").split("\t")
+			if not line.strip() or fields[0].startswith(("#", "track", "browser")):
+				continue
+			name = fields[3] if len(fields) > 3 else f"{fields[0]}:{int(fields[1]) + 1}-{fields[2]}"
+			strand = fields[5] if len(fields) > 5 and fields[5] in "+-" else None
+			regions.append((name, fields[0], int(fields[1]) + 1, int(fields[2]), strand))
+	return regions
+
+
+
+def load_query_index(grase_output_dir, rebuild=False):
+	"""
+	Loads the query index of a run, building it first if it is missing or older than the DEXSeq results or
+	incidence.npz.
+	"""
+	index_path = os.path.join(grase_output_dir, "results", QUERY_INDEX_FILE)
+	sources = [args.dexseq_results, os.path.join(grase_output_dir, "results", INCIDENCE_FILE)]
+	if (rebuild or not os.path.exists(index_path)
+			or any(os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(index_path) for source in sources)):
+		print(f"Building {index_path}...", file=sys.stderr)
+		index = QueryIndex.build(grase_output_dir)
+		index.save(index_path)
+		return index
+	return QueryIndex.load(index_path)
+
+
+
+def query_main(argv):
+	global args
+	parser = argparse.ArgumentParser(prog="grase.py query", usage="python3 %(prog)s [grase.py arguments] [-q TERM ...] [--bed regions.bed] [--rebuild]",
+	                                 description='Looks up the mapped exonic parts and events of a run by region, gene or ID. Takes the same arguments as the run (-g, -s, --rmats / --majiq, --dexseq, --gff) to build the index on first use')
+	parser.add_argument('-q', action='append', dest='terms', default=[],
+	                    help='A region (chr17:7,661,779-7,687,550, optionally followed by :+ or :-), a gene ID, an event ID or gene:exonic part. Can be repeated')
+	parser.add_argument('--bed', action='store', dest='bed', help='Query every region of a BED file (0-based starts, optional name and strand columns)')
+	parser.add_argument('--rebuild', action='store_true', dest='rebuild', help='Rebuild the index even if it is up to date')
+	query_args, run_argv = parser.parse_known_args(argv)
+	args = get_args(run_argv)
+
+	for annotation in (args.gff, args.gtf):
+		if annotation:
+			open_gene_index(annotation)
+	index = load_query_index(os.path.abspath(os.path.join(args.gene_files_directory, os.pardir)), query_args.rebuild)
+
+	queries = [(term, index.query(term)) for term in query_args.terms]
+	if query_args.bed:
+		queries += [(name, index.region(chrom, start, end, strand)) for name, chrom, start, end, strand in read_bed(query_args.bed)]
+	results = [index.rows(rows).assign(query=term) for term, rows in queries]
+	if results:
+		results = pd.concat(results)
+		results[["query"] + QUERY_COLUMNS].to_csv(sys.stdout, sep='\t', index=False)
+
+
+
+# grase.py serve keeps GrASE running as a local HTTP service, so that small sets of events can be mapped against the
+# same annotation again and again without paying for the start-up, the imports and the parsing of the gene's files on
+# every call. Genes are mapped by --nthread worker processes. Every gene is always sent to the same worker (by a
+# CRC32 of its ID, like --shard), which keeps the gene's parsed graph, gff and event tables in a GeneCache. The cache
+# is bounded by the size of the gene's input files, --cache-mb split evenly between the workers. Each worker copies its
+# cache statistics into a shared array after every gene, so GET /status reads them in the parent without waiting for
+# the tasks queued on the workers.
+SERVE_CACHE_MB = 1024
+SERVE_STATS = ("pid", "genes", "bytes", "max_bytes", "hits", "misses")
+
+_serve_cache = None
+_serve_stats = None
+
+
+
+class GeneCache:
+	"""
+	LRU cache of the parsed inputs of genes, {gene: (graph, gff, events)} as taken by map_gene, bounded by the size of
+	the gene's input files.
+	"""
+
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.genes = collections.OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, gene):
+		if gene in self.genes:
+			self.genes.move_to_end(gene)
+			self.hits += 1
+			return self.genes[gene][0]
+		self.misses += 1
+		inputs = read_gene_inputs(gene)
+		size = sum(len(data) for data in inputs.values())
+		graph, gff, events = split_gene_inputs(inputs)
+		if isinstance(events, dict):
+			events = {eventType: bytes(data) for eventType, data in events.items()}
+		elif events is not None:
+			events = bytes(events)
+		entry = (graph if isinstance(graph, ig.Graph) else read_graphml(graph), bytes(gff), events)
+		self.genes[gene] = (entry, size)
+		self.size += size
+		while self.size > self.max_bytes and len(self.genes) > 1:
+			_, (_, evicted) = self.genes.popitem(last=False)
+			self.size -= evicted
+		return entry
+
+	def full(self):
+		return self.size >= self.max_bytes
+
+	def stats(self):
+		return {"pid": os.getpid(), "genes": len(self.genes), "bytes": self.size, "max_bytes": self.max_bytes,
+				"hits": self.hits, "misses": self.misses}
+
+
+
+def init_serve_worker(max_bytes, stats):
+	global _serve_cache, _serve_stats
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	_serve_cache = GeneCache(max_bytes)
+	_serve_stats = stats
+	publish_serve_stats()
+
+
+
+def publish_serve_stats():
+	stats = _serve_cache.stats()
+	with _serve_stats.get_lock():
+		_serve_stats[:] = [stats[name] for name in SERVE_STATS]
+
+
+
+def read_serve_stats(stats):
+	"""
+	:param stats: the shared array of a serve worker
+	:return: the worker's cache statistics, as GeneCache.stats()
+	"""
+	with stats.get_lock():
+		values = stats[:]
+	return {name: int(value) for name, value in zip(SERVE_STATS, values)}
+
+
+
+def serve_preload_task(genes):
+	# fills the worker's cache with the genes it is sent, until the cache is full
+	for gene in genes:
+		if _serve_cache.full():
+			break
+		try:
+			_serve_cache.get(gene)
+		except Exception:
+			pass
+		publish_serve_stats()
+
+
+
+# The header rows of the event tables of a POST /map request, which the mappers read by column position: the rMATS
+# fromGTF.<event type>.txt tables, and the columns of the MAJIQ deltapsi.tsv table, None for the E(PSI) columns named
+# after the groups of the contrast.
+FROMGTF_HEADERS = {
+	"A3SS": ["ID", "GeneID", "geneSymbol", "chr", "strand", "longExonStart_0base", "longExonEnd", "shortES", "shortEE", "flankingES", "flankingEE"],
+	"A5SS": ["ID", "GeneID", "geneSymbol", "chr", "strand", "longExonStart_0base", "longExonEnd", "shortES", "shortEE", "flankingES", "flankingEE"],
+	"SE": ["ID", "GeneID", "geneSymbol", "chr", "strand", "exonStart_0base", "exonEnd", "upstreamES", "upstreamEE", "downstreamES", "downstreamEE"],
+	"RI": ["ID", "GeneID", "geneSymbol", "chr", "strand", "riExonStart_0base", "riExonEnd", "upstreamES", "upstreamEE", "downstreamES", "downstreamEE"]}
+DELTAPSI_HEADER = ["Gene ID", "LSV ID", "LSV Type", "E(dPSI) per LSV junction", "P(|dPSI|>=0.20) per LSV junction",
+				   "P(|dPSI|<=0.05) per LSV junction", None, None, "A5SS", "A3SS", "ES", "Num. Junctions", "Num. Exons",
+				   "Junctions coords", "IR coords"]
+
+
+
+def check_table_header(name, table, header):
+	"""
+	:return: None if table is text whose first row starts with the columns of header, otherwise the error
+	"""
+	if not isinstance(table, str):
+		return f"{name} must be the table as text"
+	columns = table.split("\n", 1)[0].rstrip("\r").split("\t")
+	matches = [column.endswith("E(PSI)") if expected is None else column == expected
+			   for column, expected in zip(columns, header)]
+	if len(columns) < len(header) or not all(matches):
+		return f"{name} must start with the header row " + "\t".join(expected or "<group> E(PSI)" for expected in header)
+	return None
+
+
+
+def check_request_events(events):
+	"""
+	Checks the events of a POST /map request against the splicing software of the service.
+	:return: None if they can be mapped (or are left out), otherwise the error
+	"""
+	if events is None:
+		return None
+	if args.splicing_software == 'r':
+		if not isinstance(events, dict):
+			return "events must be {event type: fromGTF table} for rMATS"
+		for event_type, table in events.items():
+			if event_type not in FROMGTF_HEADERS:
+				return f"unknown event type {event_type!r}, expected one of {', '.join(FROMGTF_HEADERS)}"
+			error = check_table_header(f"events[{event_type!r}]", table, FROMGTF_HEADERS[event_type])
+			if error is not None:
+				return error
+		return None
+	return check_table_header("events", events, DELTAPSI_HEADER)
+
+
+
+def frame_json(df):
+	return json.loads(df.to_json(orient="split", index=False))
+
+
+
+def serve_map_task(gene, events):
+	"""
+	Maps a gene in a serve worker, with its own event tables or with the ones of the request.
+	:return: (HTTP status, JSON text)
+	"""
+	try:
+		graph, gff, gene_events = _serve_cache.get(gene)
+	except (KeyError, OSError):
+		return 404, json.dumps({"error": f"gene {gene} not found"})
+	except Exception:
+		return 500, json.dumps({"error": traceback.format_exc().strip().splitlines()[-1]})
+	finally:
+		publish_serve_stats()
+	if events is None:
+		events = gene_events
+	elif isinstance(events, dict) != isinstance(gene_events, dict):
+		return 400, json.dumps({"error": "events must be {event type: fromGTF table} for rMATS and a deltapsi table for MAJIQ"})
+
+	try:
+		arm_gene_timeout(gene)
+		result = map_gene(graph, gff, events)
+	except Exception:
+		return 500, json.dumps({"error": traceback.format_exc().strip().splitlines()[-1]})
+	finally:
+		disarm_gene_timeout()
+
+	response = {"gene": gene, "mapped": result.mapped,
+				"tables": {name: frame_json(df) for name, df in result.tables.items()},
+				"combined": {name: frame_json(pd.concat(dfs)) for name, dfs in result.combined.items()}}
+	if result.graph is not None:
+		graph = result.graph
+		edges = graph.get_edge_dataframe()
+		names = graph.vs["name"]
+		edges["source"] = [names[i] for i in edges["source"]]
+		edges["target"] = [names[i] for i in edges["target"]]
+		response["vertices"] = names
+		response["edges"] = json.loads(edges.to_json(orient="records"))
+	return 200, json.dumps(response)
+
+
+
+class ServeHandler(BaseHTTPRequestHandler):
+	"""
+	The endpoints of grase.py serve:
+		- POST /map: {"gene": gene ID, "events": optional event tables, as for map_gene, as text with their header row}
+		- GET /query?q=TERM&q=...: rows of the query index, as for grase.py query
+		- GET /status: the workers' cache statistics
+	"""
+
+	def reply(self, status, body):
+		body = body.encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def address_string(self):
+		return self.client_address[0] if self.client_address else "unix"
+
+	def do_GET(self):
+		url = urlsplit(self.path)
+		if url.path == "/status":
+			stats = [read_serve_stats(stats) for stats in self.server.worker_stats]
+			return self.reply(200, json.dumps({"workers": stats}))
+		if url.path == "/query":
+			try:
+				index = self.server.query_index()
+			except OSError as error:
+				return self.reply(404, json.dumps({"error": f"no results to query: {error}"}))
+			terms = parse_qs(url.query).get("q", [])
+			rows = [index.rows(index.query(term)).assign(query=term) for term in terms]
+			rows = pd.concat(rows)[["query"] + QUERY_COLUMNS] if rows else pd.DataFrame(columns=["query"] + QUERY_COLUMNS)
+			return self.reply(200, rows.to_json(orient="records"))
+		self.reply(404, json.dumps({"error": f"unknown endpoint {url.path}"}))
+
+	def do_POST(self):
+		if urlsplit(self.path).path != "/map":
+			return self.reply(404, json.dumps({"error": f"unknown endpoint {self.path}"}))
+		try:
+			request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+			gene = request["gene"]
+		except (ValueError, KeyError, TypeError):
+			return self.reply(400, json.dumps({"error": 'expected a JSON body {"gene": ..., "events": ...}'}))
+		if not isinstance(gene, str):
+			return self.reply(400, json.dumps({"error": "gene must be a gene ID string"}))
+		if gene not in self.server.genes:
+			# only the genes of gene_files, so that the ID is never a path outside of it
+			return self.reply(404, json.dumps({"error": f"gene {gene} not found"}))
+		error = check_request_events(request.get("events"))
+		if error is not None:
+			return self.reply(400, json.dumps({"error": error}))
+		worker = self.server.workers[zlib.crc32(gene.encode()) % len(self.server.workers)]
+		self.reply(*worker.apply_async(serve_map_task, (gene, request.get("events"))).get())
+
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+
+
+def serve_main(argv):
+	global args
+	parser = argparse.ArgumentParser(prog="grase.py serve", usage="python3 %(prog)s [grase.py arguments] [--port PORT | --socket PATH] [--cache-mb MB] [--preload]",
+	                                 description='Runs GrASE as a local HTTP service mapping events onto the genes of a run (POST /map) and querying its results (GET /query). Takes the same arguments as the run; --nthread sets the number of workers')
+	parser.add_argument('--host', action='store', dest='host', default="127.0.0.1", help='Address to listen on. Default: %(default)s')
+	parser.add_argument('--port', action='store', dest='port', default=8765, type=int, help='Port to listen on. Default: %(default)s')
+	parser.add_argument('--socket', action='store', dest='socket', help='Listen on this Unix socket instead of a port')
+	parser.add_argument('--cache-mb', action='store', dest='cache_mb', default=SERVE_CACHE_MB, type=float,
+	                    help='Size of the input files of the genes kept parsed in memory, over all workers. Default: %(default)s')
+	parser.add_argument('--preload', action='store_true', dest='preload', help='Fill the caches with genes on start-up instead of on first use')
+	serve_args, run_argv = parser.parse_known_args(argv)
+	args = get_args(run_argv)
+	grase_output_dir = os.path.abspath(os.path.join(args.gene_files_directory, os.pardir))
+
+	for annotation in (args.gff, args.gtf):
+		if annotation:
+			open_gene_index(annotation)
+	max_bytes = serve_args.cache_mb * 2 ** 20 / args.nthread
+	genes = list_genes()
+	worker_stats = [multiprocessing.Array("d", len(SERVE_STATS)) for _ in range(args.nthread)]
+	workers = [Pool(1, initializer=init_serve_worker, initargs=(max_bytes, stats)) for stats in worker_stats]
+	if serve_args.preload:
+		worker_genes = [[] for _ in workers]
+		for gene in genes:
+			worker_genes[zlib.crc32(gene.encode()) % len(workers)].append(gene)
+		for worker, preload_genes in zip(workers, worker_genes):
+			worker.apply_async(serve_preload_task, (preload_genes,))
+
+	if serve_args.socket:
+		if os.path.exists(serve_args.socket):
+			os.remove(serve_args.socket)
+		server = UnixHTTPServer(serve_args.socket, ServeHandler)
+		address = serve_args.socket
+	else:
+		server = ThreadingHTTPServer((serve_args.host, serve_args.port), ServeHandler)
+		address = f"http://{serve_args.host}:{server.server_address[1]}"
+	server.workers = workers
+	server.worker_stats = worker_stats
+	server.genes = frozenset(genes)
+	lock = threading.Lock()
+	index = []
+
+	def query_index():
+		# loaded on the first query, as the results may not exist yet when the service starts
+		with lock:
+			if not index:
+				index.append(load_query_index(grase_output_dir))
+			return index[0]
+
+	server.query_index = query_index
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	print(f"Serving {args.gene_files_directory} on {address} with {len(workers)} workers", file=sys.stderr)
+	try:
+		server.serve_forever()
+	except (KeyboardInterrupt, SystemExit):
+		pass
+	finally:
+		server.server_close()
+		for worker in workers:
+			worker.terminate()
+		if serve_args.socket and os.path.exists(serve_args.socket):
+			os.remove(serve_args.socket)
+
+
+
+COMMANDS = {"pack": pack_main, "unpack": unpack_main, "index": index_main, "merge": merge_main, "query": query_main,
+			"serve": serve_main, "validate-graphs": validate_graphs_main}
+
+
+
+def run_gene_pool(genes, report=None):
+	"""
+	Maps genes in a fresh worker pool.
+	:param genes: list of gene ids to map
+	:param report: ProfileReport collecting the genes' profile records with --profile
+	:return: number of genes that had no mappable events, and {gene: traceback} of the genes that failed or timed out
+	"""
+	# each worker has at most one more gene queued behind the one it is mapping
+	slots = threading.BoundedSemaphore(2 * args.nthread)
+	stop = threading.Event()
+	done = threading.Condition()
+	pending = set()
+	failures = {}
+	fatal = []
+	num_skipped = 0
+
+	def finish(gene, mapped, record, error):
+		nonlocal num_skipped
+		with done:
+			if gene not in pending:
+				# a gene whose worker was killed
+				return
+			pending.discard(gene)
+			slots.release()
+			done.notify_all()
+			if error is not None:
+				failures[gene] = error
+				if is_environment_error(error):
+					fatal.append(gene)
+					stop.set()
+				return
+			num_skipped += not mapped
+			if _metrics is not None:
+				_metrics.gene_done(mapped)
+			if report is not None:
+				# inputs are read ahead by the parent's I/O threads, outside of the gene's own wall time
+				wall, cpu = _read_times.pop(gene, (0.0, 0.0))
+				record["stages"]["read_inputs"] = {"wall": wall, "cpu": cpu, "calls": 1, "peak_rss_mb": None}
+				report.add(record)
+
+	def killed(gene, error):
+		finish(gene, False, None, error)
+
+	def submit(task):
+		p.apply_async(process_gene_task, (task,), callback=lambda result: finish(*result),
+					  error_callback=lambda error, gene=task[0]: finish(gene, False, None, "".join(traceback.format_exception(error))))
+
+	def submit_chunks(gene, chunks):
+		# the chunks of a giant gene are mapped by any free workers; once all are back, one worker merges and writes them
+		results = [None] * len(chunks)
+		remaining = [len(chunks)]
+
+		def chunk_done(k, result, error):
+			if error is not None:
+				return finish(gene, False, None, error)
+			with done:
+				if gene not in pending:
+					return
+				results[k] = result
+				remaining[0] -= 1
+				if remaining[0]:
+					return
+			submit((gene, None, results))
+
+		for k, chunk in enumerate(chunks):
+			p.apply_async(map_gene_chunk_task, ((gene, chunk),), callback=lambda result, k=k: chunk_done(k, *result),
+						  error_callback=lambda error, k=k: chunk_done(k, None, "".join(traceback.format_exception(error))))
+
+	if _monitor is not None:
+		_monitor.on_kill = killed
+	p = Pool(args.nthread)
+	try:
+		for task in prefetch_gene_inputs(genes, slots, stop):
+			gene = task[0]
+			with done:
+				pending.add(gene)
+			chunks = split_giant_gene(task[1])
+			if chunks:
+				submit_chunks(gene, chunks)
+			else:
+				submit(task)
+		with done:
+			while pending and not fatal:
+				done.wait()
+	finally:
+		stop.set()
+		if _monitor is not None:
+			_monitor.on_kill = None
+	if fatal:
+		p.terminate()
+		p.join()
+		sys.exit(f"Stopping: {fatal[0]} failed with an error that would fail every gene:\n{failures[fatal[0]]}")
+	if any(error.startswith("GeneTimeout: worker") for error in failures.values()):
+		# the task of a killed worker never completes, so the pool cannot be closed normally
+		p.terminate()
+	else:
+		p.close()
+	p.join()
+	return num_skipped, failures
+
+
+
+def map_genes(genes, report=None):
+	"""
+	Run the per-gene stage over genes in a worker pool, starting from empty combined files in results/tmp. Genes that
+	fail or time out are retried once in a new pool; genes failing again are recorded in _failed_genes and left out
+	of the results.
+	:param genes: list of gene ids to map
+	:param report: ProfileReport collecting the genes' profile records with --profile
+	:return: number of genes that had no mappable events
+	"""
+	remove_files_dir = combined_dir(os.path.abspath(os.path.join(args.gene_files_directory, os.pardir)))
+	os.makedirs(remove_files_dir, exist_ok=True)
+	for file in os.listdir(remove_files_dir):
+		# shard directories of other runs are left alone
+		if os.path.isfile(os.path.join(remove_files_dir, file)):
+			os.remove(os.path.join(remove_files_dir, file))
+	init_combined_files(os.path.abspath(os.path.join(args.gene_files_directory, os.pardir)))
+	_failed_genes.clear()
+
+	num_skipped, failures = run_gene_pool(genes, report)
+	if failures:
+		print(f"{len(failures)} genes failed, retrying them with new workers...")
+		retry_skipped, retry_failures = run_gene_pool(sorted(failures), report)
+		num_skipped += retry_skipped
+		for gene, error in retry_failures.items():
+			_failed_genes[gene] = [failures[gene], error]
+			if _metrics is not None:
+				_metrics.gene_failed()
+	return num_skipped
+
+
+
+def write_failures(output_dir):
+	"""
+	Writes failed_genes.txt, listing the genes left out of the results with their last error, and failures.log with
+	the tracebacks of both attempts, to output_dir (results, or the shard's directory). Stale reports are removed.
+	"""
+	output_dir = output_dir + "/"
+	for file in ("failed_genes.txt", "failures.log"):
+		if os.path.exists(output_dir + file):
+			os.remove(output_dir + file)
+	if not _failed_genes:
+		return
+	rows = [[gene, len(errors), errors[-1].strip().splitlines()[-1]] for gene, errors in sorted(_failed_genes.items())]
+	pd.DataFrame(rows, columns=["GeneID", "Attempts", "Error"]).to_csv(output_dir + "failed_genes.txt", sep='\t', index=False)
+	with open(output_dir + "failures.log", "w") as f:
+		for gene, errors in sorted(_failed_genes.items()):
+			for attempt, error in enumerate(errors, 1):
+				f.write(f"### {gene} (attempt {attempt})\n{error}\n")
+
+
+
+def exit_on_failed_genes():
+	# called once the results are written, so that a partial run is not taken for a complete one
+	if _failed_genes and not args.allow_failed_genes:
+		print(f"{len(_failed_genes)} genes failed and are left out of the results, exiting with status {FAILED_GENES_STATUS} "
+			  f"(use --allow-failed-genes to accept a partial run)", file=sys.stderr)
+		sys.exit(FAILED_GENES_STATUS)
+
+
+
+def process_results(report=None):
+	"""
+	Runs the results stage on the combined files in results/tmp.
+	:param report: ProfileReport the results steps are added to with --profile
+	"""
+	if report is not None:
+		_profiler.begin()
+	written = get_grase_results(RESULTS_ADAPTERS[args.splicing_software])
+	if args.edge_table:
+		results_step("edge_table")
+		grase_output_dir = os.path.abspath(os.path.join(args.gene_files_directory, os.pardir))
+		print(f"Edge table of {write_edge_table(grase_output_dir)} genes written to {grase_output_dir}/results/{EDGE_TABLE_DIR}\n")
+		results_step(None)
+	if graph_viewer_enabled():
+		results_step("graph_viewer")
+		grase_output_dir = os.path.abspath(os.path.join(args.gene_files_directory, os.pardir))
+		print(f"Graphs of {write_graph_viewer(grase_output_dir)} genes written to {grase_output_dir}/results/{GRAPH_VIEWER_DIR}, "
+			  f"open viewer.html there to browse them\n")
+		results_step(None)
+	if report is not None:
+		report.add(_profiler.end(phase="results"))
+		report.add_tables(written)
+		report.close()
+		print(f"Profile written to {report.dir}")
 
 
 
 def main():
 
+	if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+		return COMMANDS[sys.argv[1]](sys.argv[2:])
+
 	global args
 	global gff
 	global fromGTF_A3SS
@@ -1242,31 +4246,87 @@ def main():
 	global fromGTF_SE
 	global fromGTF_RI
 	global delta_psi
+	global _profiler
+	global _metrics
+	global _monitor
+	global _events
 
 	args = get_args()
-
-	genes = os.listdir(args.gene_files_directory)
+	grase_output_dir = os.path.abspath(os.path.join(args.gene_files_directory, os.pardir))
+	check_plotting()
+
+	for annotation in (args.gff, args.gtf):
+		if annotation:
+			open_gene_index(annotation)
+
+	genes = list_genes()
+	output_dir = grase_output_dir + "/results"
+	if args.shard:
+		genes = [gene for gene in genes if in_shard(gene, args.shard)]
+		output_dir = combined_dir(grase_output_dir)
+		os.makedirs(output_dir, exist_ok=True)
+		if os.path.exists(output_dir + "/shard.json"):
+			os.remove(output_dir + "/shard.json")
+		print(f"\nShard {args.shard[0]}/{args.shard[1]}: {len(genes)} genes")
 
 	if args.nthread == 1:
 		print(f"\nProcessing genes (using {args.nthread} thread)...\n")
 	else:
 		print(f"\nProcessing genes (using {args.nthread} threads)...\n")
 
-	remove_files_dir = os.path.join(os.path.abspath(os.path.join(args.gene_files_directory, os.pardir)) + "/results/tmp")
-	for file in os.listdir(remove_files_dir):
-		os.remove(os.path.join(remove_files_dir, file))
-	p = Pool(args.nthread)
-	p.map(process_gene, genes)
-
-	print("Done processing genes.\n")
-	print("Processing results...\n")
-
-	if args.splicing_software == 'r':
-		get_grase_results_rmats()
-	if args.splicing_software == 'm':
-		get_grase_results_majiq()
-
-	print("Done processing results.\n")
+	report = None
+	if args.profile:
+		# created before the pool, so every worker inherits its own profiler
+		_profiler = StageProfiler()
+		report = ProfileReport(os.path.join(output_dir, PROFILE_DIR))
+	if args.gene_timeout > 0 or args.metrics or args.status:
+		# a worker that does not get out of a gene on SIGALRM is killed once the grace period is over too
+		_events = multiprocessing.Queue()
+		_monitor = WorkerMonitor(args.gene_timeout + min(args.gene_timeout, WATCHDOG_GRACE) if args.gene_timeout > 0 else 0)
+		_monitor.start()
+	if args.metrics or args.status:
+		_metrics = RunMetrics(len(genes), grase_output_dir)
+		_metrics.start()
+
+	try:
+		num_skipped = map_genes(genes, report)
+		if num_skipped:
+			print(f"{num_skipped} of {len(genes)} genes had no mappable events, only their DEXSeq exonic parts were written.")
+		write_failures(output_dir)
+		if _failed_genes:
+			print(f"{len(_failed_genes)} of {len(genes)} genes failed twice and are left out of the results, see {output_dir}/failures.log")
+		if _metrics is not None:
+			_metrics.set_phase("pack_outputs")
+		pack_gene_outputs(grase_output_dir)
+		trim_layout_cache()
+
+		print("Done processing genes.\n")
+		if args.shard:
+			# marks the shard as finished for merge_shards
+			write_atomic(output_dir + "/shard.json", json.dumps({"shard": args.shard[0], "shards": args.shard[1], "genes": len(genes),
+																 "skipped": num_skipped, "failed": len(_failed_genes)}) + "\n")
+			if report is not None:
+				report.close()
+				print(f"Profile written to {report.dir}")
+		else:
+			print("Processing results...\n")
+			process_results(report)
+	except BaseException:
+		if _metrics is not None:
+			_metrics.stop("failed")
+		raise
+	finally:
+		if _monitor is not None:
+			_monitor.stop()
+	if _metrics is not None:
+		_metrics.stop()
+
+	if args.shard:
+		print(f"Shard {args.shard[0]}/{args.shard[1]} written to {output_dir}. Once all {args.shard[1]} shards are done, run "
+			  f"'python3 {sys.argv[0]} merge' with the same arguments, without --shard, to process the results.\n")
+	else:
+		print("Done processing results.\n")
+	exit_on_failed_genes()
 
 
 if __name__ == "__main__":